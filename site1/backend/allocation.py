@@ -0,0 +1,84 @@
+"""Room allocation strategies.
+
+RoomService.allocate_room asks the configured strategy to rank the rooms that
+are free for a booking, then locks the best one it can get. A strategy is any
+callable
+
+    strategy(rooms, check_in, check_out) -> rooms, ordered best first
+
+named by dotted path in settings.ROOM_ALLOCATION_STRATEGY. `rooms` is the
+unevaluated queryset of free rooms (RoomRepository.get_available_rooms_by_type)
+and the strategy only adds an ORDER BY, so the ranking runs inside the one
+SELECT TOP 1 that locks the chosen room: no candidate list is loaded into
+Python or sent back as parameters, however many rooms the type has. A
+strategy never decides whether a room is free, so it cannot cause a double
+booking, only a worse calendar.
+
+The default is best_fit. Picking a room at random, as allocate_room used to,
+scatters short stays across the calendar: a week with one night booked in
+each of five rooms cannot take a five-night stay in any of them, and the
+availability check reports the type sold out while most of its nights are
+empty.
+"""
+from __future__ import annotations
+
+from typing import Callable
+
+from django.conf import settings
+from django.db.models import (
+    Case, DateField, IntegerField, OuterRef, QuerySet, Subquery, Value, When,
+)
+from django.db.models.functions import Coalesce
+from django.utils.module_loading import import_string
+
+from data.models.hotel import RoomAssignment
+
+DEFAULT_STRATEGY = 'backend.allocation.best_fit'
+
+
+def best_fit(rooms: QuerySet, check_in, check_out) -> QuerySet:
+    """Rooms whose free gap around the stay is tightest come first.
+
+    A room with bookings on both sides ranks ahead of one with a booking on
+    one side, which ranks ahead of an empty room; within each group, the
+    fewer free days left either side of the stay, the better. Empty rooms are
+    kept for the stays that need them. Ties go to the lower room_id so the
+    choice is repeatable.
+
+    The neighbouring stays are two correlated TOP 1 subqueries per room. The
+    rooms are free, so every active assignment ends by check_in or starts on
+    or after check_out.
+    """
+    active = RoomAssignment.objects.filter(room_id=OuterRef('room_id'), status='active')
+    check_in = Value(check_in, output_field=DateField())
+    check_out = Value(check_out, output_field=DateField())
+    rooms = rooms.annotate(
+        before_end=Subquery(
+            active.filter(check_out__lte=check_in).order_by('-check_out').values('check_out')[:1]
+        ),
+        after_start=Subquery(
+            active.filter(check_in__gte=check_out).order_by('check_in').values('check_in')[:1]
+        ),
+    )
+    open_sides = (
+        Case(When(before_end__isnull=True, then=Value(1)), default=Value(0), output_field=IntegerField())
+        + Case(When(after_start__isnull=True, then=Value(1)), default=Value(0), output_field=IntegerField())
+    )
+    # Free days before plus after the stay, less its length, which is the
+    # same for every room: an open side counts as no days.
+    gap = Coalesce('after_start', check_out) - Coalesce('before_end', check_in)
+    return rooms.order_by(open_sides, gap, 'room_id')
+
+
+def first_fit(rooms: QuerySet, check_in, check_out) -> QuerySet:
+    """Lowest room_id first. No lookups; fills rooms in a fixed order."""
+    return rooms.order_by('room_id')
+
+
+def random_fit(rooms: QuerySet, check_in, check_out) -> QuerySet:
+    """The old behaviour: any free room, uniformly."""
+    return rooms.order_by('?')
+
+
+def get_strategy() -> Callable[..., QuerySet]:
+    return import_string(getattr(settings, 'ROOM_ALLOCATION_STRATEGY', DEFAULT_STRATEGY))
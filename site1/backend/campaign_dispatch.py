@@ -0,0 +1,218 @@
+"""Background sending of email campaigns.
+
+Pressing Send moves a draft to 'sending' (EmailService.queue_campaign) and
+returns; the campaign goes out from here, once that transaction commits, on a
+one-thread pool in the web worker. The job streams active subscribers in id
+order (EmailRepository.iter_active_subscribers), EMAIL_CAMPAIGN_BATCH at a
+time, so its memory does not grow with the list. The campaign is rendered once
+(backend/campaign_render.py); each batch is personalised from that, split
+across EMAIL_CAMPAIGN_CONNECTIONS SMTP connections sent from in parallel, and
+its send log buffered. Every EMAIL_CAMPAIGN_LOG_FLUSH logged recipients, at a
+batch boundary, the log is bulk-inserted and the campaign checkpointed in one
+UPDATE: last_subscriber_id, the live sent/failed counters the campaigns page
+polls, and a heartbeat. The heartbeat is also written at the first batch
+boundary a third of EMAIL_CAMPAIGN_LEASE_SECONDS after the last one, so a
+slow send is never taken for a dead one.
+
+EMAIL_CAMPAIGN_RATE caps messages per second across all connections. SMTP
+relays throttle, then reject, senders that go faster than they allow (Gmail
+is the tightest), and a campaign should not starve transactional mail.
+
+If the worker dies mid-send the heartbeat stops. `manage.py send_campaigns`,
+from cron or by hand, takes over any 'sending' campaign whose heartbeat is
+older than EMAIL_CAMPAIGN_LEASE_SECONDS and carries on after the checkpoint;
+what was sent since the last flush is sent twice. A job that stops on an
+error checkpoints what it finished and gives the campaign up at once, so the
+next send_campaigns resumes it without waiting for the lease.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from threading import Lock
+from typing import Iterable, Iterator, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from data.repos.repositories import EmailRepository
+
+logger = logging.getLogger(__name__)
+
+
+def batch_size() -> int:
+    return getattr(settings, 'EMAIL_CAMPAIGN_BATCH', 100)
+
+
+def log_flush_size() -> int:
+    return getattr(settings, 'EMAIL_CAMPAIGN_LOG_FLUSH', 300)
+
+
+def lease_seconds() -> int:
+    return getattr(settings, 'EMAIL_CAMPAIGN_LEASE_SECONDS', 300)
+
+
+class RateLimiter:
+    """At most `rate` messages a second, shared by every sending thread. A
+    rate of 0 or less means no limit."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def throttle(self, messages: Iterable) -> Iterator:
+        for msg in messages:
+            self.wait()
+            yield msg
+
+
+def _batches(rows: Iterable, size: int) -> Iterator[list]:
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _send_batch(messages, smtp_connections, pool, limiter):
+    """Send one batch, spread round-robin over the connections. Returns
+    (Message-ID, error) per message, in order."""
+    from backend.email_providers import send_many
+
+    lanes = len(smtp_connections)
+    futures = [
+        pool.submit(send_many, limiter.throttle(messages[lane::lanes]), smtp_connections[lane])
+        for lane in range(lanes)
+    ]
+    results = [None] * len(messages)
+    for lane, future in enumerate(futures):
+        results[lane::lanes] = future.result()
+    return results
+
+
+def dispatch(campaign_id: int) -> Optional[Tuple[int, int]]:
+    """Send a 'sending' campaign from its checkpoint to the end. Returns
+    (sent, failed) for this run, or None if it is not sending or another
+    job holds it."""
+    from django.core.mail import get_connection
+
+    from backend.services.services import EmailService
+
+    if not EmailRepository.claim_campaign(campaign_id, lease_seconds()):
+        return None
+    campaign = EmailRepository.get_campaign(campaign_id)
+    renderer = EmailService.campaign_renderer(campaign)
+    after = campaign.last_subscriber_id
+    total_sent = total_failed = 0
+
+    lanes = max(1, getattr(settings, 'EMAIL_CAMPAIGN_CONNECTIONS', 2))
+    # Well inside the lease, so send_campaigns never mistakes this job for
+    # a dead one between flushes.
+    log = EmailRepository.campaign_log(campaign.id, log_flush_size(), lease_seconds() / 3)
+    rate = getattr(settings, 'EMAIL_CAMPAIGN_RATE', 10)
+    if rate > 0 and batch_size() / rate > lease_seconds() / 3:
+        # The heartbeat is only written between batches.
+        logger.warning(
+            "Campaign %s: a batch of %s at %s/s takes longer than a third of "
+            "EMAIL_CAMPAIGN_LEASE_SECONDS (%s); raise the lease or shrink the batch",
+            campaign.id, batch_size(), rate, lease_seconds(),
+        )
+    limiter = RateLimiter(rate)
+    smtp_connections = [get_connection(fail_silently=False) for _ in range(lanes)]
+    try:
+        with ThreadPoolExecutor(max_workers=lanes, thread_name_prefix='email-campaign-smtp') as pool:
+            subscribers_from = EmailRepository.iter_active_subscribers(after, batch_size())
+            for subscribers in _batches(subscribers_from, batch_size()):
+                batch, messages = [], []
+                for sub in subscribers:
+                    try:
+                        messages.append(renderer.message(sub))
+                        batch.append(sub)
+                    except Exception as exc:
+                        logger.exception("Campaign %s render for %s failed", campaign.id, sub.email)
+                        log.add(EmailService.campaign_log_row(campaign, sub, error=exc))
+                        total_failed += 1
+
+                try:
+                    results = _send_batch(messages, smtp_connections, pool, limiter)
+                except Exception as exc:
+                    # Not one message's failure: the whole batch is logged
+                    # failed, for the retry engine, and the send goes on.
+                    logger.exception("Campaign %s batch after subscriber %s failed", campaign.id, after)
+                    results = [(None, exc)] * len(batch)
+                for sub, (msg_id, error) in zip(batch, results):
+                    if error is not None:
+                        logger.error("Campaign %s send to %s failed: %s", campaign.id, sub.email, error)
+                        total_failed += 1
+                    else:
+                        total_sent += 1
+                    log.add(EmailService.campaign_log_row(campaign, sub, msg_id=msg_id, error=error))
+
+                after = subscribers[-1].id
+                if not log.checkpoint(after):
+                    logger.info("Campaign %s is no longer sending; stopping", campaign.id)
+                    return total_sent, total_failed
+        if not log.flush():
+            logger.info("Campaign %s is no longer sending; stopping", campaign.id)
+            return total_sent, total_failed
+    except Exception:
+        # Keep the finished batches, so a resumed send starts after them,
+        # and give the campaign up now rather than when its lease runs out.
+        try:
+            log.flush()
+            EmailRepository.release_campaign(campaign.id)
+        except Exception:
+            logger.exception("Campaign %s: could not checkpoint the send", campaign.id)
+        raise
+    finally:
+        for smtp in smtp_connections:
+            smtp.close()
+
+    EmailRepository.mark_campaign_sent(campaign.id)
+    logger.info("Campaign %s sent: %s delivered, %s failed", campaign.id, total_sent, total_failed)
+    return total_sent, total_failed
+
+
+# ---------------- in-process dispatch ----------------
+
+_executor = None
+_executor_lock = Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # One campaign at a time per process; each already sends over
+            # several connections.
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='email-campaign')
+        return _executor
+
+
+def _run(campaign_id: int) -> None:
+    close_old_connections()
+    try:
+        dispatch(campaign_id)
+    except Exception:
+        logger.exception("Campaign %s dispatch failed; send_campaigns will resume it", campaign_id)
+    finally:
+        connection.close()
+
+
+def dispatch_on_commit(campaign_id: int) -> None:
+    """Send the campaign once the transaction that started it commits."""
+    transaction.on_commit(lambda: _get_executor().submit(_run, campaign_id))
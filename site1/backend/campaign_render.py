@@ -0,0 +1,97 @@
+"""Render a campaign once, then personalise it per recipient.
+
+Rendering email/campaign.html per subscriber cost a template render and a
+get_hotel_info query each, yet only the unsubscribe link (and, where a
+template uses them, the subscriber's name and address) differs between
+recipients. CampaignRenderer renders the HTML and text bodies once with a
+marker in each of those places, then builds every recipient's message by
+substituting their values into the markers: HTML-escaped in the HTML body,
+as-is in an admin-written text body.
+
+A marker only stands for its value where the template prints it as it is.
+One passed through a filter that changes it (|upper, |truncatechars), or
+tested in an {% if %}, would not come out the same as a per-recipient
+render; campaign templates should keep personal fields to plain output.
+"""
+from __future__ import annotations
+
+import re
+import secrets
+from types import SimpleNamespace
+from typing import Callable, Dict, Optional, Tuple
+
+from django.utils.html import escape, strip_tags
+
+# Per-recipient values, by the name their marker stands for.
+SLOTS = ('unsubscribe_url', 'name', 'email')
+
+
+class CampaignRenderer:
+    """One campaign's bodies, rendered on first use. `render(context)`
+    renders the HTML body; `context` is everything but the per-recipient
+    values, which the renderer adds as markers."""
+
+    def __init__(self, campaign, context: Dict, render: Callable[[Dict], str],
+                 unsubscribe_url: Callable[[str], str]):
+        self.campaign = campaign
+        self._context = context
+        self._render = render
+        self._unsubscribe_url = unsubscribe_url
+        # Letters and digits only, so escaping leaves a marker intact, and a
+        # fresh nonce, so no admin-authored text can collide with one.
+        nonce = secrets.token_hex(8)
+        self._markers = {slot: f'campaignslot{nonce}{slot}' for slot in SLOTS}
+        self._pattern = re.compile('|'.join(re.escape(m) for m in self._markers.values()))
+        self._slot_for = {marker: slot for slot, marker in self._markers.items()}
+        self._bodies: Optional[Tuple[str, str, bool]] = None
+        self._error: Optional[Exception] = None
+
+    def bodies(self) -> Tuple[str, str, bool]:
+        """(html, text, text_is_html) with markers in place of the
+        per-recipient values. Raises, every time, if the render failed."""
+        if self._error is not None:
+            raise self._error
+        if self._bodies is None:
+            context = dict(self._context)
+            context['unsubscribe_url'] = self._markers['unsubscribe_url']
+            context['subscriber'] = SimpleNamespace(
+                name=self._markers['name'], email=self._markers['email'],
+            )
+            try:
+                html = self._render(context)
+            except Exception as exc:
+                self._error = exc
+                raise
+            if self.campaign.body_text:
+                self._bodies = (html, self.campaign.body_text, False)
+            else:
+                # What build_message would otherwise derive per recipient.
+                # It keeps the HTML's entities, so substitute escaped.
+                self._bodies = (html, strip_tags(html), True)
+        return self._bodies
+
+    def values(self, subscriber) -> Dict[str, str]:
+        return {
+            'unsubscribe_url': self._unsubscribe_url(subscriber.unsubscribe_token),
+            'name': subscriber.name or '',
+            'email': subscriber.email,
+        }
+
+    def _fill(self, template: str, values: Dict[str, str], escaped: bool) -> str:
+        if escaped:
+            values = {slot: escape(value) for slot, value in values.items()}
+        return self._pattern.sub(lambda m: values[self._slot_for[m.group(0)]], template)
+
+    def message(self, subscriber):
+        """The campaign as sent to `subscriber`."""
+        from backend.email_providers import build_message
+
+        html, text, text_is_html = self.bodies()
+        values = self.values(subscriber)
+        return build_message(
+            to=[subscriber.email],
+            subject=self.campaign.subject,
+            html_body=self._fill(html, values, escaped=True),
+            text_body=self._fill(text, values, escaped=text_is_html),
+            headers={'List-Unsubscribe': f"<{values['unsubscribe_url']}>"},
+        )
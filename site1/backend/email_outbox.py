@@ -0,0 +1,175 @@
+"""The email outbox: sends what EmailService queued in email_queue.
+
+EmailService._send renders a message, inserts it as a 'pending' row and
+returns, so no request waits on SMTP. Rows are sent from here, by either
+
+  - `manage.py run_email_worker`, a long-running process that polls the
+    outbox, or
+  - a one-thread pool inside each web worker, woken once the transaction that
+    queued a message commits (EMAIL_OUTBOX_IN_PROCESS, on by default), so
+    mail still goes out promptly where no worker process is deployed.
+
+Both drain through EmailRepository.claim_outbox, which skips rows another
+drainer holds, so any number of them can run at once. A send that fails goes
+back to pending with an exponential delay, and to failed after
+EMAIL_MAX_ATTEMPTS tries, where `manage.py retry_failed_emails`
+(backend/email_retry.py) carries on until EMAIL_DEAD_LETTER_ATTEMPTS.
+
+With the console backend (the default when no SMTP password is configured)
+the worker prints each message instead, which is enough to watch the outbox
+work locally.
+"""
+from __future__ import annotations
+
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from threading import Lock
+from typing import Tuple
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from data.repos.repositories import EmailRepository
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+
+
+def max_attempts() -> int:
+    return getattr(settings, 'EMAIL_MAX_ATTEMPTS', 5)
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """Delay before the next try after `attempts` failed ones: the base
+    delay, doubled per attempt, capped."""
+    base = getattr(settings, 'EMAIL_RETRY_BASE_SECONDS', 60)
+    cap = getattr(settings, 'EMAIL_RETRY_MAX_SECONDS', 6 * 60 * 60)
+    return timedelta(seconds=min(base * 2 ** max(attempts - 1, 0), cap))
+
+
+class NothingToSend(Exception):
+    """The row stores no body. Sending it would deliver a blank email."""
+
+
+def row_message(row):
+    """The message a row stores, ready to send. Raises NothingToSend for a
+    row without one, such as a campaign log row."""
+    from backend.email_providers import build_message
+    if not row.body_html and not row.body_text:
+        raise NothingToSend('no stored message to send')
+    return build_message(
+        to=[row.to_email],
+        subject=row.subject,
+        html_body=row.body_html or '',
+        text_body=row.body_text or None,
+        headers=json.loads(row.headers) if row.headers else None,
+    )
+
+
+def record(row, msg_id, error) -> bool:
+    """Record the outcome of sending a claimed row. Returns True if sent."""
+    if error is None:
+        EmailRepository.mark_outbox_sent(row.id, provider_msg_id=msg_id)
+        return True
+    if isinstance(error, NothingToSend):
+        logger.error("Email #%s has nothing to send; dead-lettered", row.id)
+        EmailRepository.mark_outbox_dead(row.id, error)
+        return False
+    if row.attempts >= max_attempts():
+        logger.error("Email #%s failed after %s attempts: %s", row.id, row.attempts, error)
+        # Over to retry_failed_emails, on the same backoff.
+        EmailRepository.mark_outbox_failed(
+            row.id, error, timezone.now() + retry_delay(row.attempts),
+        )
+    else:
+        logger.warning("Email #%s attempt %s failed: %s", row.id, row.attempts, error)
+        EmailRepository.mark_outbox_retry(
+            row.id, error, timezone.now() + retry_delay(row.attempts),
+        )
+    return False
+
+
+def drain(batch_size: int = BATCH_SIZE) -> Tuple[int, int]:
+    """Send everything that is due, over one SMTP connection. Returns (sent,
+    not sent)."""
+    from django.core.mail import get_connection
+
+    from backend.email_providers import send_many
+
+    lease = getattr(settings, 'EMAIL_SEND_LEASE_SECONDS', 600)
+    sent = unsent = 0
+    smtp = None
+    try:
+        while True:
+            rows = EmailRepository.claim_outbox(batch_size, lease)
+            if not rows:
+                return sent, unsent
+            if smtp is None:
+                # Only once there is something to send: an idle worker polls
+                # far more often than it finds mail.
+                smtp = get_connection(fail_silently=False)
+            messages, sendable = [], []
+            for row in rows:
+                try:
+                    # Headers that no longer parse fail the row like a
+                    # refused send.
+                    messages.append(row_message(row))
+                    sendable.append(row)
+                except Exception as exc:
+                    record(row, None, exc)
+                    unsent += 1
+            for row, (msg_id, error) in zip(sendable, send_many(messages, connection=smtp)):
+                if record(row, msg_id, error):
+                    sent += 1
+                else:
+                    unsent += 1
+    finally:
+        if smtp is not None:
+            smtp.close()
+
+
+# ---------------- in-process drain ----------------
+
+_executor = None
+_executor_lock = Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # One thread: a second would only compete for the same rows.
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='email-outbox')
+        return _executor
+
+
+def _drain_in_background() -> None:
+    try:
+        close_old_connections()
+        drain()
+    except Exception:
+        logger.exception("In-process email outbox drain failed")
+    finally:
+        connection.close()
+
+
+def _log_failure(future) -> None:
+    # The executor keeps a task's exception on its future, which nobody reads.
+    exc = future.exception()
+    if exc is not None:
+        logger.error("In-process email outbox drain failed", exc_info=exc)
+
+
+def _wake() -> None:
+    _get_executor().submit(_drain_in_background).add_done_callback(_log_failure)
+
+
+def wake_on_commit() -> None:
+    """Drain this process's outbox once the current transaction commits. The
+    rows are not visible to the drain before then."""
+    if getattr(settings, 'EMAIL_OUTBOX_IN_PROCESS', True):
+        transaction.on_commit(_wake)
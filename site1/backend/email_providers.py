@@ -7,22 +7,34 @@ later only requires editing this module.
 Notes:
 - Synchronous send. Exceptions propagate to the caller (EmailService),
   which is responsible for logging the failure into email_queue.
-- Returns the Message-ID header when EmailMessage.message() exposes it,
-  otherwise None.
+- Every message gets its Message-ID set before sending, and that is what
+  send_email returns. Reading it back from msg.message() afterwards, as this
+  used to, built a second MIME message with a fresh, different ID.
+- Opening an SMTP connection costs a TCP connect, STARTTLS and AUTH, several
+  round trips before the first byte of mail. Anything sending more than one
+  message should share a connection: pass one to send_email, or hand the
+  batch to send_many.
 """
 from __future__ import annotations
 
 import logging
-from typing import Optional, Sequence
+import smtplib
+from typing import Iterable, List, Optional, Sequence, Tuple
 
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.message import make_msgid
+from django.core.mail.utils import DNS_NAME
 from django.utils.html import strip_tags
 
 logger = logging.getLogger(__name__)
 
+# Failures that mean the connection is gone rather than that the message was
+# refused. send_many reconnects and tries the message once more on these.
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
 
-def send_email(
+
+def build_message(
     *,
     to: Sequence[str],
     subject: str,
@@ -31,17 +43,16 @@ def send_email(
     from_email: Optional[str] = None,
     reply_to: Optional[Sequence[str]] = None,
     headers: Optional[dict] = None,
-) -> Optional[str]:
-    """Send a multi-part (text + HTML) email.
-
-    Returns the Message-ID string from the constructed MIME message, or None
-    if it can't be read. Raises on failure — caller logs it.
-    """
+    connection=None,
+) -> EmailMultiAlternatives:
+    """A multi-part (text + HTML) message with its Message-ID already set."""
     if not to:
         raise ValueError("send_email: recipient list is empty")
 
     sender = from_email or settings.DEFAULT_FROM_EMAIL
     plain = text_body or strip_tags(html_body)
+    headers = dict(headers or {})
+    headers.setdefault('Message-ID', make_msgid(domain=DNS_NAME))
 
     msg = EmailMultiAlternatives(
         subject=subject,
@@ -49,12 +60,100 @@ def send_email(
         from_email=sender,
         to=list(to),
         reply_to=list(reply_to) if reply_to else None,
-        headers=headers or None,
+        headers=headers,
+        connection=connection,
     )
     msg.attach_alternative(html_body, "text/html")
+    return msg
+
+
+def message_id(msg) -> Optional[str]:
+    return msg.extra_headers.get('Message-ID')
+
+
+def send_email(
+    *,
+    to: Sequence[str],
+    subject: str,
+    html_body: str,
+    text_body: Optional[str] = None,
+    from_email: Optional[str] = None,
+    reply_to: Optional[Sequence[str]] = None,
+    headers: Optional[dict] = None,
+    connection=None,
+) -> Optional[str]:
+    """Send a multi-part (text + HTML) email.
+
+    With `connection` (from django.core.mail.get_connection(), opened by the
+    caller) the message goes over it and it stays open; without, Django opens
+    and closes one just for this message. Returns the Message-ID. Raises on
+    failure — caller logs it.
+    """
+    msg = build_message(
+        to=to, subject=subject, html_body=html_body, text_body=text_body,
+        from_email=from_email, reply_to=reply_to, headers=headers,
+        connection=connection,
+    )
     msg.send(fail_silently=False)
+    return message_id(msg)
 
+
+def _reconnect(connection) -> None:
     try:
-        return msg.message().get('Message-ID')
+        connection.close()
     except Exception:
-        return None
+        pass
+    connection.open()
+
+
+def send_many(
+    messages: Iterable[EmailMultiAlternatives],
+    connection=None,
+) -> List[Tuple[Optional[str], Optional[Exception]]]:
+    """Send a batch over one connection. Returns (Message-ID, None) or
+    (None, exception) per message, in order; never raises.
+
+    A message that fails because the connection dropped is retried once on a
+    fresh connection; one the server refuses is not. If no connection can be
+    opened at all, every message not yet sent fails with that error, so the
+    caller records and backs them off like any other failure. Pass
+    `connection` to keep it open across several batches (the caller then
+    closes it); otherwise one is opened for this batch and closed at the end.
+    """
+    messages = list(messages)
+    own_connection = connection is None
+    try:
+        if own_connection:
+            connection = get_connection(fail_silently=False)
+        # Opened here, not left to send_messages: that closes any connection
+        # it had to open itself after every call.
+        connection.open()
+    except Exception as exc:
+        logger.warning("SMTP connection could not be opened: %s", exc)
+        return [(None, exc)] * len(messages)
+    results = []
+    try:
+        for msg in messages:
+            try:
+                connection.send_messages([msg])
+            except CONNECTION_ERRORS:
+                logger.info("SMTP connection lost; reconnecting")
+                try:
+                    _reconnect(connection)
+                except Exception as exc:
+                    logger.warning("SMTP connection could not be reopened: %s", exc)
+                    results += [(None, exc)] * (len(messages) - len(results))
+                    break
+                try:
+                    connection.send_messages([msg])
+                except Exception as exc:
+                    results.append((None, exc))
+                    continue
+            except Exception as exc:
+                results.append((None, exc))
+                continue
+            results.append((message_id(msg), None))
+    finally:
+        if own_connection:
+            connection.close()
+    return results
@@ -0,0 +1,164 @@
+"""Retrying failed email_queue rows (`manage.py retry_failed_emails`).
+
+The outbox (backend/email_outbox.py) gives a message EMAIL_MAX_ATTEMPTS tries,
+then marks it 'failed' with a next_attempt_at on the same backoff. This picks
+failed rows up once that is due and sends the real message again:
+
+  - an outbox row carries its rendered body and headers;
+  - a campaign log row carries none, but names the campaign and subscriber,
+    so the campaign is rendered again for them, unless they have since
+    unsubscribed;
+  - anything else (a template that would not render, rows from before the
+    outbox) has nothing to resend.
+
+A retry that fails waits retry_delay(attempts), doubling as before, then is
+tried again; at EMAIL_DEAD_LETTER_ATTEMPTS, or at once if there is nothing to
+resend, the row becomes 'dead' and is left for a human. A campaign row that
+is sent moves one recipient from the campaign's failed_count to sent_count.
+
+Rows are claimed like the outbox's (EmailRepository.claim_failed skips rows
+another worker holds), so several workers can run side by side, each sending
+over one SMTP connection. A claimed row is 'retrying' rather than the
+outbox's 'sending', so a row a dead retry worker left behind comes back here
+once EMAIL_SEND_LEASE_SECONDS runs out, never to the outbox.
+"""
+from __future__ import annotations
+
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from backend import email_outbox
+from data.repos.repositories import EmailRepository
+
+logger = logging.getLogger(__name__)
+
+
+def dead_letter_attempts() -> int:
+    return max(getattr(settings, 'EMAIL_DEAD_LETTER_ATTEMPTS', 10), email_outbox.max_attempts())
+
+
+class NotResendable(Exception):
+    """The row does not hold enough to build its message again."""
+
+
+def _message(row, renderers):
+    """The message `row` was. `renderers` caches one CampaignRenderer per
+    campaign for the worker's run."""
+    from backend.services.services import EmailService
+
+    if row.body_html:
+        return email_outbox.row_message(row)
+    if row.campaign_id and row.related_type == 'subscriber' and row.related_id:
+        subscriber = EmailRepository.get_subscriber(row.related_id)
+        if subscriber is None or subscriber.status != 'subscribed':
+            raise NotResendable('subscriber has unsubscribed')
+        if row.campaign_id not in renderers:
+            campaign = EmailRepository.get_campaign(row.campaign_id)
+            renderers[row.campaign_id] = campaign and EmailService.campaign_renderer(campaign)
+        if renderers[row.campaign_id] is None:
+            raise NotResendable('campaign no longer exists')
+        return renderers[row.campaign_id].message(subscriber)
+    raise NotResendable('no stored message to resend')
+
+
+def record(row, msg_id, error) -> str:
+    """Record the outcome of retrying a claimed row: 'sent', 'failed' (to be
+    retried) or 'dead'."""
+    if error is None:
+        with transaction.atomic():
+            EmailRepository.mark_outbox_sent(row.id, provider_msg_id=msg_id)
+            if row.campaign_id:
+                # The campaign counted this recipient as failed.
+                EmailRepository.campaign_recipient_resent(row.campaign_id)
+        return 'sent'
+    if isinstance(error, NotResendable) or row.attempts >= dead_letter_attempts():
+        logger.error("Email #%s is dead after %s attempts: %s", row.id, row.attempts, error)
+        EmailRepository.mark_outbox_dead(row.id, error)
+        return 'dead'
+    logger.warning("Email #%s retry %s failed: %s", row.id, row.attempts, error)
+    EmailRepository.mark_outbox_failed(
+        row.id, error, timezone.now() + email_outbox.retry_delay(row.attempts),
+    )
+    return 'failed'
+
+
+class _Budget:
+    """How many rows the run may still claim, shared by its workers."""
+
+    def __init__(self, limit: int):
+        self.left = limit
+        self._lock = Lock()
+
+    def take(self, n: int) -> int:
+        with self._lock:
+            n = min(n, self.left)
+            self.left -= n
+            return n
+
+
+def _work(budget: _Budget, batch_size: int) -> Counter:
+    from django.core.mail import get_connection
+
+    from backend.email_providers import send_many
+
+    lease = getattr(settings, 'EMAIL_SEND_LEASE_SECONDS', 600)
+    counts = Counter()
+    renderers = {}
+    smtp = None
+    try:
+        while True:
+            wanted = budget.take(batch_size)
+            if not wanted:
+                return counts
+            try:
+                rows = EmailRepository.claim_failed(wanted, lease)
+                if not rows:
+                    return counts
+                if smtp is None:
+                    smtp = get_connection(fail_silently=False)
+                messages, sendable = [], []
+                for row in rows:
+                    try:
+                        messages.append(_message(row, renderers))
+                        sendable.append(row)
+                    except Exception as exc:
+                        counts[record(row, None, exc)] += 1
+                for row, (msg_id, error) in zip(sendable, send_many(messages, connection=smtp)):
+                    counts[record(row, msg_id, error)] += 1
+            except Exception:
+                # The budget bounds how often this can repeat. Rows claimed
+                # but not recorded are claimed again once their lease runs
+                # out.
+                logger.exception("Email retry pass failed")
+    finally:
+        if smtp is not None:
+            smtp.close()
+
+
+def _work_in_thread(budget: _Budget, batch_size: int) -> Counter:
+    close_old_connections()
+    try:
+        return _work(budget, batch_size)
+    finally:
+        connection.close()
+
+
+def retry_failed(limit: int = 50, workers: int = 1,
+                 batch_size: int = email_outbox.BATCH_SIZE) -> Counter:
+    """Retry up to `limit` due failed rows over `workers` parallel workers.
+    Returns how many ended 'sent', 'failed' and 'dead'."""
+    budget = _Budget(limit)
+    batch_size = max(1, min(batch_size, limit))
+    if workers <= 1:
+        return _work(budget, batch_size)
+    counts = Counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='email-retry') as pool:
+        for result in [pool.submit(_work_in_thread, budget, batch_size) for _ in range(workers)]:
+            counts.update(result.result())
+    return counts
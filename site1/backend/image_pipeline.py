@@ -0,0 +1,54 @@
+"""Background processing of image uploads.
+
+upload_image saves the raw upload and returns; ImageService.process_upload,
+which decodes it and writes the variants (backend/image_storage.py), runs
+here on a small thread pool once the upload's transaction has committed.
+Pillow releases the GIL while decoding, resizing and encoding, so threads
+give real parallelism without a second process to deploy.
+
+The pool lives in each web worker, so a job still queued when that worker
+exits is lost. Its row stays pending and `manage.py process_images` picks it
+up; run that from cron, or after a restart.
+"""
+from __future__ import annotations
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMAGE_PIPELINE_WORKERS', 2),
+                thread_name_prefix='image-pipeline',
+            )
+        return _executor
+
+
+def _run(image_name: str) -> None:
+    from backend.services.services import ImageService
+    close_old_connections()
+    try:
+        ImageService.process_upload(image_name)
+    except Exception:
+        logger.exception("Image pipeline failed for %s", image_name)
+    finally:
+        # Pool threads outlive requests, so nothing else closes this.
+        connection.close()
+
+
+def submit_on_commit(image_name: str) -> None:
+    """Process image_name's pending upload once the current transaction
+    commits. Before then the worker could not see the pending row."""
+    transaction.on_commit(lambda: _get_executor().submit(_run, image_name))
@@ -0,0 +1,176 @@
+"""Files for admin-uploaded images.
+
+An upload is decoded once and written to the `images` storage (STORAGES in
+settings.py) as a set of variants: JPEG and WebP at each width in
+VARIANT_WIDTHS no larger than the original, plus the original width when it
+is smaller than the largest of them. ImagesRef keeps only the metadata needed
+to name them: ImageHash and ImageWidths.
+
+Variant names are content-addressed,
+
+    <hash[:2]>/<hash>/<width>w.<ext>
+
+where hash is the sha256 of the uploaded bytes. A name therefore always
+means the same file: it can be cached forever, written twice without harm,
+and re-uploading an image changes its URLs rather than the files behind
+them. Variants of a replaced upload are left in place.
+
+The upload itself is kept too, as originals/<hash[:2]>/<hash>, so the
+request can return as soon as it is saved and the variants be made later
+(backend/image_pipeline.py).
+
+Locally the storage is a directory under MEDIA_ROOT, served by the front web
+server at MEDIA_URL (by Django itself when DEBUG). WhiteNoise is no use here:
+it indexes its files once at startup and would not see later uploads. With
+IMAGE_STORAGE_BUCKET set, the same names go to an S3-compatible bucket.
+"""
+from __future__ import annotations
+
+import hashlib
+from dataclasses import dataclass
+from io import BytesIO
+from typing import List, Optional, Sequence, Tuple
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+
+IMAGE_STORAGE_ALIAS = 'images'
+
+VARIANT_WIDTHS = (480, 960, 1600)
+
+# format -> (extension, content type, Pillow save options)
+VARIANT_FORMATS = {
+    'webp': ('webp', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('jpg', 'image/jpeg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+
+@dataclass(frozen=True)
+class ImageSource:
+    """What a template needs to show one image slot.
+
+    Renders as its src, so it drops into src="..." and url(...) unchanged;
+    {% image_sources %} adds the srcset <source> elements when there are
+    variants to offer.
+    """
+    src: str
+    # (content type, srcset) per format, preferred first. Empty for static
+    # fallbacks and for images still stored in ImageData.
+    sources: Tuple[Tuple[str, str], ...] = ()
+
+    def __str__(self):
+        return self.src
+
+
+def get_storage():
+    return storages[IMAGE_STORAGE_ALIAS]
+
+
+def parse_widths(value: Optional[str]) -> Tuple[int, ...]:
+    """ImagesRef.ImageWidths ('480,960,1600') as a tuple, () when unset."""
+    return tuple(int(width) for width in value.split(',')) if value else ()
+
+
+def variant_name(image_hash: str, width: int, fmt: str) -> str:
+    ext = VARIANT_FORMATS[fmt][0]
+    return f'{image_hash[:2]}/{image_hash}/{width}w.{ext}'
+
+
+def original_name(image_hash: str) -> str:
+    return f'originals/{image_hash[:2]}/{image_hash}'
+
+
+def save_original(source: bytes) -> str:
+    """Keep an upload as it arrived, for the pipeline to process. Returns its
+    hash."""
+    image_hash = hashlib.sha256(source).hexdigest()
+    storage = get_storage()
+    name = original_name(image_hash)
+    if not storage.exists(name):
+        storage.save(name, ContentFile(source))
+    return image_hash
+
+
+def read_original(image_hash: str) -> bytes:
+    with get_storage().open(original_name(image_hash)) as f:
+        return f.read()
+
+
+def variant_url(image_hash: str, width: int, fmt: str) -> str:
+    return get_storage().url(variant_name(image_hash, width, fmt))
+
+
+def image_source(image_hash: str, widths: Sequence[int]) -> ImageSource:
+    """The ImageSource for a stored upload. src is the widest JPEG, which is
+    what a browser without <picture> support, or a CSS background, gets."""
+    storage = get_storage()
+    sources = tuple(
+        (content_type, ', '.join(
+            f'{storage.url(variant_name(image_hash, width, fmt))} {width}w' for width in widths
+        ))
+        for fmt, (_, content_type, _) in VARIANT_FORMATS.items()
+    )
+    return ImageSource(src=variant_url(image_hash, max(widths), 'jpeg'), sources=sources)
+
+
+def variant_widths(original_width: int) -> List[int]:
+    widths = [width for width in VARIANT_WIDTHS if width < original_width]
+    if len(widths) < len(VARIANT_WIDTHS):
+        widths.append(original_width)
+    return widths
+
+
+def _flatten(img):
+    """RGB on white. JPEG has no alpha channel, and a transparent PNG saved as
+    JPEG comes out with a black background."""
+    from PIL import Image
+    if img.mode in ('RGBA', 'LA', 'P'):
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode in ('P', 'LA'):
+            img = img.convert('RGBA')
+        background.paste(img, mask=img.split()[-1])
+        return background
+    return img.convert('RGB')
+
+
+def store_variants(source: bytes) -> Tuple[str, List[int]]:
+    """Write every variant of an uploaded image. Returns (hash, widths), the
+    values for ImagesRef.ImageHash and ImageWidths.
+
+    Raises whatever Pillow raises for a file it cannot decode.
+    """
+    from PIL import Image
+
+    image_hash = hashlib.sha256(source).hexdigest()
+    img = Image.open(BytesIO(source))
+    original_width, original_height = img.size
+    widths = variant_widths(original_width)
+    largest = max(widths)
+    if largest < original_width:
+        # JPEG only (a no-op otherwise): have the decoder scale by 1/2, 1/4
+        # or 1/8 while decoding, to the smallest size still at least as large
+        # as the widest variant. A 6000px photo is then never held at full
+        # size.
+        img.draft('RGB', (largest, max(1, round(original_height * largest / original_width))))
+    img = _flatten(img)
+    storage = get_storage()
+
+    for width in widths:
+        height = max(1, round(original_height * width / original_width))
+        if (width, height) == img.size:
+            resized = img
+        else:
+            # reducing_gap has resize() shrink by whole factors with reduce()
+            # first and run LANCZOS only over the last, small step.
+            resized = img.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+        for fmt, (_, _, options) in VARIANT_FORMATS.items():
+            name = variant_name(image_hash, width, fmt)
+            # Same name, same bytes: nothing to do. Checking first also keeps
+            # FileSystemStorage from saving a renamed duplicate.
+            if storage.exists(name):
+                continue
+            buffer = BytesIO()
+            resized.save(buffer, fmt.upper(), **options)
+            storage.save(name, ContentFile(buffer.getvalue()))
+
+    return image_hash, widths
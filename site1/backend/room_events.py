@@ -0,0 +1,218 @@
+"""Live room status changes, pushed to open room dashboards.
+
+Every room change the snapshot publishes (backend/room_snapshot.py, on
+commit of a Room, RoomAssignment or booking write) is also published here
+as an event: the change's version and the room's new card. Under ASGI,
+room_dashboard_events, a Server-Sent Events view, streams them to each open
+dashboard, which patches its cards in place instead of reloading or polling.
+Under WSGI the view answers 204 and dashboards poll room_dashboard_changes.
+
+Within one process the broker hands events straight to the streams open
+in it. Processes only see each other's events through Redis pub/sub: with
+ROOM_EVENTS_REDIS_URL set, events are published on the ROOM_EVENTS_CHANNEL
+channel and each process runs one listener thread that feeds its own
+streams. That needs the `redis` package, which is not in requirements.txt.
+
+Events are a hint, not the record. A stream that falls behind is sent
+'resync', and a dashboard that reconnects sends the last version it saw
+(Last-Event-ID); both catch up from room_snapshot.changes_since, so nothing
+is lost to a dropped connection or a slow reader.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+logger = logging.getLogger(__name__)
+
+ROOM_EVENTS_CHANNEL = 'room_events'
+# Events a stream may fall behind by before it is told to resync.
+_QUEUE_SIZE = 100
+
+RESYNC = 'resync'
+
+
+class _Subscriber:
+    """One open stream's queue, fed from any thread through its loop."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(_QUEUE_SIZE)
+
+    def put(self, message: str) -> None:
+        # Runs on self.loop.
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Too slow to keep up: drop what it has and have it catch up.
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+    async def get(self) -> str:
+        return await self.queue.get()
+
+
+class LocalBroker:
+    """Fans events out to the streams open in this process."""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def publish(self, message: str) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.put, message)
+            except RuntimeError:
+                # Its loop has closed under it.
+                self._remove(subscriber)
+
+    def _remove(self, subscriber) -> None:
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    @asynccontextmanager
+    async def subscribe(self):
+        subscriber = _Subscriber(asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(subscriber)
+        try:
+            yield subscriber
+        finally:
+            self._remove(subscriber)
+
+
+class RedisBroker(LocalBroker):
+    """Publishes through Redis; a listener thread, started with the first
+    stream, hands every process its events."""
+
+    def __init__(self, url: str):
+        super().__init__()
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._listener = None
+
+    def publish(self, message: str) -> None:
+        try:
+            self._redis.publish(ROOM_EVENTS_CHANNEL, message)
+        except Exception:
+            logger.exception("Could not publish room event")
+
+    def _listen(self) -> None:
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(ROOM_EVENTS_CHANNEL)
+                # Events missed while disconnected are not replayed.
+                super().publish(RESYNC)
+                for item in pubsub.listen():
+                    if item['type'] == 'message':
+                        super().publish(item['data'].decode())
+            except Exception:
+                logger.exception("Room event listener lost Redis; reconnecting")
+                time.sleep(1)
+
+    @asynccontextmanager
+    async def subscribe(self):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(
+                    target=self._listen, name='room-events', daemon=True
+                )
+                self._listener.start()
+        async with super().subscribe() as subscriber:
+            yield subscriber
+
+
+_broker: Optional[LocalBroker] = None
+_broker_lock = threading.Lock()
+
+
+def broker() -> LocalBroker:
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            url = getattr(settings, 'ROOM_EVENTS_REDIS_URL', '')
+            _broker = RedisBroker(url) if url else LocalBroker()
+        return _broker
+
+
+def publish(version, room_id: int, room: Optional[dict]) -> None:
+    """Announce a room's new card, or its removal if `room` is None."""
+    broker().publish(json.dumps(
+        {'version': str(version), 'room_id': room_id, 'room': room}, cls=DjangoJSONEncoder,
+    ))
+
+
+def sse(data: str, event: str = 'message', id: Optional[str] = None) -> str:
+    lines = [f'event: {event}']
+    if id is not None:
+        lines.append(f'id: {id}')
+    lines += [f'data: {line}' for line in data.splitlines()]
+    return '\n'.join(lines) + '\n\n'
+
+
+def _catch_up(since: int):
+    """SSE text for the changes after version `since`."""
+    from backend import room_snapshot
+
+    changes = room_snapshot.changes_since(since, date.today())
+    if changes['full']:
+        return [sse('{}', event=RESYNC)]
+    version = str(changes['version'])
+    rooms = [(room['room_id'], room) for room in changes['rooms']]
+    rooms += [(room_id, None) for room_id in changes['removed']]
+    return [
+        sse(json.dumps({'version': version, 'room_id': room_id, 'room': room}, cls=DjangoJSONEncoder),
+            event='room', id=version)
+        for room_id, room in rooms
+    ]
+
+
+async def stream(since: Optional[int], heartbeat: float = 15, timeout: Optional[float] = None):
+    """The event stream for a dashboard that last saw version `since`: the
+    changes after it, then each change as it is published, with a comment
+    every `heartbeat` seconds to keep proxies from closing it.
+
+    With a `timeout` it ends at the first change, or after `timeout`
+    seconds."""
+    async with broker().subscribe() as subscriber:
+        # Subscribed before catching up, so nothing falls in between.
+        yield 'retry: 3000\n\n'
+        if since is not None:
+            caught_up = await sync_to_async(_catch_up)(since)
+            for chunk in caught_up:
+                yield chunk
+            if caught_up and timeout is not None:
+                return
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            wait = heartbeat if deadline is None else min(heartbeat, deadline - loop.time())
+            if wait <= 0:
+                return
+            try:
+                message = await asyncio.wait_for(subscriber.get(), wait)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if message == RESYNC:
+                yield sse('{}', event=RESYNC)
+            else:
+                yield sse(message, event='room', id=json.loads(message)['version'])
+            if deadline is not None:
+                return
@@ -0,0 +1,200 @@
+"""The room dashboard's state, built once and patched room by room.
+
+room_dashboard loaded every room and every active assignment, with their
+bookings, on each request. This keeps what it shows of each room -- the
+room's statuses and its active stays with their guests -- as a snapshot in
+the default cache, built by one query (RoomRepository.dashboard_rows, the
+join v_room_dashboard makes).
+
+Changes are not written into the snapshot, which several workers would race
+to rewrite. Each one is published instead: the version in the
+'room_dashboard' namespace is bumped, and the changed room's fresh state is
+stored as that version's change. A reader takes the snapshot and replays the
+changes made since it was built. Past _MAX_CHANGES of them, or when one has
+been evicted, the snapshot is built again at the current version. A room's
+change holds its whole state, so replaying one the snapshot already includes
+does no harm. The same changes answer changes_since(version): only the rooms
+changed after the version a dashboard last saw. Each is also pushed to open
+dashboards as it is published (backend/room_events.py).
+
+Rooms, assignments and bookings written through the ORM publish their rooms
+once the write commits (home/signals.py). _SNAPSHOT_TTL_SECONDS bounds how
+long a change made with SQL directly goes unseen.
+
+A room's display status depends on the date, so it is worked out when the
+room is read (card), not stored.
+"""
+from __future__ import annotations
+
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q, Subquery
+
+from backend import room_events
+from backend.versioned_cache import bump_version, get_version, versioned_key
+from data.models import RoomAssignment
+from data.repos.repositories import RoomRepository
+
+NAMESPACE = 'room_dashboard'
+_SNAPSHOT_KEY = f'{NAMESPACE}:snapshot'
+_SNAPSHOT_TTL_SECONDS = 300
+# Changes replayed over a snapshot before it is cheaper to build it again.
+_MAX_CHANGES = 200
+
+STATUSES = ('vacant', 'dirty', 'occupied', 'out_of_order', 'reserved')
+
+_ROOM_COLUMNS = (
+    'room_id', 'room_code', 'floor_number', 'room_number', 'room_type',
+    'reservation_status', 'housekeeping_status',
+)
+
+
+def _states(rows) -> Dict[int, Dict]:
+    """{room_id: room columns plus 'stays', its active stays by check-in}."""
+    states = {}
+    for row in rows:
+        state = states.setdefault(
+            row['room_id'], {**{c: row[c] for c in _ROOM_COLUMNS}, 'stays': []}
+        )
+        if row['assignment_id'] is not None:
+            state['stays'].append({c: row[c] for c in RoomRepository.DASHBOARD_STAY_COLUMNS})
+    return states
+
+
+def _current_stay(stays, today):
+    """The stay a room card shows: the one under way, else the next, else
+    the last to have ended without being checked out."""
+    for stay in stays:
+        if stay['check_in'] <= today <= stay['check_out']:
+            return stay
+    upcoming = [stay for stay in stays if stay['check_in'] > today]
+    if upcoming:
+        return upcoming[0]
+    return stays[-1] if stays else None
+
+
+def display_status(state, stay, today) -> str:
+    if state['housekeeping_status'] == 'out_of_order':
+        return 'out_of_order'
+    if stay and stay['check_in'] <= today <= stay['check_out']:
+        return 'occupied'
+    if stay and stay['check_in'] > today:
+        return 'reserved'
+    if state['reservation_status'] == 'vacant' and state['housekeeping_status'] == 'dirty':
+        return 'dirty'
+    return state['reservation_status']
+
+
+def card(state, today) -> Dict:
+    """What the dashboard shows of one room, flat, for the template and the
+    changes endpoint alike."""
+    stay = _current_stay(state['stays'], today)
+    empty = dict.fromkeys(RoomRepository.DASHBOARD_STAY_COLUMNS)
+    return {
+        **{c: state[c] for c in _ROOM_COLUMNS},
+        **(stay or empty),
+        'duration': (stay['check_out'] - stay['check_in']).days if stay else None,
+        'disp_status': display_status(state, stay, today),
+    }
+
+
+def _build(version) -> Dict[int, Dict]:
+    rooms = _states(RoomRepository.dashboard_rows())
+    if version is not None:
+        cache.set(_SNAPSHOT_KEY, {'version': version, 'rooms': rooms}, _SNAPSHOT_TTL_SECONDS)
+    return rooms
+
+
+def _changes(since, version) -> Optional[List[Tuple[int, Optional[Dict]]]]:
+    """(room_id, state or None if deleted) for each change after `since` up
+    to `version`, in order; None if some of them are no longer cached."""
+    if version - since > _MAX_CHANGES:
+        return None
+    keys = [versioned_key(NAMESPACE, v, 'change') for v in range(since + 1, version + 1)]
+    found = cache.get_many(keys) if keys else {}
+    if len(found) < len(keys):
+        return None
+    return [found[key] for key in keys]
+
+
+def snapshot() -> Tuple[Optional[int], Dict[int, Dict]]:
+    """(version, {room_id: state}) as of now. The version is None if the
+    cache could not be used."""
+    version = get_version(NAMESPACE)
+    if version is None:
+        return None, _build(None)
+    stored = cache.get(_SNAPSHOT_KEY)
+    if stored is not None and stored['version'] <= version:
+        changes = _changes(stored['version'], version)
+        if changes is not None:
+            rooms = dict(stored['rooms'])
+            for room_id, state in changes:
+                if state is None:
+                    rooms.pop(room_id, None)
+                else:
+                    rooms[room_id] = state
+            return version, rooms
+    # Read before the query, so a change committed meanwhile is replayed
+    # rather than missed.
+    return version, _build(version)
+
+
+def cards(today: date) -> Tuple[Optional[int], List[Dict]]:
+    """(version, room cards ordered by floor and room number)."""
+    version, rooms = snapshot()
+    ordered = sorted(rooms.values(), key=lambda s: (s['floor_number'], s['room_number']))
+    return version, [card(state, today) for state in ordered]
+
+
+def changes_since(since: int, today: date) -> Dict:
+    """What changed after version `since`: {'version', 'full', 'rooms',
+    'removed'}. 'full' means the changes could not be listed and 'rooms'
+    holds every room instead."""
+    version = get_version(NAMESPACE)
+    changes = None
+    if version is not None and since <= version:
+        changes = _changes(since, version)
+    if changes is None:
+        version, rooms = cards(today)
+        return {'version': version, 'full': True, 'rooms': rooms, 'removed': []}
+    latest = dict(changes)
+    return {
+        'version': version,
+        'full': False,
+        'rooms': [card(state, today) for state in latest.values() if state is not None],
+        'removed': [room_id for room_id, state in latest.items() if state is None],
+    }
+
+
+def _publish(room_filter, room_ids: Iterable[int] = ()) -> None:
+    states = _states(RoomRepository.dashboard_rows(room_filter))
+    # Rooms asked for by id that are gone have been deleted.
+    for room_id in set(room_ids) - states.keys():
+        states[room_id] = None
+    for room_id, state in states.items():
+        version = bump_version(NAMESPACE)
+        if version is not None:
+            cache.set(versioned_key(NAMESPACE, version, 'change'), (room_id, state),
+                      _SNAPSHOT_TTL_SECONDS)
+            room_events.publish(version, room_id, card(state, date.today()) if state else None)
+
+
+def invalidate() -> None:
+    """Drop the snapshot; the next read builds it again."""
+    cache.delete(_SNAPSHOT_KEY)
+
+
+def record_room(room_id: int) -> None:
+    """Publish the room's state once the current transaction commits."""
+    transaction.on_commit(lambda: _publish(Q(room_id=room_id), [room_id]))
+
+
+def record_booking(booking_id: int) -> None:
+    """Publish, on commit, the rooms the booking is staying in: their cards
+    carry its guest's details."""
+    transaction.on_commit(lambda: _publish(Q(room_id__in=Subquery(
+        RoomAssignment.objects.filter(booking_id=booking_id, status='active').values('room_id')
+    ))))
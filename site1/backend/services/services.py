@@ -1,22 +1,33 @@
 from __future__ import annotations
 
-import random
 import logging
-from datetime import datetime
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
 from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 from typing import Any, Dict, Iterable, Optional
 
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from django.db import transaction
+from django.db.models import Q
 
-from data.models.hotel import Hotel as BookingHotel, RoomPrice
+from data.models.hotel import BookingStatus, Hotel as BookingHotel, RoomPrice
 from data.repos.repositories import (
     HotelRepository,
     ReservationRepository,
     RoomRepository,
     EmailRepository,
     DiscountRepository,
+    ImageRepository,
+)
+from data.repos.availability import RoomAvailabilityIndex
+from backend.versioned_cache import bump_version, bump_version_on_commit, get_version, versioned_key
+from backend.allocation import get_strategy as get_allocation_strategy
+from backend.email_outbox import wake_on_commit as wake_email_outbox_on_commit
+from backend.image_pipeline import submit_on_commit as submit_image_on_commit
+from backend.image_storage import (
+    ImageSource, image_source, parse_widths, read_original, save_original, store_variants,
 )
 
 logger = logging.getLogger(__name__)
@@ -104,9 +115,30 @@ class DiscountService:
 class ReservationService:
     """Business logic for reservation workflow."""
 
-    _RATE_CACHE: Optional[Dict[str, Decimal]] = None
-    _RATE_CACHE_FETCHED_AT: Optional[datetime] = None
+    # Two levels. _RATE_CACHE is this process's copy (L1). Behind it, the
+    # Django cache holds one payload per rates version (L2), shared by every
+    # worker when CACHES points at a shared backend. invalidate_room_rates
+    # bumps the version, and the first worker to miss L2 reloads from
+    # room_price for the rest. A rate lookup runs several times per booking
+    # and per page, so L1 asks for the version at most every
+    # _RATE_VERSION_CHECK_SECONDS rather than a cache round trip each time:
+    # other workers see a bump within that, this one at once. The TTL still
+    # bounds staleness after hand-run SQL that nobody followed with
+    # `manage.py refresh_room_rates`.
+    #
+    # L1 is one tuple, (rates, room type lookup, fetched at, version),
+    # replaced whole and never changed in place. The lookup holds every
+    # spelling _canonicalise_room_type accepts, lowercased, mapped to what it
+    # returns. Readers take the tuple once, so a reload or
+    # invalidate_room_rates on another thread cannot pull it from under them
+    # or pair rates with another snapshot's lookup.
+    _RATE_CACHE: Optional[tuple] = None
     _RATE_CACHE_TTL_SECONDS = 300
+    _RATE_VERSION_CHECKED_AT: Optional[float] = None  # time.monotonic()
+    _RATE_VERSION_CHECK_SECONDS = 5
+    _RATE_CACHE_KEY = 'room_rates'
+    DASHBOARD_STATS_CACHE = 'reservation_stats'
+    _DASHBOARD_STATS_TTL_SECONDS = 30
 
     _ROOM_TYPE_ALIASES: Dict[str, Iterable[str]] = {
         'one_bed_balcony_room': (
@@ -168,11 +200,12 @@ class ReservationService:
         from data.models.hotel import CustomerBookingInfo
 
         with transaction.atomic():
-            # 1. Lock the room rate row for serializing bookings to prevent race conditions
-            #    This ensures no two users can book simultaneously using the same room type.
-            RoomPrice.objects.select_for_update().filter(room_type=canonical_room_type).first()
-
-            # 2. Check physical room availability for the requested type and dates
+            # 1. Check physical room availability for the requested type and dates.
+            #    Answered from RoomAvailabilityIndex; allocate_room below is what
+            #    re-checks under lock before anything is written. That lock is
+            #    per (room type, week of the stay), not per room type: this used
+            #    to take UPDLOCK on the room_price row, which queued every booking
+            #    of a type behind every other, whatever their dates.
             available_count = RoomRepository.count_available_rooms_by_type(
                 canonical_room_type, checkin_date, checkout_date
             )
@@ -283,13 +316,52 @@ class ReservationService:
 
     @classmethod
     def get_room_rates(cls, force_refresh: bool = False) -> Dict[str, Decimal]:
-        if force_refresh or cls._RATE_CACHE is None or cls._rates_expired():
-            cls._RATE_CACHE = cls._load_room_rates()
-            cls._RATE_CACHE_FETCHED_AT = timezone.now()
-        return dict(cls._RATE_CACHE)
+        rates, _ = cls._ensure_rates_loaded(force_refresh)
+        return dict(rates)
+
+    @classmethod
+    def _ensure_rates_loaded(cls, force_refresh: bool = False) -> tuple:
+        """(rates, room type lookup) from one snapshot, reloaded first if it
+        is stale. Use these rather than reading _RATE_CACHE again."""
+        current = cls._RATE_CACHE
+        fresh = not force_refresh and current is not None and not cls._rates_expired(current[2])
+        now = time.monotonic()
+        checked_at = cls._RATE_VERSION_CHECKED_AT
+        if fresh and checked_at is not None and now - checked_at < cls._RATE_VERSION_CHECK_SECONDS:
+            return current[:2]
+        version = get_version(cls._RATE_CACHE_KEY)
+        cls._RATE_VERSION_CHECKED_AT = now
+        if fresh and version == current[3]:
+            return current[:2]
+
+        key = versioned_key(cls._RATE_CACHE_KEY, version) if version is not None else None
+        payload = None
+        if version is not None and not force_refresh:
+            payload = cache.get(key)
+        if payload is None:
+            rates, lookup = cls._load_room_rates()
+            payload = (rates, lookup, timezone.now())
+            if version is not None:
+                cache.set(key, payload, cls._RATE_CACHE_TTL_SECONDS)
+
+        # The fetch time is when the rows were read, not when this worker
+        # copied them out of L2, so the TTL bounds the age of the data itself.
+        rates, lookup, fetched_at = payload
+        cls._RATE_CACHE = (rates, lookup, fetched_at, version)
+        return rates, lookup
+
+    @classmethod
+    def invalidate_room_rates(cls) -> None:
+        """Make every worker reload room rates on its next read. Call after
+        room_price changes (see home/signals.py, and the refresh_room_rates
+        management command for hand-run SQL)."""
+        bump_version(cls._RATE_CACHE_KEY)
+        cls._RATE_CACHE = None
+        cls._RATE_VERSION_CHECKED_AT = None
 
     @classmethod
     def refresh_room_rates(cls) -> None:
+        cls.invalidate_room_rates()
         cls.get_room_rates(force_refresh=True)
 
     @staticmethod
@@ -342,35 +414,40 @@ class ReservationService:
 
     @classmethod
     def _canonicalise_room_type(cls, room_type: str) -> Optional[str]:
+        """A room_price room type (lowercased) or a legacy alias key, or None.
+
+        A dict lookup against the rate cache's room type lookup; no query
+        unless the rate cache is due for a reload.
+        """
         if not room_type:
             return None
-        normalised = room_type.strip().lower()
-
-        # First, check if it's already a valid database room type (direct match)
-        try:
-            if RoomPrice.objects.filter(room_type__iexact=normalised).exists():
-                return normalised
-        except Exception:
-            logger.exception("Database check error in _canonicalise_room_type")
-
-        # Then check against aliases for backward compatibility
-        for canonical, aliases in cls._ROOM_TYPE_ALIASES.items():
-            if normalised in (alias.lower() for alias in aliases):
-                return canonical
-
-        # If no match found, return None
-        return None
+        _, lookup = cls._ensure_rates_loaded()
+        return lookup.get(room_type.strip().lower())
 
     @classmethod
-    def _load_room_rates(cls) -> Dict[str, Decimal]:
-        """Load room rates from database room_price table."""
+    def _load_room_rates(cls):
+        """Load room rates from database room_price table.
+
+        Returns (rates, room_type_lookup). The lookup is built from the same
+        rows, including types with no price yet: those are still valid room
+        types, they just fail _resolve_rate. Database types win over aliases
+        when both spell the same thing.
+        """
         rates: Dict[str, Decimal] = {}
+        lookup: Dict[str, str] = {
+            alias.lower(): canonical
+            for canonical, aliases in cls._ROOM_TYPE_ALIASES.items()
+            for alias in aliases
+        }
 
         try:
-            price_rows = RoomPrice.objects.filter(price_per_night__isnull=False).values_list('room_type', 'price_per_night')
+            price_rows = RoomPrice.objects.values_list('room_type', 'price_per_night')
             for room_type, price_str in price_rows:
-                if room_type and price_str:
-                    canonical = room_type.strip().lower()
+                if not room_type:
+                    continue
+                canonical = room_type.strip().lower()
+                lookup[canonical] = canonical
+                if price_str:
                     try:
                         price = Decimal(str(price_str)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
                         rates[canonical] = price
@@ -379,13 +456,11 @@ class ReservationService:
         except Exception:
             logger.exception("Could not load from room_price table")
 
-        return rates
+        return rates, lookup
 
     @classmethod
-    def _rates_expired(cls) -> bool:
-        if cls._RATE_CACHE_FETCHED_AT is None:
-            return True
-        elapsed = (timezone.now() - cls._RATE_CACHE_FETCHED_AT).total_seconds()
+    def _rates_expired(cls, fetched_at: datetime) -> bool:
+        elapsed = (timezone.now() - fetched_at).total_seconds()
         return elapsed > cls._RATE_CACHE_TTL_SECONDS
 
     @staticmethod
@@ -409,6 +484,129 @@ class ReservationService:
             joined = ', '.join(missing)
             raise ValidationError(f'Missing required fields: {joined}.')
 
+    @classmethod
+    def dashboard_stats(cls, today) -> Dict[str, Any]:
+        """Booking figures for the admin dashboard, which the front desk
+        keeps open and auto-refreshing. Cached for a short window per day;
+        home/signals.py bumps the version when a booking is written."""
+        version = get_version(cls.DASHBOARD_STATS_CACHE)
+        if version is None:
+            return cls._load_dashboard_stats(today)
+        key = versioned_key(cls.DASHBOARD_STATS_CACHE, version, today.isoformat())
+        stats = cache.get(key)
+        if stats is None:
+            stats = cls._load_dashboard_stats(today)
+            cache.set(key, stats, cls._DASHBOARD_STATS_TTL_SECONDS)
+        return stats
+
+    @staticmethod
+    def _load_dashboard_stats(today) -> Dict[str, Any]:
+        stats = ReservationRepository.dashboard_stats(today)
+        stats['total_revenue'] = stats['total_revenue'] or 0
+        return stats
+
+    # The admin table's time-period buttons, as the badges each one shows.
+    _PERIOD_STAYS = {
+        'all': ReservationRepository.STAY_STATUSES,
+        'today': ('checking_in', 'checking_out', 'staying'),
+        'upcoming': ('upcoming', 'staying'),
+        'past': ('completed',),
+    }
+    RESERVATION_PAGE_SIZE = 50
+    _RESERVATION_PAGE_MAX = 200
+
+    @classmethod
+    def reservation_page(cls, params, today) -> Dict[str, Any]:
+        """One page of the admin reservations table, filtered server-side.
+        `params` is the request's query string:
+
+          period     all | today | upcoming | past
+          stay       badges to keep, repeated (checking_in, checking_out,
+                     staying, upcoming, completed); present but empty
+                     keeps none
+          status     booking statuses to keep, repeated
+          room_type, booking_id, q (guest name, email or phone)
+          check_in_from, check_in_to, check_out_from, check_out_to  YYYY-MM-DD
+          price_min, price_max
+          cursor     the previous page's `next`
+          limit      rows per page, at most 200
+
+        Raises ValidationError on a bad parameter.
+        """
+        stays = set(cls._PERIOD_STAYS.get(params.get('period') or 'all', ()))
+        if not stays and params.get('period'):
+            raise ValidationError('Unknown period.')
+        if 'stay' in params:
+            wanted = {stay for stay in params.getlist('stay') if stay}
+            if wanted - set(ReservationRepository.STAY_STATUSES):
+                raise ValidationError('Unknown stay status.')
+            stays &= wanted
+        filters = Q()
+        if stays != set(ReservationRepository.STAY_STATUSES):
+            filters &= ReservationRepository.stay_filter(sorted(stays), today)
+
+        statuses = [status for status in params.getlist('status') if status]
+        if statuses:
+            if set(statuses) - set(BookingStatus.values):
+                raise ValidationError('Unknown booking status.')
+            filters &= Q(status__in=statuses)
+        if params.get('room_type'):
+            filters &= Q(room_type=params['room_type'])
+        if params.get('booking_id'):
+            filters &= Q(booking_id=cls._parse_positive_int(params['booking_id'], 'booking_id', 1))
+        term = (params.get('q') or '').strip()
+        if term:
+            search = ReservationRepository.search_filter(term)
+            if term.lstrip('#').isdigit():
+                search |= Q(booking_id=int(term.lstrip('#')))
+            filters &= search
+        for field, lookup in (('check_in_from', 'check_in__gte'), ('check_in_to', 'check_in__lte'),
+                              ('check_out_from', 'check_out__gte'), ('check_out_to', 'check_out__lte')):
+            if params.get(field):
+                try:
+                    filters &= Q(**{lookup: datetime.strptime(params[field], '%Y-%m-%d').date()})
+                except ValueError:
+                    raise ValidationError(f'{field} must be YYYY-MM-DD.')
+        for field, lookup in (('price_min', 'total_price__gte'), ('price_max', 'total_price__lte')):
+            if params.get(field):
+                try:
+                    amount = Decimal(params[field])
+                except InvalidOperation:
+                    amount = None
+                if amount is None or not amount.is_finite():
+                    raise ValidationError(f'{field} must be a number.')
+                filters &= Q(**{lookup: amount})
+
+        limit = cls.RESERVATION_PAGE_SIZE
+        if params.get('limit'):
+            limit = min(cls._parse_positive_int(params['limit'], 'limit', 1), cls._RESERVATION_PAGE_MAX)
+        after = cls._parse_cursor(params['cursor']) if params.get('cursor') else None
+
+        rows, last = ReservationRepository.booking_page(filters, after=after, limit=limit)
+        for row in rows:
+            row['stay'] = ReservationRepository.stay_status(row, today)
+        return {
+            'reservations': rows,
+            'next': cls._cursor(*last) if last else None,
+        }
+
+    # UTC with a Z, so the cursor needs no escaping in a query string.
+    _CURSOR_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+    @classmethod
+    def _cursor(cls, booking_date, booking_id) -> str:
+        booking_date = booking_date.astimezone(dt_timezone.utc)
+        return f"{booking_date.strftime(cls._CURSOR_FORMAT)}_{booking_id}"
+
+    @classmethod
+    def _parse_cursor(cls, cursor: str):
+        try:
+            booking_date, booking_id = cursor.rsplit('_', 1)
+            booking_date = datetime.strptime(booking_date, cls._CURSOR_FORMAT)
+            return booking_date.replace(tzinfo=dt_timezone.utc), int(booking_id)
+        except ValueError:
+            raise ValidationError('Invalid cursor.')
+
     @staticmethod
     def get_reservation_by_id(booking_id):
         return ReservationRepository.get_by_id(booking_id)
@@ -424,36 +622,72 @@ class ReservationService:
 class RoomService:
     """Handles physical room allocation tied to booking status transitions."""
 
+    CALENDAR_MAX_NIGHTS = 366
+
+    @classmethod
+    def availability_calendar(cls, start, end) -> Dict[str, Any]:
+        """
+        Free rooms per room type for every night in [start, end).
+
+        Returns {'nights': [date, ...], 'room_types': {type_key: [int, ...]}},
+        the lists aligned with `nights`. Keys are the case-folded room type
+        (see data.repos.availability), since that is how SQL Server matches
+        them. Advisory, like count_available_rooms_by_type: allocate_room
+        still decides under lock.
+        """
+        if end <= start:
+            raise ValidationError('End date must be after start date.')
+        if (end - start).days > cls.CALENDAR_MAX_NIGHTS:
+            raise ValidationError(
+                f'Calendar window cannot exceed {cls.CALENDAR_MAX_NIGHTS} nights.'
+            )
+        return {
+            'nights': [start + timedelta(days=n) for n in range((end - start).days)],
+            'room_types': RoomAvailabilityIndex.calendar(start, end),
+        }
+
     @classmethod
     def allocate_room(cls, booking, assigned_by=None):
         """
         Allocate a physical room when a booking is confirmed.
-        Uses select_for_update() to prevent two concurrent confirmations
-        from grabbing the same room.
+
+        Holds RoomRepository.lock_allocation_window for the booking's room
+        type and dates while it reads the free rooms and writes the
+        assignment, so two concurrent allocations whose stays overlap cannot
+        both see the same room as free. Allocations for dates in different
+        weeks take different locks and run side by side.
+
+        Which free room is used is up to the configured strategy (see
+        backend.allocation, best-fit by default), which orders the free-room
+        query; only the room it ranks first is read and locked.
         """
         from django.db import transaction
 
-        # Guard: don't double-allocate
-        existing = RoomRepository.get_active_assignment_for_booking(booking.booking_id)
-        if existing:
-            return existing
-
         with transaction.atomic():
-            candidates = (
+            RoomRepository.lock_allocation_window(
+                booking.room_type, booking.check_in, booking.check_out
+            )
+
+            # Guard: don't double-allocate. Checked under the lock, which a
+            # second confirm of the same booking also has to take.
+            existing = RoomRepository.get_active_assignment_for_booking(booking.booking_id)
+            if existing:
+                return existing
+
+            ranked = get_allocation_strategy()(
                 RoomRepository.get_available_rooms_by_type(
                     booking.room_type, booking.check_in, booking.check_out
-                )
-                .select_for_update()
+                ),
+                booking.check_in, booking.check_out,
             )
-            candidate_list = list(candidates)  # evaluate under lock
+            room = RoomRepository.lock_preferred_room(ranked)
 
-            if not candidate_list:
+            if room is None:
                 raise ValidationError(
                     f'No available {booking.room_type.replace("_", " ")} rooms '
                     f'for {booking.check_in} – {booking.check_out}.'
                 )
 
-            room = random.choice(candidate_list)
             assignment = RoomRepository.create_assignment(booking, room, assigned_by)
             RoomRepository.update_room_status(room.room_id, 'reserved')
             return assignment
@@ -477,6 +711,7 @@ class RoomService:
             )
             assignment.status = 'completed'
             assignment.save()
+            RoomAvailabilityIndex.release_assignment(assignment)
 
     @classmethod
     def deallocate_room(cls, booking):
@@ -489,6 +724,173 @@ class RoomService:
             RoomRepository.update_room_status(assignment.room_id, 'vacant')
             assignment.status = 'cancelled'
             assignment.save()
+            RoomAvailabilityIndex.release_assignment(assignment)
+
+
+class ImageService:
+    """
+    Stores admin uploads and resolves the site's image slots to an
+    ImageSource: the uploaded image's variants in image storage if there are
+    any, else its ImageData served by serve_image, else the bundled static
+    file.
+
+    Which names have an upload, with its hash and stored widths, is read once
+    into a manifest kept in the default cache, so rendering a page costs no
+    image queries. Any ImagesRef write bumps the manifest version
+    (home/signals.py); the TTL covers rows changed by hand.
+
+    serve_image URLs get ?v=<hash prefix>. serve_image marks a response
+    immutable only when that matches the stored hash, so browsers keep the
+    file for a year and a new upload, which changes the hash, gets a new URL
+    instead of waiting out the old one. Storage URLs need no such suffix:
+    their names are the hash.
+    """
+
+    MANIFEST_CACHE = 'image_manifest'
+    _MANIFEST_TTL_SECONDS = 300
+    # Enough of the sha256 to tell uploads of one name apart.
+    URL_VERSION_LENGTH = 16
+
+    # slot -> (ImagesRef.ImageName, static fallback)
+    ROOM_IMAGES = {
+        'single_bed': ('room-single-bed', 'images/single bed.png'),
+        'double':     ('room-double',     'images/double room.png'),
+        'window':     ('room-window',     'images/window room.png'),
+        'balcony':    ('room-balcony',    'images/balcony.png'),
+        'condotel':   ('room-condotel',   'images/condotel.png'),
+    }
+    PAGE_IMAGES = {
+        'hero':   ('hero',   'images/hero_4.jpg'),
+        'food_1': ('food-1', 'images/food-1.jpg'),
+        'img_1':  ('img-1',  'images/img_1.jpg'),
+    }
+
+    @classmethod
+    def manifest(cls) -> Dict[str, tuple]:
+        """{ImageName: (ImageHash, stored widths)} for every image in
+        ImagesRef. The widths are () for an image still in ImageData."""
+        version = get_version(cls.MANIFEST_CACHE)
+        if version is None:
+            return cls._load_manifest()
+        key = versioned_key(cls.MANIFEST_CACHE, version)
+        manifest = cache.get(key)
+        if manifest is None:
+            manifest = cls._load_manifest()
+            cache.set(key, manifest, cls._MANIFEST_TTL_SECONDS)
+        return manifest
+
+    @staticmethod
+    def _load_manifest() -> Dict[str, tuple]:
+        try:
+            return {
+                name: (image_hash, parse_widths(widths))
+                for name, (image_hash, widths) in ImageRepository.list_manifest().items()
+            }
+        except Exception:
+            # Same fallback the per-image checks had: show the static files.
+            logger.exception("Could not load the image manifest")
+            return {}
+
+    @staticmethod
+    def store_upload(image_name: str, source: bytes):
+        """Write an upload's variants to image storage, then point its
+        ImagesRef row at them. Files first: a row must never name files that
+        are not there yet. Synchronous; uploads from the admin UI go through
+        queue_upload instead."""
+        image_hash, widths = store_variants(source)
+        return ImageRepository.save_stored(image_name, image_hash, widths)
+
+    @staticmethod
+    def queue_upload(image_name: str, source: bytes) -> str:
+        """Save an upload as-is and hand it to the image pipeline. Returns at
+        once; the slot keeps its current image until process_upload is done.
+
+        Only the header is parsed here, so a file Pillow cannot even identify,
+        or one with more pixels than it will decode (a decompression bomb), is
+        refused now with a ValidationError rather than failing later where
+        nobody sees it.
+        """
+        import warnings
+        from PIL import Image, UnidentifiedImageError
+        from io import BytesIO
+        try:
+            with warnings.catch_warnings():
+                # Past MAX_IMAGE_PIXELS Pillow only warns, up to twice that.
+                warnings.simplefilter('error', Image.DecompressionBombWarning)
+                Image.open(BytesIO(source))
+        except UnidentifiedImageError as exc:
+            raise ValidationError('The file is not an image we can read.') from exc
+        except (Image.DecompressionBombError, Image.DecompressionBombWarning) as exc:
+            raise ValidationError('The image has too many pixels.') from exc
+        pending_hash = save_original(source)
+        ImageRepository.save_pending(image_name, pending_hash)
+        submit_image_on_commit(image_name)
+        return pending_hash
+
+    @classmethod
+    def process_upload(cls, image_name: str, statuses=('pending',)) -> Optional[str]:
+        """Decode, resize and encode image_name's pending upload. Runs on the
+        pipeline's worker threads or from `manage.py process_images`.
+
+        Returns the final status, or None when there was nothing to claim.
+        """
+        pending_hash = ImageRepository.claim_pending(image_name, statuses)
+        if pending_hash is None:
+            return None
+        try:
+            _, widths = store_variants(read_original(pending_hash))
+        except Exception:
+            logger.exception("Could not process image upload %s", image_name)
+            ImageRepository.fail_pending(image_name, pending_hash)
+            return 'failed'
+        if ImageRepository.finish_pending(image_name, pending_hash, widths):
+            # A queryset update() sends no post_save, so home/signals.py
+            # does not see it.
+            bump_version_on_commit(cls.MANIFEST_CACHE)
+            return 'ready'
+        # Superseded by a newer upload, which has its own job.
+        return None
+
+    @staticmethod
+    def status(image_name: str) -> Optional[str]:
+        return ImageRepository.get_status(image_name)
+
+    @classmethod
+    def url_version(cls, image_hash: Optional[str]) -> Optional[str]:
+        return image_hash[:cls.URL_VERSION_LENGTH] if image_hash else None
+
+    @classmethod
+    def image_url(cls, image_name: str, image_hash: Optional[str]) -> str:
+        """serve_image URL for an upload, versioned by its hash. A row with no
+        hash yet gets the bare URL, which serve_image never marks immutable."""
+        from django.urls import reverse
+        url = reverse('serve_image', args=[image_name])
+        version = cls.url_version(image_hash)
+        return f'{url}?v={version}' if version else url
+
+    @classmethod
+    def resolve(cls, slots: Dict[str, tuple]) -> Dict[str, ImageSource]:
+        from django.templatetags.static import static
+        manifest = cls.manifest()
+        resolved = {}
+        for slot, (name, fallback) in slots.items():
+            if name not in manifest:
+                resolved[slot] = ImageSource(static(fallback))
+                continue
+            image_hash, widths = manifest[name]
+            if widths:
+                resolved[slot] = image_source(image_hash, widths)
+            else:
+                resolved[slot] = ImageSource(cls.image_url(name, image_hash))
+        return resolved
+
+    @classmethod
+    def room_images(cls) -> Dict[str, ImageSource]:
+        return cls.resolve(cls.ROOM_IMAGES)
+
+    @classmethod
+    def page_images(cls) -> Dict[str, ImageSource]:
+        return cls.resolve(cls.PAGE_IMAGES)
 
 
 class EmailService:
@@ -497,9 +899,9 @@ class EmailService:
     Every public method follows the same shape:
       1. resolve the recipient + context
       2. render the right template
-      3. call the provider
-      4. write a row into email_queue (sent or failed)
-      5. NEVER raise — email failure is non-fatal for the caller
+      3. write the rendered message into email_queue as 'pending' (the
+         outbox); backend/email_outbox.py sends it after the request
+      4. NEVER raise — email failure is non-fatal for the caller
     """
 
     # --------------- transactional helpers ---------------
@@ -642,8 +1044,10 @@ class EmailService:
 
     @classmethod
     def queue_campaign(cls, campaign_id):
-        """Send a draft campaign to every active subscriber. Logs per-recipient
-        rows into email_queue and updates the campaign's send stats."""
+        """Start sending a draft campaign to every active subscriber. Returns
+        the campaign, now 'sending'; backend/campaign_dispatch.py sends it in
+        the background once the caller's transaction commits, updating its
+        sent/failed counters as it goes."""
         campaign = EmailRepository.get_campaign(campaign_id)
         if not campaign:
             logger.warning("queue_campaign: campaign %s missing", campaign_id)
@@ -652,67 +1056,53 @@ class EmailService:
             logger.warning("queue_campaign: campaign %s is not in draft status", campaign_id)
             return campaign
 
-        subscribers = list(EmailRepository.active_subscribers())
-        sent_count = 0
-        failed_count = 0
+        recipients = EmailRepository.active_subscribers().count()
+        if EmailRepository.start_campaign(campaign.id, recipient_count=recipients):
+            from backend.campaign_dispatch import dispatch_on_commit
+            dispatch_on_commit(campaign.id)
+        return EmailRepository.get_campaign(campaign.id)
 
-        for sub in subscribers:
-            # Personalise the unsubscribe link per recipient.
-            unsubscribe_url = cls._build_unsubscribe_url(sub.unsubscribe_token)
-            context = {
-                'campaign': campaign,
-                'subscriber': sub,
-                'unsubscribe_url': unsubscribe_url,
-                'hotel': HotelService.get_hotel_info(),
-            }
-            try:
-                # Render the campaign body wrapped in base_email; campaign body
-                # is rich HTML the admin authored.
-                html = cls._render('email/campaign.html', context, fallback_body=campaign.body_html)
-                from backend.email_providers import send_email
-                msg_id = send_email(
-                    to=[sub.email],
-                    subject=campaign.subject,
-                    html_body=html,
-                    text_body=campaign.body_text or None,
-                    headers={'List-Unsubscribe': f'<{unsubscribe_url}>'},
-                )
-                EmailRepository.log_sent(
-                    to_email=sub.email,
-                    to_name=sub.name,
-                    subject=campaign.subject,
-                    email_type='campaign',
-                    template_name='email/campaign.html',
-                    user=sub.user,
-                    related_type='subscriber',
-                    related_id=sub.id,
-                    campaign=campaign,
-                    provider_msg_id=msg_id,
-                )
-                sent_count += 1
-            except Exception as exc:
-                logger.exception("Campaign %s send to %s failed", campaign.id, sub.email)
-                EmailRepository.log_failed(
-                    to_email=sub.email,
-                    to_name=sub.name,
-                    subject=campaign.subject,
-                    email_type='campaign',
-                    template_name='email/campaign.html',
-                    error=exc,
-                    user=sub.user,
-                    related_type='subscriber',
-                    related_id=sub.id,
-                    campaign=campaign,
-                )
-                failed_count += 1
+    @classmethod
+    def campaign_renderer(cls, campaign):
+        """Builds each recipient's copy of the campaign. The template is
+        rendered, and hotel info fetched, once per campaign rather than per
+        subscriber; see backend/campaign_render.py. Its message() raises if
+        the campaign cannot be rendered; the dispatcher logs that subscriber
+        as failed."""
+        from backend.campaign_render import CampaignRenderer
+
+        context = {'campaign': campaign, 'hotel': HotelService.get_hotel_info()}
+        # Render the campaign body wrapped in base_email; campaign body is
+        # rich HTML the admin authored.
+        return CampaignRenderer(
+            campaign,
+            context,
+            render=lambda ctx: cls._render('email/campaign.html', ctx, fallback_body=campaign.body_html),
+            unsubscribe_url=cls._build_unsubscribe_url,
+        )
 
-        EmailRepository.mark_campaign_sent(
-            campaign.id,
-            recipient_count=len(subscribers),
-            sent_count=sent_count,
-            failed_count=failed_count,
+    @staticmethod
+    def campaign_log_row(campaign, subscriber, msg_id=None, error=None):
+        """The unsaved email_queue row for one campaign recipient: sent, or
+        failed with `error`. The dispatcher writes them in bulk through
+        EmailRepository.campaign_log."""
+        fields = dict(
+            to_email=subscriber.email,
+            to_name=subscriber.name,
+            subject=campaign.subject,
+            email_type='campaign',
+            template_name='email/campaign.html',
+            related_type='subscriber',
+            related_id=subscriber.id,
+            campaign=campaign,
         )
-        return EmailRepository.get_campaign(campaign.id)
+        if error is None:
+            row = EmailRepository.sent_row(provider_msg_id=msg_id, **fields)
+        else:
+            row = EmailRepository.failed_row(error=error, **fields)
+        # A SubscriberRow carries user_id, not the user.
+        row.user_id = subscriber.user_id
+        return row
 
     # --------------- internal plumbing ---------------
 
@@ -720,7 +1110,13 @@ class EmailService:
     def _send(cls, *, to_email, subject, template_name, email_type, context,
               to_name=None, user=None, related_type=None, related_id=None,
               campaign=None):
-        """Render → send → log. Never raises."""
+        """Render → queue. Never raises. Returns the email_queue row, or None
+        if the message could not be rendered or queued.
+
+        Nothing is sent here: a slow SMTP relay used to hold the request for
+        up to EMAIL_TIMEOUT per message, twice for a booking (guest and
+        admin). The outbox sends it once this transaction commits.
+        """
         try:
             html = cls._render(template_name, context)
         except Exception as exc:
@@ -737,31 +1133,17 @@ class EmailService:
             return None
 
         try:
-            from backend.email_providers import send_email
-            msg_id = send_email(
-                to=[to_email],
-                subject=subject,
-                html_body=html,
-            )
-            EmailRepository.log_sent(
-                to_email=to_email, to_name=to_name, subject=subject,
-                email_type=email_type, template_name=template_name,
+            row = EmailRepository.enqueue(
+                to_email=to_email, subject=subject, email_type=email_type,
+                body_html=html, template_name=template_name, to_name=to_name,
                 user=user, related_type=related_type, related_id=related_id,
-                campaign=campaign, provider_msg_id=msg_id,
+                campaign=campaign,
             )
-            return msg_id
-        except Exception as exc:
-            logger.exception("Email send failed (%s -> %s)", email_type, to_email)
-            try:
-                EmailRepository.log_failed(
-                    to_email=to_email, subject=subject, email_type=email_type,
-                    template_name=template_name, to_name=to_name, user=user,
-                    related_type=related_type, related_id=related_id, campaign=campaign,
-                    error=exc,
-                )
-            except Exception:
-                logger.exception("log_failed also failed for %s -> %s", email_type, to_email)
+        except Exception:
+            logger.exception("Could not queue email (%s -> %s)", email_type, to_email)
             return None
+        wake_email_outbox_on_commit()
+        return row
 
     @staticmethod
     def _render(template_name, context, fallback_body=None):
@@ -770,7 +1152,7 @@ class EmailService:
             return render_to_string(template_name, context)
         except Exception:
             if fallback_body is not None:
-                # Used by queue_campaign when the admin pastes raw HTML.
+                # Used by campaign_renderer when the admin pastes raw HTML.
                 base_ctx = dict(context)
                 base_ctx['raw_body'] = fallback_body
                 return render_to_string('email/campaign.html', base_ctx)
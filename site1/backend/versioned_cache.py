@@ -0,0 +1,64 @@
+"""Version counters in the Django cache, for invalidating derived data.
+
+A cached value is stored under a key that embeds its namespace's current
+version. Bumping the version orphans every value stored under the old one, so
+all workers sharing the cache backend see the change on their next read. The
+orphans are left to expire on their own timeouts.
+
+The counters live in the default cache. With the default LocMemCache that
+means per process; see CACHES in settings.py.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from typing import Optional
+
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+def _version_key(namespace: str) -> str:
+    return f'{namespace}:version'
+
+
+def get_version(namespace: str) -> Optional[int]:
+    """The namespace's current version, or None if the cache is unreachable.
+    Callers treat None as "do not use the shared cache this time"."""
+    try:
+        version = cache.get(_version_key(namespace))
+        if version is None:
+            # Seeded from the clock rather than 1. If the key was evicted,
+            # counting again from 1 could land on a version whose stale value
+            # is still stored.
+            cache.add(_version_key(namespace), time.time_ns(), None)
+            version = cache.get(_version_key(namespace))
+        return version
+    except Exception:
+        logger.exception("Could not read cache version for %s", namespace)
+        return None
+
+
+def versioned_key(namespace: str, version: int, *parts) -> str:
+    return ':'.join([namespace, str(version), *(str(part) for part in parts)])
+
+
+def bump_version(namespace: str) -> Optional[int]:
+    """Returns the new version, or None if there was none to bump."""
+    try:
+        return cache.incr(_version_key(namespace))
+    except ValueError:
+        # No version yet; the next get_version seeds a fresh one.
+        return None
+    except Exception:
+        logger.exception("Could not bump cache version for %s", namespace)
+        return None
+
+
+def bump_version_on_commit(namespace: str) -> None:
+    """Bump once the current transaction commits. Bumping before then would
+    let another worker rebuild from the old rows and store them under the new
+    version, where they would stay until their timeout."""
+    transaction.on_commit(lambda: bump_version(namespace))
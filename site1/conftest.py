@@ -27,11 +27,67 @@ def _reset_rate_cache():
     """ReservationService._RATE_CACHE is a class attribute with a 300s TTL, so
     it outlives individual tests. An empty dict counts as populated, so one
     test priming it against an empty room_price table would make later tests
-    fail rate lookup for reasons unrelated to what they assert."""
+    fail rate lookup for reasons unrelated to what they assert. The shared
+    copy in the default cache outlives them too, so bump its version rather
+    than only dropping the class attribute."""
     from backend.services.services import ReservationService
-    ReservationService._RATE_CACHE = None
+    ReservationService.invalidate_room_rates()
     yield
-    ReservationService._RATE_CACHE = None
+    ReservationService.invalidate_room_rates()
+
+
+@pytest.fixture(autouse=True)
+def _reset_availability_index():
+    """RoomAvailabilityIndex is per-process class state too. Each test rolls
+    its rows back, and sqlite can then hand out the same ids again, so the
+    next test's fingerprint may match an index built from rows that no longer
+    exist."""
+    from data.repos.availability import RoomAvailabilityIndex
+    RoomAvailabilityIndex.invalidate()
+    yield
+    RoomAvailabilityIndex.invalidate()
+
+
+@pytest.fixture(autouse=True)
+def _reset_site_content_cache():
+    """The text_overrides payload sits in the default cache, and its
+    invalidation runs on commit, which a rolled-back test never reaches."""
+    from backend.versioned_cache import bump_version
+    from home.context_processors import SITE_CONTENT_CACHE
+    bump_version(SITE_CONTENT_CACHE)
+    yield
+    bump_version(SITE_CONTENT_CACHE)
+
+
+@pytest.fixture(autouse=True)
+def _reset_image_manifest():
+    """Same as above, for ImageService's manifest of uploaded image names."""
+    from backend.services.services import ImageService
+    from backend.versioned_cache import bump_version
+    bump_version(ImageService.MANIFEST_CACHE)
+    yield
+    bump_version(ImageService.MANIFEST_CACHE)
+
+
+@pytest.fixture(autouse=True)
+def _reset_dashboard_stats():
+    """And for the admin dashboard's booking figures, whose bump on a
+    booking write also waits for a commit."""
+    from backend.services.services import ReservationService
+    from backend.versioned_cache import bump_version
+    bump_version(ReservationService.DASHBOARD_STATS_CACHE)
+    yield
+    bump_version(ReservationService.DASHBOARD_STATS_CACHE)
+
+
+@pytest.fixture(autouse=True)
+def _reset_room_snapshot():
+    """The room dashboard snapshot is patched on commit too, so a rolled-back
+    test would leave its rooms in it."""
+    from backend import room_snapshot
+    room_snapshot.invalidate()
+    yield
+    room_snapshot.invalidate()
 
 
 @pytest.fixture
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Add ImagesRef.ImageHash, the sha256 of ImageData as lowercase hex.
+
+    serve_image uses it as the ETag and ImageService puts a prefix of it in
+    the image URLs, so a revalidation can be answered with a 304 from this
+    column alone and a new upload changes the URL. Without it the only way to
+    tell whether an image changed was to read the whole VARBINARY(MAX) value.
+
+    Existing rows are backfilled here; upload_image sets it from then on.
+    HASHBYTES accepts VARBINARY(MAX) input from SQL Server 2016 on; older
+    servers cap it at 8000 bytes and the backfill UPDATE fails there. CONVERT
+    style 2 gives uppercase hex without the 0x, hence LOWER to match
+    hashlib.hexdigest().
+
+    Each statement runs as its own batch, so the UPDATE compiles after the
+    column exists. ImagesRef is managed = False, hence RunSQL.
+    """
+
+    dependencies = [
+        ('data', '0008_booking_status_check'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "ALTER TABLE ImagesRef ADD ImageHash CHAR(64) NULL;",
+                "UPDATE ImagesRef "
+                "SET ImageHash = LOWER(CONVERT(CHAR(64), HASHBYTES('SHA2_256', ImageData), 2)) "
+                "WHERE ImageHash IS NULL;",
+            ],
+            reverse_sql=[
+                "ALTER TABLE ImagesRef DROP COLUMN ImageHash;",
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Let ImagesRef rows point at files in image storage instead of carrying
+    the image in ImageData.
+
+    ImageWidths lists the widths written to storage under ImageHash (see
+    backend/image_storage.py); a row with it set has no ImageData, so
+    ImageData becomes NULLable. Rows uploaded before this keep their blob and
+    are still served by serve_image until `manage.py offload_images` moves
+    them out.
+
+    Reverse fails, correctly, once any row has a NULL ImageData: run it only
+    before uploading anything new, or put the blobs back first.
+    """
+
+    dependencies = [
+        ('data', '0009_imagesref_image_hash'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "ALTER TABLE ImagesRef ADD ImageWidths NVARCHAR(100) NULL;",
+                "ALTER TABLE ImagesRef ALTER COLUMN ImageData VARBINARY(MAX) NULL;",
+            ],
+            reverse_sql=[
+                "ALTER TABLE ImagesRef ALTER COLUMN ImageData VARBINARY(MAX) NOT NULL;",
+                "ALTER TABLE ImagesRef DROP COLUMN ImageWidths;",
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Track uploads waiting for the background image pipeline.
+
+    upload_image now saves the raw file and returns; resizing and encoding
+    happen on a worker (backend/image_pipeline.py). ImagePendingHash names
+    the saved upload and ImageStatus is what the admin UI polls. Both are
+    NULL for every existing row, which reads as ready.
+
+    ImagesRef is managed = False, hence RunSQL.
+    """
+
+    dependencies = [
+        ('data', '0010_imagesref_storage'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "ALTER TABLE ImagesRef ADD ImagePendingHash CHAR(64) NULL, "
+                "ImageStatus NVARCHAR(20) NULL;",
+                "ALTER TABLE ImagesRef ADD CONSTRAINT chk_image_status "
+                "CHECK (ImageStatus IN ('pending','processing','ready','failed'));",
+            ],
+            reverse_sql=[
+                "ALTER TABLE ImagesRef DROP CONSTRAINT chk_image_status;",
+                "ALTER TABLE ImagesRef DROP COLUMN ImagePendingHash, ImageStatus;",
+            ],
+        ),
+    ]
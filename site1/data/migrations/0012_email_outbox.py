@@ -0,0 +1,68 @@
+from django.db import migrations
+
+# Same problem as 0008: the status CHECK was declared inline, so its name was
+# generated by the server. Find it by column.
+DROP_STATUS_CHECK = """
+DECLARE @name NVARCHAR(128);
+SELECT @name = cc.name
+FROM sys.check_constraints cc
+JOIN sys.columns col
+    ON col.object_id = cc.parent_object_id
+   AND col.column_id = cc.parent_column_id
+WHERE cc.parent_object_id = OBJECT_ID('email_queue')
+  AND col.name = 'status';
+
+IF @name IS NOT NULL
+BEGIN
+    DECLARE @drop_sql NVARCHAR(MAX) =
+        N'ALTER TABLE email_queue DROP CONSTRAINT ' + QUOTENAME(@name) + N';';
+    EXEC sp_executesql @drop_sql;
+END
+"""
+
+
+class Migration(migrations.Migration):
+    """
+    Turn email_queue from a send log into an outbox.
+
+    EmailService._send used to send over SMTP inside the request and log the
+    result here. It now inserts a 'pending' row carrying the rendered message
+    and returns; backend/email_outbox.py claims rows ('sending'), sends them
+    and moves them to sent, back to pending with a later next_attempt_at, or
+    to failed. locked_at lets a row whose worker died be claimed again.
+
+    Existing rows are all sent or failed and keep their meaning. They have no
+    stored body, which only matters to retry_failed_emails.
+
+    email_queue is managed = False, hence RunSQL. Reverse fails, correctly,
+    while any row is still pending or sending: drain the outbox first.
+    """
+
+    dependencies = [
+        ('data', '0011_imagesref_pipeline_status'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                DROP_STATUS_CHECK,
+                "ALTER TABLE email_queue ADD CONSTRAINT chk_email_queue_status "
+                "CHECK (status IN ('pending','sending','sent','failed'));",
+                "ALTER TABLE email_queue ADD "
+                "body_html NVARCHAR(MAX) NULL, "
+                "body_text NVARCHAR(MAX) NULL, "
+                "headers NVARCHAR(MAX) NULL, "
+                "next_attempt_at DATETIME NULL, "
+                "locked_at DATETIME NULL;",
+                "CREATE INDEX ix_email_queue_outbox ON email_queue (status, next_attempt_at);",
+            ],
+            reverse_sql=[
+                "DROP INDEX IF EXISTS ix_email_queue_outbox ON email_queue;",
+                "ALTER TABLE email_queue DROP COLUMN "
+                "body_html, body_text, headers, next_attempt_at, locked_at;",
+                DROP_STATUS_CHECK,
+                "ALTER TABLE email_queue ADD CONSTRAINT chk_email_queue_status "
+                "CHECK (status IN ('sent','failed'));",
+            ],
+        ),
+    ]
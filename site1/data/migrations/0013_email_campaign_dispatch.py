@@ -0,0 +1,64 @@
+from django.db import migrations
+
+# Inline, server-named CHECK again (see 0008); find it by column.
+DROP_STATUS_CHECK = """
+DECLARE @name NVARCHAR(128);
+SELECT @name = cc.name
+FROM sys.check_constraints cc
+JOIN sys.columns col
+    ON col.object_id = cc.parent_object_id
+   AND col.column_id = cc.parent_column_id
+WHERE cc.parent_object_id = OBJECT_ID('email_campaigns')
+  AND col.name = 'status';
+
+IF @name IS NOT NULL
+BEGIN
+    DECLARE @drop_sql NVARCHAR(MAX) =
+        N'ALTER TABLE email_campaigns DROP CONSTRAINT ' + QUOTENAME(@name) + N';';
+    EXEC sp_executesql @drop_sql;
+END
+"""
+
+
+class Migration(migrations.Migration):
+    """
+    Let a campaign be sent by a background job rather than inside the admin's
+    request (backend/campaign_dispatch.py).
+
+    A campaign is 'sending' from the moment the admin presses Send until the
+    job has gone through every subscriber. last_subscriber_id is the job's
+    checkpoint: subscribers are sent in id order and everything up to it is
+    done, so a job that dies resumes after it instead of starting over.
+    heartbeat_at is refreshed at every checkpoint; a 'sending' campaign whose
+    heartbeat is older than EMAIL_CAMPAIGN_LEASE_SECONDS has lost its job and
+    `manage.py send_campaigns` takes it over. sent_count and failed_count now
+    move during the send, which is what the campaigns page polls.
+
+    email_campaigns is managed = False, hence RunSQL. Reverse fails, correctly,
+    while a campaign is still sending.
+    """
+
+    dependencies = [
+        ('data', '0012_email_outbox'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                DROP_STATUS_CHECK,
+                "ALTER TABLE email_campaigns ADD CONSTRAINT chk_email_campaigns_status "
+                "CHECK (status IN ('draft','sending','sent','cancelled'));",
+                "ALTER TABLE email_campaigns ADD "
+                "started_at DATETIME NULL, "
+                "last_subscriber_id INT NULL, "
+                "heartbeat_at DATETIME NULL;",
+            ],
+            reverse_sql=[
+                "ALTER TABLE email_campaigns DROP COLUMN "
+                "started_at, last_subscriber_id, heartbeat_at;",
+                DROP_STATUS_CHECK,
+                "ALTER TABLE email_campaigns ADD CONSTRAINT chk_email_campaigns_status "
+                "CHECK (status IN ('draft','sent','cancelled'));",
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Add a 'dead' status to email_queue for the retry engine
+    (backend/email_retry.py).
+
+    A 'failed' row is no longer final: retry_failed_emails resends it on a
+    backoff. Rows it gives up on, after EMAIL_DEAD_LETTER_ATTEMPTS or because
+    there is nothing to resend, become 'dead' and are left alone.
+
+    email_queue is managed = False, hence RunSQL. 0012 named the CHECK, so it
+    can be dropped by name. Reverse turns dead rows back into failed ones.
+    """
+
+    dependencies = [
+        ('data', '0013_email_campaign_dispatch'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "ALTER TABLE email_queue DROP CONSTRAINT chk_email_queue_status;",
+                "ALTER TABLE email_queue ADD CONSTRAINT chk_email_queue_status "
+                "CHECK (status IN ('pending','sending','sent','failed','dead'));",
+            ],
+            reverse_sql=[
+                "UPDATE email_queue SET status = 'failed' WHERE status = 'dead';",
+                "ALTER TABLE email_queue DROP CONSTRAINT chk_email_queue_status;",
+                "ALTER TABLE email_queue ADD CONSTRAINT chk_email_queue_status "
+                "CHECK (status IN ('pending','sending','sent','failed'));",
+            ],
+        ),
+    ]
@@ -0,0 +1,60 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    """
+    booking_search_terms: the guest search index (data/repos/guest_search.py).
+
+    Guest search was three LIKE '%term%' filters over booking_info, which no
+    index can serve. The table holds each booking's name and email words,
+    email, phone digits (also reversed, for the last digits) and name
+    trigrams, normalised, and is clustered on
+    (kind, term, booking_id) so a prefix or trigram lookup is a seek.
+    search_term_id stays the (nonclustered) primary key for the ORM;
+    ix_booking_search_terms_booking serves rewriting one booking's terms.
+
+    The table starts empty: run `manage.py rebuild_guest_search` after this.
+    booking_search_terms is managed = False, hence RunSQL next to the state
+    operation.
+    """
+
+    dependencies = [
+        ('data', '0014_email_queue_dead_letter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingSearchTerm',
+            fields=[
+                ('search_term_id', models.AutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(max_length=1)),
+                ('term', models.CharField(max_length=64)),
+                ('booking', models.ForeignKey(db_column='booking_id', on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='data.customerbookinginfo')),
+            ],
+            options={
+                'db_table': 'booking_search_terms',
+                'managed': False,
+            },
+        ),
+        migrations.RunSQL(
+            sql=[
+                "CREATE TABLE booking_search_terms ("
+                "search_term_id INT IDENTITY(1,1) NOT NULL "
+                "CONSTRAINT pk_booking_search_terms PRIMARY KEY NONCLUSTERED, "
+                "booking_id INT NOT NULL "
+                "CONSTRAINT fk_booking_search_terms_booking REFERENCES booking_info(booking_id) "
+                "ON DELETE CASCADE, "
+                "kind CHAR(1) NOT NULL "
+                "CONSTRAINT chk_booking_search_terms_kind CHECK (kind IN ('w','e','p','r','g')), "
+                "term NVARCHAR(64) NOT NULL);",
+                "CREATE UNIQUE CLUSTERED INDEX ix_booking_search_terms_term "
+                "ON booking_search_terms (kind, term, booking_id);",
+                "CREATE INDEX ix_booking_search_terms_booking "
+                "ON booking_search_terms (booking_id);",
+            ],
+            reverse_sql=[
+                "DROP TABLE IF EXISTS booking_search_terms;",
+            ],
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Add a 'retrying' status to email_queue for rows the retry engine
+    (backend/email_retry.py) has claimed.
+
+    Retry claims used to be 'sending', the outbox's own in-flight status, so
+    a row a dead retry worker left behind was taken over by the outbox once
+    its lease ran out. A campaign row stores no body, and the outbox sent it
+    blank. 'retrying' rows go back to the retry engine instead.
+
+    email_queue is managed = False, hence RunSQL. Reverse turns retrying rows
+    back into failed ones, due at once.
+    """
+
+    dependencies = [
+        ('data', '0015_booking_search_terms'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "ALTER TABLE email_queue DROP CONSTRAINT chk_email_queue_status;",
+                "ALTER TABLE email_queue ADD CONSTRAINT chk_email_queue_status "
+                "CHECK (status IN ('pending','sending','retrying','sent','failed','dead'));",
+            ],
+            reverse_sql=[
+                "UPDATE email_queue SET status = 'failed', locked_at = NULL, next_attempt_at = NULL "
+                "WHERE status = 'retrying';",
+                "ALTER TABLE email_queue DROP CONSTRAINT chk_email_queue_status;",
+                "ALTER TABLE email_queue ADD CONSTRAINT chk_email_queue_status "
+                "CHECK (status IN ('pending','sending','sent','failed','dead'));",
+            ],
+        ),
+    ]
@@ -3,6 +3,7 @@ from .hotel import (
     User,
     Hotel,
     CustomerBookingInfo,
+    BookingSearchTerm,
     RoomPrice,
     Room,
     RoomAssignment,
@@ -18,6 +19,7 @@ __all__ = [
     'User',
     'Hotel',
     'CustomerBookingInfo',
+    'BookingSearchTerm',
     'RoomPrice',
     'Room',
     'RoomAssignment',
@@ -42,6 +42,8 @@ class EmailCampaign(models.Model):
 
     STATUS_CHOICES = [
         ('draft', 'Draft'),
+        ('sending', 'Sending'),
+        ('retrying', 'Retrying'),
         ('sent', 'Sent'),
         ('cancelled', 'Cancelled'),
     ]
@@ -56,6 +58,10 @@ class EmailCampaign(models.Model):
     recipient_count = models.IntegerField(default=0)
     sent_count = models.IntegerField(default=0)
     failed_count = models.IntegerField(default=0)
+    # Background send checkpoint; see backend/campaign_dispatch.py.
+    started_at = models.DateTimeField(null=True, blank=True)
+    last_subscriber_id = models.IntegerField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
     created_by = models.ForeignKey(
         'User', models.DO_NOTHING, null=True, blank=True, db_column='created_by'
     )
@@ -72,11 +78,17 @@ class EmailCampaign(models.Model):
 
 
 class EmailQueue(models.Model):
-    """Per-send log. One row per send attempt; status is terminal (sent | failed)."""
+    """Outbox and send log. One row per message: EmailService writes it
+    'pending' with the rendered body, backend/email_outbox.py claims it
+    ('sending') and leaves it sent or failed; retry_failed_emails claims
+    failed rows ('retrying') until they are sent or dead."""
 
     STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
         ('sent', 'Sent'),
         ('failed', 'Failed'),
+        ('dead', 'Dead letter'),
     ]
 
     EMAIL_TYPES = [
@@ -110,6 +122,11 @@ class EmailQueue(models.Model):
         'EmailCampaign', models.DO_NOTHING,
         null=True, blank=True, db_column='campaign_id',
     )
+    body_html = models.TextField(null=True, blank=True)
+    body_text = models.TextField(null=True, blank=True)
+    headers = models.TextField(null=True, blank=True)  # JSON object
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         db_table = 'email_queue'
@@ -217,6 +217,29 @@ class CustomerBookingInfo(models.Model):
         return f"Booking #{self.booking_id} - {self.guest_name}"
 
 
+class BookingSearchTerm(models.Model):
+    """One normalised search key of a booking: a word of the guest's name or
+    email, the email, the phone's digits forwards or reversed, or a trigram.
+    Maintained by data/repos/guest_search.py; mapped to booking_search_terms."""
+
+    KIND_WORD = 'w'
+    KIND_EMAIL = 'e'
+    KIND_PHONE = 'p'
+    KIND_PHONE_SUFFIX = 'r'
+    KIND_TRIGRAM = 'g'
+
+    search_term_id = models.AutoField(primary_key=True)
+    booking = models.ForeignKey(
+        'CustomerBookingInfo', models.CASCADE, db_column='booking_id', related_name='search_terms'
+    )
+    kind = models.CharField(max_length=1)
+    term = models.CharField(max_length=64)
+
+    class Meta:
+        db_table = 'booking_search_terms'
+        managed = False
+
+
 class RoomPrice(models.Model):
     """Room pricing information."""
 
@@ -3,8 +3,18 @@ from django.db import models
 class ImagesRef(models.Model):
     ImageId = models.AutoField(primary_key=True)
     ImageName = models.CharField(max_length=100, unique=True)  # Identifier e.g. 'food-1'
-    ImageData = models.BinaryField()  # Stores VARBINARY(MAX)
+    # VARBINARY(MAX). Only rows uploaded before image storage have it; newer
+    # uploads live as files (backend/image_storage.py) and leave it NULL.
+    ImageData = models.BinaryField(null=True)
     ImageContentType = models.CharField(max_length=50, default='image/jpeg')
+    # sha256 hex of the uploaded bytes: the ETag for ImageData rows, and the
+    # name of the variant files otherwise.
+    ImageHash = models.CharField(max_length=64, null=True, blank=True)
+    ImageWidths = models.CharField(max_length=100, null=True, blank=True)  # e.g. '480,960,1600'; NULL = not in storage
+    # An upload waiting for the image pipeline (backend/image_pipeline.py).
+    # The row keeps showing its previous image until the new one is ready.
+    ImagePendingHash = models.CharField(max_length=64, null=True, blank=True)
+    ImageStatus = models.CharField(max_length=20, null=True, blank=True)  # pending/processing/ready/failed; NULL = ready
 
     class Meta:
         db_table = 'ImagesRef'
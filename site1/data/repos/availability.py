@@ -0,0 +1,270 @@
+"""Per-process room availability index.
+
+RoomRepository.get_available_rooms_by_type answers "which rooms of this type
+are free over [check_in, check_out)" with an EXISTS anti-join on
+room_assignments. That is the right query for the final allocation, which has
+to lock what it reads, but every booking POST and every confirm also runs it
+just to decide whether to bother. This index answers that question from memory.
+
+It holds, per room, a sorted list of the room's active assignment intervals,
+built lazily from room_assignments. Writes made through this process
+(RoomRepository.create_assignment, RoomService.deallocate_room/check_out_room)
+patch it in place. Writes made anywhere else -- another worker, hand-run SQL --
+are caught by the fingerprint check that runs before every answer: one
+aggregate over room_assignments, (count, max id) of the active rows, compared
+against the value the index was built from. A mismatch rebuilds.
+
+The fingerprint sees assignments being added and released, nothing else. Two
+kinds of write by another worker leave it unchanged and are only picked up by
+the next rebuild, which _TTL_SECONDS (60s) forces. The TTL is the only
+backstop for them:
+
+  - a room taken out of order, or given another type (the fingerprint does
+    not cover the rooms table). The index is too optimistic meanwhile;
+  - check_in/check_out edited in place on an active assignment (the table
+    has no updated_at to fingerprint). A lengthened stay leaves the index
+    too optimistic; a shortened one leaves it too strict, turning guests
+    away from nights that are free, for up to the TTL.
+
+Too optimistic never double-books: RoomService.allocate_room reads the
+anti-join itself, serialized against other allocations by
+RoomRepository.lock_allocation_window (sp_getapplock per room type and date
+bucket), and locks the room it picks with UPDLOCK/READPAST
+(lock_preferred_room) before writing.
+
+The same state answers the booking calendar (free rooms per type, per night,
+over a window). Built calendars are memoised per (start, end) and the memo is
+dropped on every change the index sees, so a repeat request for the same
+window costs the fingerprint aggregate and nothing else.
+"""
+from __future__ import annotations
+
+import threading
+from bisect import bisect_left, insort
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from data.models.hotel import Room, RoomAssignment
+
+
+def _type_key(room_type):
+    # rooms.room_type is compared under SQL Server's default case-insensitive
+    # collation, which also ignores trailing spaces. Normalise the same way or
+    # the index and the SQL path disagree about which rooms belong to a type:
+    # _canonicalise_room_type hands back '1 bed with balcony' for a row stored
+    # as '1 Bed With Balcony'.
+    return (room_type or '').rstrip().lower()
+
+
+class RoomAvailabilityIndex:
+    """Class-level state, like ReservationService._RATE_CACHE: one copy per
+    worker process, shared by its threads under _lock."""
+
+    _TTL_SECONDS = 60
+
+    _lock = threading.RLock()
+    _rooms = None          # {room_id: (type_key, out_of_order)}
+    _by_type = {}          # {type_key: [room_id, ...]}
+    _intervals = {}        # {room_id: [(check_in, check_out, assignment_id), ...]} by check_in
+    _assignment_rooms = {} # {assignment_id: room_id}, active assignments only
+    _fingerprint = None    # (active_count, max_active_id) the index reflects
+    _loaded_at = None
+    _calendars = {}        # {(start, end): {type_key: [free rooms per night]}}
+
+    _MAX_CALENDARS = 32
+
+    # ---------------- reads ----------------
+
+    @classmethod
+    def available_room_ids(cls, room_type, check_in, check_out):
+        """Room ids of the given type, not out of order, with no active
+        assignment overlapping [check_in, check_out). Same predicate as
+        RoomRepository.get_available_rooms_by_type."""
+        cls._ensure_fresh()
+        with cls._lock:
+            return [
+                room_id
+                for room_id in cls._by_type.get(_type_key(room_type), ())
+                if not cls._rooms[room_id][1]
+                and not cls._overlaps(cls._intervals.get(room_id, ()), check_in, check_out)
+            ]
+
+    @classmethod
+    def count_available(cls, room_type, check_in, check_out):
+        return len(cls.available_room_ids(room_type, check_in, check_out))
+
+    @classmethod
+    def calendar(cls, start, end):
+        """Free room counts for every night in [start, end), per room type:
+        {type_key: [count for start, count for start + 1 day, ...]}. A night
+        is free for a room if no active assignment covers it and the room is
+        not out of order. Types whose rooms are all out of order still appear,
+        with zeros, so the caller can tell sold out from unknown."""
+        cls._ensure_fresh()
+        with cls._lock:
+            built = cls._calendars.get((start, end))
+            if built is None:
+                built = cls._build_calendar(start, end)
+                # Windows are chosen by the browser, so bound the memo rather
+                # than trusting the set of keys to stay small.
+                if len(cls._calendars) >= cls._MAX_CALENDARS:
+                    cls._calendars.clear()
+                cls._calendars[(start, end)] = built
+            return {key: list(counts) for key, counts in built.items()}
+
+    @classmethod
+    def _build_calendar(cls, start, end):
+        nights = (end - start).days
+        free = {}
+        for room_id, (key, out_of_order) in cls._rooms.items():
+            counts = free.setdefault(key, [0] * nights)
+            if out_of_order:
+                continue
+            busy = bytearray(nights)
+            intervals = cls._intervals.get(room_id, ())
+            for check_in, check_out, _id in intervals[:bisect_left(intervals, (end,))]:
+                if check_out <= start:
+                    continue
+                lo = max((check_in - start).days, 0)
+                hi = min((check_out - start).days, nights)
+                busy[lo:hi] = b'\x01' * (hi - lo)
+            for night, taken in enumerate(busy):
+                if not taken:
+                    counts[night] += 1
+        return free
+
+    @staticmethod
+    def _overlaps(intervals, check_in, check_out):
+        # Only intervals starting before check_out can overlap; (check_out,)
+        # sorts ahead of every tuple that starts on check_out itself.
+        cut = bisect_left(intervals, (check_out,))
+        return any(end > check_in for _start, end, _id in intervals[:cut])
+
+    # ---------------- incremental updates ----------------
+    # Deferred to on_commit: an assignment written inside a transaction that
+    # later rolls back (create_reservation aborts after allocate_room, say)
+    # must never reach the index, or it would report a phantom booking as
+    # sold out until the next rebuild.
+
+    @classmethod
+    def record_assignment(cls, assignment):
+        if assignment.status != 'active':
+            return
+        transaction.on_commit(partial(
+            cls._add, assignment.assignment_id, assignment.room_id,
+            assignment.check_in, assignment.check_out,
+        ))
+
+    @classmethod
+    def release_assignment(cls, assignment):
+        transaction.on_commit(partial(cls._remove, assignment.assignment_id))
+
+    @classmethod
+    def record_room(cls, room):
+        transaction.on_commit(partial(
+            cls._set_room, room.room_id, room.room_type, room.housekeeping_status,
+        ))
+
+    @classmethod
+    def invalidate(cls):
+        with cls._lock:
+            cls._rooms = None
+            cls._calendars = {}
+
+    @classmethod
+    def _add(cls, assignment_id, room_id, check_in, check_out):
+        with cls._lock:
+            # A rebuild that ran between the commit and this callback already
+            # has the row; adding it again would also skew the fingerprint.
+            if cls._rooms is None or assignment_id in cls._assignment_rooms:
+                return
+            insort(cls._intervals.setdefault(room_id, []), (check_in, check_out, assignment_id))
+            cls._assignment_rooms[assignment_id] = room_id
+            cls._calendars = {}
+            active, last = cls._fingerprint
+            cls._fingerprint = (active + 1, max(last or 0, assignment_id))
+
+    @classmethod
+    def _remove(cls, assignment_id):
+        with cls._lock:
+            if cls._rooms is None or assignment_id not in cls._assignment_rooms:
+                return
+            room_id = cls._assignment_rooms.pop(assignment_id)
+            cls._intervals[room_id] = [
+                iv for iv in cls._intervals.get(room_id, ()) if iv[2] != assignment_id
+            ]
+            cls._calendars = {}
+            active, _last = cls._fingerprint
+            # The fingerprint's MAX is over active rows only, so releasing the
+            # newest one moves it back to the newest that is still held.
+            cls._fingerprint = (active - 1, max(cls._assignment_rooms, default=None))
+
+    @classmethod
+    def _set_room(cls, room_id, room_type, housekeeping_status):
+        with cls._lock:
+            if cls._rooms is None:
+                return
+            old = cls._rooms.get(room_id)
+            key = _type_key(room_type)
+            if old and old[0] != key:
+                cls._by_type[old[0]].remove(room_id)
+            if not old or old[0] != key:
+                cls._by_type.setdefault(key, []).append(room_id)
+            cls._rooms[room_id] = (key, housekeeping_status == 'out_of_order')
+            cls._calendars = {}
+
+    # ---------------- loading ----------------
+
+    @staticmethod
+    def _read_fingerprint():
+        row = RoomAssignment.objects.filter(status='active').aggregate(
+            active=Count('assignment_id'), last=Max('assignment_id'),
+        )
+        return (row['active'], row['last'])
+
+    @classmethod
+    def _expired(cls):
+        if cls._loaded_at is None:
+            return True
+        return (timezone.now() - cls._loaded_at).total_seconds() > cls._TTL_SECONDS
+
+    @classmethod
+    def _ensure_fresh(cls):
+        # The fingerprint is read outside the lock so concurrent readers do
+        # not queue behind one another's round trip.
+        fingerprint = cls._read_fingerprint()
+        with cls._lock:
+            if cls._rooms is None or fingerprint != cls._fingerprint or cls._expired():
+                cls._load(fingerprint)
+
+    @classmethod
+    def _load(cls, fingerprint):
+        """Rebuild from scratch. `fingerprint` was read before the rows, so a
+        write landing in between leaves the index looking stale, not fresh,
+        and the next check rebuilds again."""
+        rooms, by_type = {}, {}
+        for room_id, room_type, housekeeping in (
+            Room.objects.values_list('room_id', 'room_type', 'housekeeping_status')
+        ):
+            key = _type_key(room_type)
+            rooms[room_id] = (key, housekeeping == 'out_of_order')
+            by_type.setdefault(key, []).append(room_id)
+
+        intervals, assignment_rooms = {}, {}
+        for assignment_id, room_id, check_in, check_out in (
+            RoomAssignment.objects.filter(status='active')
+            .values_list('assignment_id', 'room_id', 'check_in', 'check_out')
+        ):
+            intervals.setdefault(room_id, []).append((check_in, check_out, assignment_id))
+            assignment_rooms[assignment_id] = room_id
+        for room_intervals in intervals.values():
+            room_intervals.sort()
+
+        cls._rooms, cls._by_type = rooms, by_type
+        cls._intervals, cls._assignment_rooms = intervals, assignment_rooms
+        cls._fingerprint = fingerprint
+        cls._loaded_at = timezone.now()
+        cls._calendars = {}
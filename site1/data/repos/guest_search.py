@@ -0,0 +1,231 @@
+"""Guest search over booking_info, by name, email or phone.
+
+search_bookings used to OR three icontains filters. On SQL Server that is
+LIKE '%term%', which no index can serve, so every keystroke in the admin
+search box scanned booking_info.
+
+Instead each booking's searchable fields are kept, normalised, in
+booking_search_terms, clustered on (kind, term, booking_id):
+
+  w  each word of the guest's name and of the email
+  e  the whole email
+  p  the phone's digits, with a +84 prefix written as the local 0
+  r  the same digits reversed, so the last digits of a number are a prefix
+  g  the trigrams of the name's and the email local part's words
+
+Normalised means case-folded with the accents stripped, so 'Nguyễn Đức'
+is stored, and found, as 'nguyen duc'.
+
+A search is answered from that table alone. Each word of the query must be
+the start of some term of the booking (term LIKE 'tok%', a seek on the
+clustered key); a number is looked up as the start or the end of the
+phone, and a leading +84 (or 84) in it is also tried as 0. So the cost follows how many terms share the prefix rather
+than how many bookings there are. Bookings are ranked by how many query
+words matched a term exactly, then newest first. When no booking matches
+every word, the words are compared by trigrams instead, which finds
+misspellings and the middle of names ('guyen', 'nguyn'); bookings sharing
+at least TRIGRAM_SIMILARITY of the query's trigrams are ranked by how many
+they share.
+
+Terms are rewritten when a booking is saved (home/signals.py). Rows written
+by hand, or from before this table, need `manage.py rebuild_guest_search`.
+"""
+from __future__ import annotations
+
+import math
+import re
+import unicodedata
+
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Max, Q, Value, When
+
+from data.models import BookingSearchTerm, CustomerBookingInfo
+
+W, E, P, R, G = (BookingSearchTerm.KIND_WORD, BookingSearchTerm.KIND_EMAIL,
+                 BookingSearchTerm.KIND_PHONE, BookingSearchTerm.KIND_PHONE_SUFFIX,
+                 BookingSearchTerm.KIND_TRIGRAM)
+
+TERM_LENGTH = 64
+# Shorter query words would match too many terms to be worth a seek.
+MIN_PREFIX = 2
+MIN_PHONE_DIGITS = 3
+TRIGRAM_SIMILARITY = 0.5
+
+_WORD = re.compile(r'[a-z0-9]+')
+_PHONE = re.compile(r'[\d\s()+.-]+')
+
+
+def fold(text) -> str:
+    """Lowercase, without accents. đ has no decomposition, so it is mapped
+    by hand."""
+    text = (text or '').casefold().replace('đ', 'd')
+    return ''.join(
+        c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c)
+    )
+
+
+def words(text) -> list:
+    return _WORD.findall(fold(text))
+
+
+def phone_digits(phone) -> str:
+    digits = ''.join(c for c in (phone or '') if c.isdigit())
+    if digits.startswith('84') and len(digits) >= 11:
+        digits = '0' + digits[2:]
+    return digits
+
+
+def trigrams(word: str) -> set:
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def booking_terms(guest_name, email, phone) -> set:
+    """The (kind, term) rows a booking with these fields is indexed under."""
+    email = fold(email).strip()
+    # The domain's words are searchable, but shared by too many bookings to
+    # say anything as trigrams.
+    named = words(guest_name) + words(email.split('@')[0])
+    found = {(W, word) for word in named + words(email)}
+    found |= {(G, gram) for word in named for gram in trigrams(word)}
+    if email:
+        found.add((E, email))
+    digits = phone_digits(phone)
+    if digits:
+        found |= {(P, digits), (R, digits[::-1])}
+    return {(kind, term[:TERM_LENGTH]) for kind, term in found}
+
+
+def _phone_query(search_term) -> list:
+    """The (kind, term) prefixes a number may be found by: the start of the
+    phone, its end, and, for a number typed as +84... or 84..., the start of
+    the local 0... form the stored digits use. A partial number is too
+    short for phone_digits to tell 84 from the start of a local number."""
+    digits = ''.join(c for c in search_term if c.isdigit())
+    if search_term.lstrip().startswith('00'):
+        digits = digits[2:]
+    alternatives = [(P, digits), (R, digits[::-1])]
+    if digits.startswith('84') and len(digits) > 2:
+        alternatives.append((P, '0' + digits[2:]))
+    return [(kind, term[:TERM_LENGTH]) for kind, term in alternatives]
+
+
+def _query_terms(search_term):
+    """What a query looks for: one list per query word of the (kind, term)
+    prefixes, any of which the booking must have."""
+    search_term = (search_term or '').strip()
+    if _PHONE.fullmatch(search_term) and sum(c.isdigit() for c in search_term) >= MIN_PHONE_DIGITS:
+        return [_phone_query(search_term)]
+    tokens = []
+    for piece in search_term.split():
+        if '@' in piece.lstrip('@'):
+            tokens.append([(E, fold(piece)[:TERM_LENGTH])])
+        else:
+            tokens += [[(W, word[:TERM_LENGTH])] for word in words(piece)
+                       if len(word) >= MIN_PREFIX]
+    return tokens
+
+
+def _prefix_matches(tokens):
+    """booking_id and `rank`, for bookings with a term starting with every
+    token."""
+    any_token = Q()
+    matched, exact = [], []
+    for alternatives in tokens:
+        hit, equal = Q(), Q()
+        for kind, term in alternatives:
+            hit |= Q(kind=kind, term__startswith=term)
+            equal |= Q(kind=kind, term=term)
+        any_token |= hit
+        matched.append(Max(Case(When(hit, then=Value(1)), default=Value(0), output_field=IntegerField())))
+        exact.append(Max(Case(When(equal, then=Value(1)), default=Value(0), output_field=IntegerField())))
+    return (
+        BookingSearchTerm.objects.filter(any_token)
+        .values('booking_id')
+        .annotate(matched=sum(matched[1:], matched[0]), rank=sum(exact[1:], exact[0]))
+        .filter(matched=len(tokens))
+    )
+
+
+def _trigram_matches(search_term):
+    grams = set()
+    for word in words(search_term):
+        grams |= trigrams(word)
+    if not grams:
+        return None
+    return (
+        BookingSearchTerm.objects.filter(kind=G, term__in=grams)
+        .values('booking_id')
+        .annotate(rank=Count('term', distinct=True))
+        .filter(rank__gte=math.ceil(len(grams) * TRIGRAM_SIMILARITY))
+    )
+
+
+def matches(search_term):
+    """(booking_id, rank) rows of the bookings `search_term` finds, as a
+    values queryset, or None if it cannot find any."""
+    tokens = _query_terms(search_term)
+    if not tokens:
+        return None
+    found = _prefix_matches(tokens)
+    if tokens[0][0][0] == W and not found.exists():
+        return _trigram_matches(search_term)
+    return found
+
+
+def search(search_term, limit=50) -> list:
+    """Up to `limit` bookings, best match first."""
+    found = matches(search_term)
+    if found is None:
+        return []
+    ranked = [row['booking_id'] for row in found.order_by('-rank', '-booking_id')[:limit]]
+    bookings = CustomerBookingInfo.objects.in_bulk(ranked)
+    return [bookings[booking_id] for booking_id in ranked if booking_id in bookings]
+
+
+def booking_filter(search_term) -> Q:
+    """A filter on booking_info for the bookings `search_term` finds."""
+    found = matches(search_term)
+    if found is None:
+        return Q(pk__in=[])
+    return Q(booking_id__in=found.values('booking_id'))
+
+
+def index_booking(booking_id, guest_name, email, phone) -> None:
+    """Bring one booking's terms up to date, writing only what changed."""
+    wanted = booking_terms(guest_name, email, phone)
+    with transaction.atomic():
+        stored = {
+            (kind, term): pk for pk, kind, term in
+            BookingSearchTerm.objects.filter(booking_id=booking_id)
+            .values_list('search_term_id', 'kind', 'term')
+        }
+        stale = [pk for key, pk in stored.items() if key not in wanted]
+        if stale:
+            BookingSearchTerm.objects.filter(search_term_id__in=stale).delete()
+        BookingSearchTerm.objects.bulk_create([
+            BookingSearchTerm(booking_id=booking_id, kind=kind, term=term)
+            for kind, term in wanted - stored.keys()
+        ])
+
+
+def rebuild(batch_size=1000) -> int:
+    """Index every booking again, a batch at a time. Returns how many."""
+    done, after = 0, 0
+    while True:
+        rows = list(
+            CustomerBookingInfo.objects.filter(booking_id__gt=after)
+            .order_by('booking_id')
+            .values_list('booking_id', 'guest_name', 'email', 'phone')[:batch_size]
+        )
+        if not rows:
+            return done
+        ids = [row[0] for row in rows]
+        with transaction.atomic():
+            BookingSearchTerm.objects.filter(booking_id__in=ids).delete()
+            BookingSearchTerm.objects.bulk_create([
+                BookingSearchTerm(booking_id=booking_id, kind=kind, term=term)
+                for booking_id, name, email, phone in rows
+                for kind, term in booking_terms(name, email, phone)
+            ], batch_size=batch_size)
+        done += len(rows)
+        after = ids[-1]
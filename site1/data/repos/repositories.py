@@ -1,14 +1,28 @@
+import json
 import secrets
+import time
+from collections import namedtuple
 from datetime import timedelta
 
 import nh3
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.core.exceptions import ValidationError
 
 from data.models.hotel import Hotel, Room, RoomAssignment
-from data.models import CustomerBookingInfo, EmailQueue, EmailSubscriber, EmailCampaign, DiscountCode
-from django.db.models import Q, Exists, OuterRef
+from data.models import CustomerBookingInfo, EmailQueue, EmailSubscriber, EmailCampaign, DiscountCode, ImagesRef
+from data.repos import guest_search
+from data.repos.availability import RoomAvailabilityIndex, _type_key
+from django.db import connection, transaction
+from django.db.models import (
+    Count, Exists, F, FilteredRelation, Func, IntegerField, OuterRef, Q, Sum,
+)
+from django.db.models.functions import Substr
 from django.utils import timezone
 
+# What a campaign send needs of a subscriber, without building the model.
+SubscriberRow = namedtuple('SubscriberRow', 'id email name unsubscribe_token user_id')
+
 _DEFAULT_PHONE = getattr(settings, 'HOTEL_DEFAULT_PHONE', '')
 _DEFAULT_EMAIL = getattr(settings, 'HOTEL_DEFAULT_EMAIL', '')
 
@@ -133,19 +147,81 @@ class ReservationRepository:
         ).order_by('check_in')
 
     @staticmethod
-    def search_bookings(search_term):
+    def search_bookings(search_term, limit=50):
         """
-        Search bookings by name, email, or phone
+        Search bookings by name, email, or phone: up to `limit`, best match
+        first (see data/repos/guest_search.py)
         """
-        return (
-            CustomerBookingInfo.objects
-            .filter(
-                Q(guest_name__icontains=search_term) |
-                Q(email__icontains=search_term) |
-                Q(phone__icontains=search_term)
+        return guest_search.search(search_term, limit=limit)
+
+    @staticmethod
+    def search_filter(search_term):
+        return guest_search.booking_filter(search_term)
+
+    # The admin table's badge for a booking, from its dates relative to
+    # today. The conditions are disjoint and follow the badge's precedence:
+    # a booking checking in and out today shows as checking in.
+    STAY_STATUSES = ('checking_in', 'checking_out', 'staying', 'upcoming', 'completed')
+
+    @staticmethod
+    def stay_filter(stays, today):
+        """Bookings whose badge is one of `stays` on `today`."""
+        conditions = {
+            'checking_in': Q(check_in=today),
+            'checking_out': Q(check_out=today) & ~Q(check_in=today),
+            'staying': Q(check_in__lt=today, check_out__gt=today),
+            'upcoming': Q(check_in__gt=today),
+            'completed': Q(check_in__lt=today, check_out__lt=today),
+        }
+        matched = Q(pk__in=[])
+        for stay in stays:
+            matched |= conditions[stay]
+        return matched
+
+    @staticmethod
+    def stay_status(booking, today):
+        if booking['check_in'] == today:
+            return 'checking_in'
+        if booking['check_out'] == today:
+            return 'checking_out'
+        if booking['check_in'] < today < booking['check_out']:
+            return 'staying'
+        if booking['check_in'] > today:
+            return 'upcoming'
+        return 'completed'
+
+    TABLE_COLUMNS = (
+        'booking_id', 'booking_date', 'guest_name', 'email', 'room_type',
+        'check_in', 'check_out', 'adults', 'children', 'total_price',
+    )
+
+    @staticmethod
+    def booking_page(filters, after=None, limit=50):
+        """One page of the admin table: bookings matching `filters` (a Q),
+        newest first, as dicts of TABLE_COLUMNS. Returns (rows, last) where
+        `last` is the (booking_date, booking_id) to pass as `after` for the
+        next page, or None on the last one.
+
+        Keyset, not OFFSET: ordered (booking_date DESC, booking_id), which is
+        ix_booking_date's own key order (the clustered booking_id breaks
+        ties), each page seeks straight past `after` however deep it is, and
+        no COUNT(*) is needed.
+        """
+        qs = CustomerBookingInfo.objects.filter(filters)
+        if after is not None:
+            booking_date, booking_id = after
+            qs = qs.filter(
+                Q(booking_date__lt=booking_date) |
+                Q(booking_date=booking_date, booking_id__gt=booking_id)
             )
-            .order_by('-booking_date', '-check_in')
+        rows = list(
+            qs.order_by('-booking_date', 'booking_id')
+            .values(*ReservationRepository.TABLE_COLUMNS)[:limit + 1]
         )
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, (rows[-1]['booking_date'], rows[-1]['booking_id'])
 
     @staticmethod
     def get_booking_count():
@@ -154,6 +230,20 @@ class ReservationRepository:
         """
         return CustomerBookingInfo.objects.count()
 
+    @staticmethod
+    def dashboard_stats(today):
+        """The admin dashboard's booking figures for `today`, in one
+        conditional-aggregation query rather than one query each."""
+        return CustomerBookingInfo.objects.aggregate(
+            total_reservations=Count('booking_id'),
+            today_checkins=Count('booking_id', filter=Q(check_in=today)),
+            today_checkouts=Count('booking_id', filter=Q(check_out=today)),
+            upcoming_reservations=Count('booking_id', filter=Q(check_in__gt=today)),
+            currently_checked_in=Count('booking_id', filter=Q(check_in__lte=today, check_out__gte=today)),
+            # Revenue from bookings made today.
+            total_revenue=Sum('total_price', filter=Q(booking_date__date=today)),
+        )
+
     @staticmethod
     def get_bookings_today():
         """
@@ -201,7 +291,9 @@ class RoomRepository:
         - have NO active RoomAssignment overlapping [check_in, check_out)
         - have housekeeping_status != 'out_of_order'
 
-        Returns a queryset so the caller can chain .select_for_update().
+        Returns an unevaluated queryset. This is the authoritative path, read
+        by RoomService.allocate_room under lock_allocation_window; counts come
+        from RoomAvailabilityIndex.
         """
         overlapping = RoomAssignment.objects.filter(
             room_id=OuterRef('room_id'),
@@ -215,12 +307,79 @@ class RoomRepository:
             housekeeping_status='out_of_order'
         )
 
+    # Nights are grouped into week-long buckets for locking. Two stays that
+    # overlap share a night, so they share that night's bucket; stays that
+    # are far apart share none and never wait on each other.
+    ALLOCATION_BUCKET_DAYS = 7
+    ALLOCATION_LOCK_TIMEOUT_MS = 10000
+
+    @classmethod
+    def lock_allocation_window(cls, room_type, check_in, check_out):
+        """
+        Serialize room allocation for one room type over [check_in, check_out)
+        against every other allocation that could compete for the same rooms.
+
+        Takes one exclusive SQL Server application lock per (room_type, date
+        bucket) the stay touches, owned by the current transaction, so the
+        caller must be inside transaction.atomic() and the locks release at
+        commit or rollback. Buckets are taken in ascending order so two
+        allocations spanning the same buckets cannot deadlock on each other.
+
+        Only SQL Server has sp_getapplock. SQLite, which the test suite runs
+        on, already serializes writers on the whole database.
+        """
+        if connection.vendor != 'microsoft':
+            return
+        last_night = max(check_out.toordinal() - 1, check_in.toordinal())
+        buckets = range(
+            check_in.toordinal() // cls.ALLOCATION_BUCKET_DAYS,
+            last_night // cls.ALLOCATION_BUCKET_DAYS + 1,
+        )
+        key = _type_key(room_type)
+        with connection.cursor() as cursor:
+            for bucket in buckets:
+                # Room types are nvarchar(50); the resource name limit is 255.
+                cursor.execute(
+                    "SET NOCOUNT ON; DECLARE @result int; "
+                    "EXEC @result = sp_getapplock @Resource=%s, @LockMode='Exclusive', "
+                    "@LockOwner='Transaction', @LockTimeout=%s; SELECT @result;",
+                    [f'room_alloc:{key}:{bucket}', cls.ALLOCATION_LOCK_TIMEOUT_MS],
+                )
+                # 0 granted, 1 granted after waiting; negative is a timeout,
+                # cancellation or deadlock.
+                if cursor.fetchone()[0] < 0:
+                    raise ValidationError(
+                        'Rooms are being booked for these dates right now. Please try again.'
+                    )
+
+    @staticmethod
+    def lock_preferred_room(ranked):
+        """
+        Lock and return the first room of `ranked`, a Room queryset ordered
+        best first (see backend.allocation), that no other transaction holds,
+        or None if it is empty.
+
+        One SELECT TOP 1 ... WITH (ROWLOCK, UPDLOCK, READPAST) with the
+        ranking as its ORDER BY, so only the chosen row is read and locked
+        and a room another transaction is updating is skipped rather than
+        waited on. If every ranked room is held, waits for the best one
+        instead of giving up: the caller already holds lock_allocation_window,
+        so the rooms are free for these dates and the wait is only for a
+        status write to commit.
+        """
+        return (
+            ranked.select_for_update(skip_locked=True).first()
+            or ranked.select_for_update().first()
+        )
+
     @staticmethod
     def count_available_rooms_by_type(room_type, check_in, check_out):
-        """Return the number of available rooms for the given type and date range."""
-        return RoomRepository.get_available_rooms_by_type(
-            room_type, check_in, check_out
-        ).count()
+        """Return the number of available rooms for the given type and date range.
+
+        Answered from the in-memory index, which costs one fingerprint
+        aggregate instead of the anti-join. Advisory only: it takes no locks.
+        """
+        return RoomAvailabilityIndex.count_available(room_type, check_in, check_out)
 
     @staticmethod
     def create_assignment(booking, room, assigned_by=None):
@@ -235,6 +394,7 @@ class RoomRepository:
             status='active',
         )
         assignment.save()
+        RoomAvailabilityIndex.record_assignment(assignment)
         return assignment
 
     @staticmethod
@@ -256,8 +416,253 @@ class RoomRepository:
             room.housekeeping_status = housekeeping_status
         room.updated_at = timezone.now()
         room.save()
+        RoomAvailabilityIndex.record_room(room)
         return room
 
+    # What the room dashboard shows of a stay: v_room_dashboard's columns
+    # plus the booking details its room cards carry.
+    DASHBOARD_STAY_COLUMNS = {
+        'assignment_id': 'stay__assignment_id',
+        'check_in': 'stay__check_in',
+        'check_out': 'stay__check_out',
+        'booking_id': 'stay__booking__booking_id',
+        'guest_name': 'stay__booking__guest_name',
+        'phone': 'stay__booking__phone',
+        'adults': 'stay__booking__adults',
+        'children': 'stay__booking__children',
+        'total_price': 'stay__booking__total_price',
+        'payment_status': 'stay__booking__payment_status',
+    }
+
+    @staticmethod
+    def dashboard_rows(room_filter=None):
+        """
+        v_room_dashboard's join in one query: a row per room and active
+        assignment, or one row with the stay columns null for a room with
+        none. Ordered by floor, room number and check-in. `room_filter`
+        (a Q on rooms) narrows it to the rooms being refreshed.
+        """
+        rooms = Room.objects.all() if room_filter is None else Room.objects.filter(room_filter)
+        return list(
+            rooms.annotate(stay=FilteredRelation('assignments', condition=Q(assignments__status='active')))
+            .order_by('floor_number', 'room_number', 'stay__check_in')
+            .values(
+                'room_id', 'room_code', 'floor_number', 'room_number', 'room_type',
+                'reservation_status', 'housekeeping_status',
+                **{name: F(path) for name, path in RoomRepository.DASHBOARD_STAY_COLUMNS.items()},
+            )
+        )
+
+
+class DataLength(Func):
+    """Size in bytes of a binary value. SQL Server reads it from the LOB's
+    metadata without fetching the value; sqlite's LENGTH does the same for a
+    BLOB."""
+    function = 'DATALENGTH'
+    output_field = IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, function='LENGTH', **extra_context)
+
+
+class ImageRepository:
+    """Data access for ImagesRef (admin-uploaded images stored in the DB)."""
+
+    @staticmethod
+    def list_manifest():
+        """{ImageName: (ImageHash, ImageWidths)} for every stored image.
+        Never reads ImageData. ImageWidths is None for a row whose image is
+        still in ImageData, and ImageHash for one that has not been hashed."""
+        return {
+            name: (image_hash, widths)
+            for name, image_hash, widths in
+            ImagesRef.objects
+            # A first upload still in the pipeline has nothing to show yet.
+            .filter(Q(ImageWidths__isnull=False) | Q(ImageData__isnull=False))
+            .values_list('ImageName', 'ImageHash', 'ImageWidths')
+        }
+
+    @staticmethod
+    def get_metadata(image_name):
+        """The row without ImageData, or None, annotated with ImageLength
+        (bytes in ImageData, None when it is NULL). Enough to answer a
+        conditional or range request."""
+        return (
+            ImagesRef.objects
+            .only('ImageId', 'ImageName', 'ImageContentType', 'ImageHash', 'ImageWidths')
+            .annotate(ImageLength=DataLength('ImageData'))
+            .filter(ImageName=image_name)
+            .first()
+        )
+
+    # Small enough that a few concurrent downloads of multi-MB images do not
+    # show in worker RSS, large enough that a hero image is a handful of
+    # round trips.
+    IMAGE_CHUNK_SIZE = 256 * 1024
+
+    @staticmethod
+    def _read_chunk(image_id, image_hash, position, length):
+        chunk = (
+            ImagesRef.objects
+            .filter(ImageId=image_id, ImageHash=image_hash)
+            # SUBSTRING positions are 1-based.
+            .annotate(chunk=Substr('ImageData', position + 1, length))
+            .values_list('chunk', flat=True)
+            .first()
+        )
+        return bytes(chunk) if chunk else None
+
+    @staticmethod
+    def iter_data(image_id, image_hash, start, end):
+        """Yield ImageData[start:end] in chunks, one SUBSTRING query each, so
+        the whole value is never in memory at once.
+
+        Each query also matches image_hash. If the image is replaced part way
+        through, the next chunk finds no row and iteration stops short rather
+        than splicing two images together; the client sees fewer bytes than
+        Content-Length promised and discards the response.
+        """
+        chunk_size = ImageRepository.IMAGE_CHUNK_SIZE
+        position = start
+        while position < end:
+            chunk = ImageRepository._read_chunk(
+                image_id, image_hash, position, min(chunk_size, end - position),
+            )
+            if not chunk:
+                return
+            yield chunk
+            position += len(chunk)
+
+    @staticmethod
+    async def aiter_data(image_id, image_hash, start, end):
+        """iter_data for ASGI. Django reads a sync iterator under ASGI in one
+        thread for the whole response, tying it up for a slow download; here
+        only each query leaves the event loop."""
+        read_chunk = sync_to_async(ImageRepository._read_chunk)
+        chunk_size = ImageRepository.IMAGE_CHUNK_SIZE
+        position = start
+        while position < end:
+            chunk = await read_chunk(image_id, image_hash, position, min(chunk_size, end - position))
+            if not chunk:
+                return
+            yield chunk
+            position += len(chunk)
+
+    @staticmethod
+    def save_stored(image_name, image_hash, widths):
+        """Upsert a row whose image lives in image storage. Clears any
+        ImageData left from before."""
+        return ImagesRef.objects.update_or_create(
+            ImageName=image_name,
+            defaults={
+                'ImageData': None,
+                'ImageContentType': 'image/jpeg',
+                'ImageHash': image_hash,
+                'ImageWidths': ','.join(str(width) for width in widths),
+            },
+        )
+
+    # ---------------- image pipeline ----------------
+
+    @staticmethod
+    def save_pending(image_name, pending_hash):
+        """Record an upload waiting for the pipeline. Leaves the row's current
+        image, if any, in place until the new one is ready."""
+        return ImagesRef.objects.update_or_create(
+            ImageName=image_name,
+            defaults={'ImagePendingHash': pending_hash, 'ImageStatus': 'pending'},
+        )
+
+    @staticmethod
+    def claim_pending(image_name, statuses=('pending',)):
+        """Mark image_name's pending upload as processing, if it is in one of
+        `statuses`. Returns the pending hash, or None when there is nothing to
+        do or another worker got there first: the UPDATE only matches while
+        the row is still in the state it was read in."""
+        row = (
+            ImagesRef.objects
+            .filter(ImageName=image_name, ImageStatus__in=statuses, ImagePendingHash__isnull=False)
+            .values_list('ImagePendingHash', 'ImageStatus')
+            .first()
+        )
+        if row is None:
+            return None
+        pending_hash, status = row
+        claimed = (
+            ImagesRef.objects
+            .filter(ImageName=image_name, ImagePendingHash=pending_hash, ImageStatus=status)
+            .update(ImageStatus='processing')
+        )
+        return pending_hash if claimed else None
+
+    @staticmethod
+    def finish_pending(image_name, pending_hash, widths):
+        """Point the row at its processed upload. Matches on pending_hash, so
+        a newer upload that arrived meanwhile is not overwritten; returns
+        False in that case."""
+        return bool(
+            ImagesRef.objects
+            .filter(ImageName=image_name, ImagePendingHash=pending_hash)
+            .update(
+                ImageData=None,
+                ImageContentType='image/jpeg',
+                ImageHash=pending_hash,
+                ImageWidths=','.join(str(width) for width in widths),
+                ImagePendingHash=None,
+                ImageStatus='ready',
+            )
+        )
+
+    @staticmethod
+    def fail_pending(image_name, pending_hash):
+        return bool(
+            ImagesRef.objects
+            .filter(ImageName=image_name, ImagePendingHash=pending_hash)
+            .update(ImageStatus='failed')
+        )
+
+    @staticmethod
+    def pending_names(statuses=('pending',)):
+        return list(
+            ImagesRef.objects
+            .filter(ImageStatus__in=statuses, ImagePendingHash__isnull=False)
+            .values_list('ImageName', flat=True)
+        )
+
+    @staticmethod
+    def get_status(image_name):
+        """ImageStatus for one name ('ready' when NULL), or None if there is
+        no such row."""
+        row = (
+            ImagesRef.objects
+            .filter(ImageName=image_name)
+            .values_list('ImageStatus', flat=True)
+        )
+        if not row:
+            return None
+        return row[0] or 'ready'
+
+    # ---------------- inline ImageData ----------------
+
+    @staticmethod
+    def inline_image_ids():
+        """ImageIds of rows still carrying ImageData."""
+        return list(
+            ImagesRef.objects
+            .filter(ImageData__isnull=False, ImageWidths__isnull=True)
+            .values_list('ImageId', flat=True)
+        )
+
+    @staticmethod
+    def get_inline(image_id):
+        """(ImageName, ImageData) for one row, or None."""
+        return (
+            ImagesRef.objects
+            .filter(ImageId=image_id)
+            .values_list('ImageName', 'ImageData')
+            .first()
+        )
+
 
 class EmailRepository:
     """Data access for email_queue, email_subscribers, email_campaigns."""
@@ -265,12 +670,12 @@ class EmailRepository:
     # ---------------- email_queue ----------------
 
     @staticmethod
-    def log_sent(to_email, subject, email_type, template_name=None, to_name=None,
+    def sent_row(to_email, subject, email_type, template_name=None, to_name=None,
                  user=None, related_type=None, related_id=None, campaign=None,
                  provider_msg_id=None):
-        """Insert a 'sent' row into email_queue."""
+        """An unsaved 'sent' email_queue row."""
         now = timezone.now()
-        return EmailQueue.objects.create(
+        return EmailQueue(
             to_email=to_email,
             to_name=to_name,
             subject=subject,
@@ -288,11 +693,11 @@ class EmailRepository:
         )
 
     @staticmethod
-    def log_failed(to_email, subject, email_type, error, template_name=None,
+    def failed_row(to_email, subject, email_type, error, template_name=None,
                    to_name=None, user=None, related_type=None, related_id=None,
                    campaign=None):
-        """Insert a 'failed' row into email_queue."""
-        return EmailQueue.objects.create(
+        """An unsaved 'failed' email_queue row."""
+        return EmailQueue(
             to_email=to_email,
             to_name=to_name,
             subject=subject,
@@ -308,39 +713,127 @@ class EmailRepository:
             campaign=campaign,
         )
 
+    @classmethod
+    def log_sent(cls, *args, **kwargs):
+        """Insert a 'sent' row into email_queue."""
+        row = cls.sent_row(*args, **kwargs)
+        row.save(force_insert=True)
+        return row
+
+    @classmethod
+    def log_failed(cls, *args, **kwargs):
+        """Insert a 'failed' row into email_queue."""
+        row = cls.failed_row(*args, **kwargs)
+        row.save(force_insert=True)
+        return row
+
+    # ---------------- outbox ----------------
+
     @staticmethod
-    def get_failed(limit=None):
-        qs = EmailQueue.objects.filter(status='failed').order_by('-created_at')
-        if limit:
-            qs = qs[:limit]
-        return qs
+    def enqueue(to_email, subject, email_type, body_html, body_text=None, headers=None,
+                template_name=None, to_name=None, user=None, related_type=None,
+                related_id=None, campaign=None):
+        """Insert a 'pending' row carrying everything needed to send it.
+        attempts counts sends tried, so it starts at 0."""
+        return EmailQueue.objects.create(
+            to_email=to_email,
+            to_name=to_name,
+            subject=subject,
+            template_name=template_name,
+            email_type=email_type,
+            status='pending',
+            attempts=0,
+            body_html=body_html,
+            body_text=body_text,
+            headers=json.dumps(headers) if headers else None,
+            created_at=timezone.now(),
+            user=user,
+            related_type=related_type,
+            related_id=related_id,
+            campaign=campaign,
+        )
 
     @staticmethod
-    def mark_retried_sent(email_id, provider_msg_id=None):
-        """Update an existing failed row after a successful retry."""
-        try:
-            row = EmailQueue.objects.get(id=email_id)
-        except EmailQueue.DoesNotExist:
-            return None
-        row.status = 'sent'
-        row.attempts = (row.attempts or 0) + 1
-        row.sent_at = timezone.now()
-        row.error_message = None
-        if provider_msg_id:
-            row.provider_msg_id = provider_msg_id
-        row.save(update_fields=['status', 'attempts', 'sent_at', 'error_message', 'provider_msg_id'])
-        return row
+    def claim_outbox(limit, lease_seconds):
+        """Claim up to `limit` due rows for one worker: mark them 'sending',
+        stamp locked_at and count the attempt. Returns the claimed rows.
+
+        Rows another worker has locked are skipped rather than waited on
+        (select_for_update(skip_locked=True), READPAST on SQL Server), so
+        several workers drain the outbox side by side without sending a row
+        twice. A 'sending' row whose lease has run out belongs to a worker
+        that died mid-send and is claimed again; that message may go out
+        twice, which beats never.
+        """
+        now = timezone.now()
+        due = (
+            Q(status='pending') & (Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+        ) | Q(status='sending', locked_at__lt=now - timedelta(seconds=lease_seconds))
+        return EmailRepository._claim(due, limit, now)
 
     @staticmethod
-    def mark_retried_failed(email_id, error):
-        try:
-            row = EmailQueue.objects.get(id=email_id)
-        except EmailQueue.DoesNotExist:
-            return None
-        row.attempts = (row.attempts or 0) + 1
-        row.error_message = str(error)[:4000] if error else None
-        row.save(update_fields=['attempts', 'error_message'])
-        return row
+    def claim_failed(limit, lease_seconds):
+        """Claim up to `limit` failed rows whose retry is due, for the retry
+        engine (backend/email_retry.py), the same way claim_outbox does.
+
+        Claimed rows are 'retrying', not 'sending': a campaign row stores no
+        body, so only the retry engine can rebuild its message, and the
+        outbox must never take one over. A 'retrying' row whose lease has run
+        out belongs to a retry worker that died and is claimed here again.
+        """
+        now = timezone.now()
+        due = (
+            Q(status='failed') & (Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+        ) | Q(status='retrying', locked_at__lt=now - timedelta(seconds=lease_seconds))
+        return EmailRepository._claim(due, limit, now, status='retrying')
+
+    @staticmethod
+    def _claim(due, limit, now, status='sending'):
+        with transaction.atomic():
+            ids = list(
+                EmailQueue.objects
+                .select_for_update(skip_locked=True)
+                .filter(due)
+                .order_by('id')
+                .values_list('id', flat=True)[:limit]
+            )
+            if not ids:
+                return []
+            EmailQueue.objects.filter(id__in=ids).update(
+                status=status, locked_at=now, attempts=F('attempts') + 1,
+            )
+        return list(EmailQueue.objects.filter(id__in=ids).order_by('id'))
+
+    @staticmethod
+    def mark_outbox_sent(email_id, provider_msg_id=None):
+        EmailQueue.objects.filter(id=email_id).update(
+            status='sent', sent_at=timezone.now(), provider_msg_id=provider_msg_id,
+            error_message=None, locked_at=None, next_attempt_at=None,
+        )
+
+    @staticmethod
+    def mark_outbox_retry(email_id, error, next_attempt_at):
+        """Back to pending, not to be claimed before next_attempt_at."""
+        EmailQueue.objects.filter(id=email_id).update(
+            status='pending', error_message=str(error)[:4000] if error else None,
+            locked_at=None, next_attempt_at=next_attempt_at,
+        )
+
+    @staticmethod
+    def mark_outbox_failed(email_id, error, next_attempt_at=None):
+        """Failed; retry_failed_emails tries it again from next_attempt_at."""
+        EmailQueue.objects.filter(id=email_id).update(
+            status='failed', error_message=str(error)[:4000] if error else None,
+            locked_at=None, next_attempt_at=next_attempt_at,
+        )
+
+    @staticmethod
+    def mark_outbox_dead(email_id, error):
+        """Dead letter: never retried again. Only a human can revive it."""
+        EmailQueue.objects.filter(id=email_id).update(
+            status='dead', error_message=str(error)[:4000] if error else None,
+            locked_at=None, next_attempt_at=None,
+        )
 
     @staticmethod
     def delete_older_than(days):
@@ -409,6 +902,10 @@ class EmailRepository:
         subscriber.save(update_fields=['status', 'unsubscribed_at'])
         return subscriber
 
+    @staticmethod
+    def get_subscriber(subscriber_id):
+        return EmailSubscriber.objects.filter(id=subscriber_id).first()
+
     @staticmethod
     def get_by_email(email):
         return EmailSubscriber.objects.filter(email__iexact=(email or '').strip()).first()
@@ -426,6 +923,23 @@ class EmailRepository:
     def active_subscribers():
         return EmailSubscriber.objects.filter(status='subscribed').order_by('email')
 
+    @staticmethod
+    def iter_active_subscribers(after_id=None, batch_size=500):
+        """Every active subscriber with an id after `after_id` (None to
+        start), in id order, as SubscriberRow tuples. Read a page of
+        `batch_size` at a time (WHERE id > last ORDER BY id), so a campaign
+        holds one page in memory however long the list is, and the last id
+        yielded is a position to resume from."""
+        qs = EmailSubscriber.objects.filter(status='subscribed').order_by('id')
+        while True:
+            page = qs.filter(id__gt=after_id) if after_id is not None else qs
+            rows = list(page.values_list(*SubscriberRow._fields)[:batch_size])
+            for row in rows:
+                yield SubscriberRow._make(row)
+            if len(rows) < batch_size:
+                return
+            after_id = rows[-1][0]
+
     # ---------------- email_campaigns ----------------
 
     # campaign.body_html is rendered with |safe into the outgoing email, so it
@@ -498,19 +1012,146 @@ class EmailRepository:
     def list_campaigns():
         return EmailCampaign.objects.all().order_by('-created_at')
 
+    # A campaign is sent by a background job (backend/campaign_dispatch.py):
+    # draft -> sending here, checkpointed per batch, -> sent at the end.
+
     @staticmethod
-    def mark_campaign_sent(campaign_id, recipient_count, sent_count, failed_count):
-        camp = EmailCampaign.objects.filter(id=campaign_id).first()
-        if not camp:
-            return None
-        camp.status = 'sent'
-        camp.sent_at = timezone.now()
-        camp.recipient_count = recipient_count
-        camp.sent_count = sent_count
-        camp.failed_count = failed_count
-        camp.updated_at = timezone.now()
-        camp.save()
-        return camp
+    def start_campaign(campaign_id, recipient_count):
+        """Move a draft to 'sending'. False if it was not a draft, e.g. a
+        second click on Send got here first."""
+        now = timezone.now()
+        return EmailCampaign.objects.filter(id=campaign_id, status='draft').update(
+            status='sending', started_at=now, updated_at=now,
+            recipient_count=recipient_count, sent_count=0, failed_count=0,
+            last_subscriber_id=None, heartbeat_at=None,
+        ) == 1
+
+    @staticmethod
+    def claim_campaign(campaign_id, lease_seconds):
+        """Take a 'sending' campaign for this job. False while another job's
+        heartbeat is fresher than the lease, so two never send it at once."""
+        now = timezone.now()
+        stale = Q(heartbeat_at__isnull=True) | Q(heartbeat_at__lt=now - timedelta(seconds=lease_seconds))
+        return EmailCampaign.objects.filter(stale, id=campaign_id, status='sending').update(
+            heartbeat_at=now,
+        ) == 1
+
+    @staticmethod
+    def release_campaign(campaign_id):
+        """Let the next claim_campaign take a 'sending' campaign at once."""
+        EmailCampaign.objects.filter(id=campaign_id, status='sending').update(heartbeat_at=None)
+
+    @staticmethod
+    def campaign_log(campaign_id, flush_size, heartbeat_seconds=None):
+        """A CampaignLogWriter for one run of a campaign send."""
+        return CampaignLogWriter(campaign_id, flush_size, heartbeat_seconds)
+
+    @staticmethod
+    def sending_campaign_ids():
+        return list(
+            EmailCampaign.objects.filter(status='sending').order_by('id').values_list('id', flat=True)
+        )
+
+    @staticmethod
+    def checkpoint_campaign(campaign_id, last_subscriber_id, sent, failed):
+        """Record a finished batch: everything up to last_subscriber_id is
+        done, plus sent/failed more. False if the campaign is no longer
+        'sending' (cancelled), which tells the job to stop."""
+        now = timezone.now()
+        return EmailCampaign.objects.filter(id=campaign_id, status='sending').update(
+            last_subscriber_id=last_subscriber_id,
+            sent_count=F('sent_count') + sent,
+            failed_count=F('failed_count') + failed,
+            heartbeat_at=now, updated_at=now,
+        ) == 1
+
+    @staticmethod
+    def campaign_recipient_resent(campaign_id):
+        """A recipient the campaign counted as failed was sent on retry."""
+        EmailCampaign.objects.filter(id=campaign_id, failed_count__gt=0).update(
+            sent_count=F('sent_count') + 1, failed_count=F('failed_count') - 1,
+            updated_at=timezone.now(),
+        )
+
+    @staticmethod
+    def mark_campaign_sent(campaign_id):
+        """'sending' -> 'sent'. recipient_count becomes the number actually
+        attempted: subscribers may have come and gone during the send."""
+        now = timezone.now()
+        EmailCampaign.objects.filter(id=campaign_id, status='sending').update(
+            status='sent', sent_at=now, updated_at=now, heartbeat_at=None,
+            recipient_count=F('sent_count') + F('failed_count'),
+        )
+        return EmailCampaign.objects.filter(id=campaign_id).first()
+
+
+class CampaignLogWriter:
+    """Buffers a campaign's send log and checkpoint.
+
+    Logging each recipient was one INSERT round trip apiece. The writer keeps
+    the rows (EmailRepository.sent_row/failed_row) and writes them together
+    with the checkpoint: one bulk_create and one UPDATE of the campaign's
+    counters, last_subscriber_id and heartbeat per flush, in one transaction
+    so the log and the counters always agree.
+
+    The flush is also the job's heartbeat. A slow send (a low
+    EMAIL_CAMPAIGN_RATE, a sluggish relay) may take longer than the lease to
+    fill flush_size rows, and send_campaigns would then take over a job that
+    is still running. So a checkpoint also flushes once heartbeat_seconds
+    have passed since the last write, however few rows are waiting.
+
+    Rows only become flushable once checkpoint() says every subscriber up to
+    an id is done. Rows added after that (a batch cut short by an error) are
+    never written: the resumed send goes through those subscribers again and
+    logs them then.
+    """
+
+    def __init__(self, campaign_id, flush_size, heartbeat_seconds=None):
+        self.campaign_id = campaign_id
+        self.flush_size = max(1, flush_size)
+        self.heartbeat_seconds = heartbeat_seconds
+        # Claiming the campaign wrote the first heartbeat.
+        self._written_at = time.monotonic()
+        self._rows = []
+        self._done = 0  # rows up to here are covered by the checkpoint
+        self._last_subscriber_id = None
+
+    def add(self, row):
+        self._rows.append(row)
+
+    def checkpoint(self, last_subscriber_id):
+        """Everything up to last_subscriber_id is sent and added. Flushes once
+        flush_size rows are waiting, or the heartbeat is due. False if the
+        flush found the campaign no longer 'sending', which tells the job to
+        stop."""
+        self._done = len(self._rows)
+        self._last_subscriber_id = last_subscriber_id
+        heartbeat_due = (
+            self.heartbeat_seconds is not None
+            and time.monotonic() - self._written_at >= self.heartbeat_seconds
+        )
+        if self._done >= self.flush_size or heartbeat_due:
+            return self.flush()
+        return True
+
+    def flush(self):
+        """Write the checkpointed rows and advance the campaign. False if it
+        is no longer 'sending'; the rows are written regardless, as those
+        messages did go out."""
+        if self._last_subscriber_id is None:
+            return True
+        rows = self._rows[:self._done]
+        sent = sum(1 for row in rows if row.status == 'sent')
+        with transaction.atomic():
+            EmailQueue.objects.bulk_create(rows)
+            sending = EmailRepository.checkpoint_campaign(
+                self.campaign_id, self._last_subscriber_id, sent, len(rows) - sent,
+            )
+        del self._rows[:self._done]
+        self._done = 0
+        self._last_subscriber_id = None
+        self._written_at = time.monotonic()
+        return sending
 
 
 class DiscountRepository:
@@ -21,3 +21,5 @@ class HomeConfig(AppConfig):
             Command as StaticfilesRunserverCommand,
         )
         StaticfilesRunserverCommand.default_addr = 'localhost'
+
+        from home import signals  # noqa: F401 - connects the receivers
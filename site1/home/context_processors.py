@@ -1,5 +1,9 @@
 ﻿import json
 
+from django.core.cache import cache
+
+from backend.versioned_cache import get_version, versioned_key
+
 _CONTENT_DEFAULTS = {
     'hero_subtitle':         'Relax Your Soul',
     'welcome_heading':       'Welcome!',
@@ -26,40 +30,80 @@ _CONTENT_DEFAULTS = {
     'footer_newsletter_copy':   'Occasional updates on availability and seasonal rates.',
 }
 
+# Bumped by home/signals.py on any SiteContent, HotelServices or Hotel write.
+SITE_CONTENT_CACHE = 'site_content'
+# Backstop for rows edited by hand-run SQL, which no signal sees.
+_SITE_CONTENT_TTL_SECONDS = 300
+
+
+def _build_site_content():
+    """Everything text_overrides serves that does not depend on the request.
+    One site_content read, one hotel_info read, one hotel_services read."""
+    from data.models.site_content import SiteContent
+    from data.models import HotelServices
+    from backend.services.services import HotelService
+
+    all_content = list(SiteContent.objects.values_list('content_key', 'content_value'))
+
+    # Inline overrides are keyed page:tag:hash. Split them by page and encode
+    # each page once here, so a render embeds only its own page's slice and
+    # neither the HTML nor the encode cost grows with other pages' edits.
+    by_page = {}
+    for key, value in all_content:
+        if ':' in key:
+            by_page.setdefault(key.split(':', 1)[0], {})[key] = value
+
+    # Global CT dictionary for top-level static site content keys
+    base_keys = {key: value for key, value in all_content if key in _CONTENT_DEFAULTS}
+    ct = {k: base_keys.get(k, v) for k, v in _CONTENT_DEFAULTS.items()}
+
+    hotel = HotelService.get_hotel_info()
+    return {
+        'text_overrides_by_page': {
+            page: json.dumps(overrides, ensure_ascii=False)
+            for page, overrides in by_page.items()
+        },
+        'ct': ct,
+        'hotel_name': hotel['hotel_name'] if hotel else 'Hotel Name Not Found',
+        'hotel': hotel,
+        'hotel_services': list(HotelServices.objects.all()),
+    }
+
+
+def _site_content():
+    version = get_version(SITE_CONTENT_CACHE)
+    if version is None:
+        return _build_site_content()
+    key = versioned_key(SITE_CONTENT_CACHE, version)
+    payload = cache.get(key)
+    if payload is None:
+        payload = _build_site_content()
+        cache.set(key, payload, _SITE_CONTENT_TTL_SECONDS)
+    return payload
+
+
 def text_overrides(request):
     """
-    Inject all inline-edit text overrides into every template context as JSON.  
-    Keys with ':' are inline-edit overrides (page:tag:hash format).
-    Embedded in the page so JS can apply them instantly with no AJAX flash.
+    Inject inline-edit text overrides into every template context as JSON,
+    one string per page. Keys with ':' are inline-edit overrides
+    (page:tag:hash format). base.html embeds the current page's string (see
+    home/templatetags/inline_overrides.py) so JS can apply them instantly with
+    no AJAX flash.
+
+    Runs on every rendered page, so the request-independent part is built
+    once per site-content version and served from the cache after that.
     """
     try:
-        from data.models.site_content import SiteContent
-        from data.models import HotelServices
-        from backend.services.services import HotelService
-        
-        # Load all content keys to provide defaults and overrides globally
-        all_content = SiteContent.objects.all()
-        inline_overrides = {c.content_key: c.content_value for c in all_content if ':' in c.content_key}
-        
-        # Global CT dictionary for top-level static site content keys
-        base_keys = {c.content_key: c.content_value for c in all_content if c.content_key in _CONTENT_DEFAULTS.keys()}
-        ct = {k: base_keys.get(k, v) for k, v in _CONTENT_DEFAULTS.items()}
-        
-        return {
-            'text_overrides_json': json.dumps(inline_overrides, ensure_ascii=False),   
-            'ct': ct,
-            'is_admin_user': (
-                request.user.is_authenticated
-                and hasattr(request.user, 'role')
-                and request.user.role == 'admin'
-            ),
-            'hotel_name': HotelService.get_hotel_name(),
-            'hotel': HotelService.get_hotel_info(),
-            'hotel_services': HotelServices.objects.all(),
-        }
+        context = dict(_site_content())
+        context['is_admin_user'] = (
+            request.user.is_authenticated
+            and hasattr(request.user, 'role')
+            and request.user.role == 'admin'
+        )
+        return context
     except Exception:
         return {
-            'text_overrides_json': '{}',
+            'text_overrides_by_page': {},
             'ct': _CONTENT_DEFAULTS,
             'is_admin_user': False,
             'hotel_name': 'Thiên Tài Hotel',
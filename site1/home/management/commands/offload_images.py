@@ -0,0 +1,37 @@
+"""Move images uploaded before image storage out of ImagesRef.ImageData.
+
+Usage:
+    python manage.py offload_images
+
+Each row still carrying ImageData is re-processed as if freshly uploaded: its
+variants are written to the `images` storage and the row keeps only their
+hash and widths. One row is read at a time, so a table of large images never
+sits in memory at once. Safe to re-run; rows already moved are skipped, and
+a row that fails keeps its ImageData and is still served by serve_image.
+"""
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand
+
+from backend.services.services import ImageService
+from data.repos.repositories import ImageRepository
+
+
+class Command(BaseCommand):
+    help = "Write ImageData rows to image storage and drop their blobs."
+
+    def handle(self, *args, **opts):
+        moved = failed = 0
+        for image_id in ImageRepository.inline_image_ids():
+            row = ImageRepository.get_inline(image_id)
+            if row is None:
+                continue
+            name, data = row
+            try:
+                ImageService.store_upload(name, bytes(data))
+            except Exception as exc:
+                failed += 1
+                self.stderr.write(f'{name}: {exc}')
+                continue
+            moved += 1
+        self.stdout.write(self.style.SUCCESS(f'Moved {moved} image(s); {failed} failed.'))
@@ -0,0 +1,41 @@
+"""Process image uploads the background pipeline did not finish.
+
+Usage:
+    python manage.py process_images [--retry-failed] [--stuck]
+
+The pipeline's thread pool lives in each web worker, so an upload queued
+just before a restart is never processed and its row stays pending. Run this
+from cron, or after a deploy, to pick those up. --retry-failed also retries
+failed uploads. --stuck also takes rows left in processing by a worker that
+died mid-job; only use it when no worker can still be running one.
+"""
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand
+
+from backend.services.services import ImageService
+from data.repos.repositories import ImageRepository
+
+
+class Command(BaseCommand):
+    help = "Process image uploads still waiting for the pipeline."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true')
+        parser.add_argument('--stuck', action='store_true')
+
+    def handle(self, *args, **opts):
+        statuses = ['pending']
+        if opts['retry_failed']:
+            statuses.append('failed')
+        if opts['stuck']:
+            statuses.append('processing')
+
+        counts = {'ready': 0, 'failed': 0}
+        for name in ImageRepository.pending_names(statuses):
+            result = ImageService.process_upload(name, statuses)
+            if result in counts:
+                counts[result] += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {counts['ready']} image(s); {counts['failed']} failed."
+        ))
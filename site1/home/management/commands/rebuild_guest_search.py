@@ -0,0 +1,29 @@
+"""Rebuild booking_search_terms, the guest search index, from booking_info.
+
+Usage:
+    python manage.py rebuild_guest_search
+    python manage.py rebuild_guest_search --batch-size 5000
+
+Saving a booking through the ORM keeps its terms current (home/signals.py).
+Run this once after migration 0015 creates the table, and after bookings are
+written with SQL directly; until then those bookings cannot be searched.
+"""
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand
+
+from data.repos import guest_search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the guest search terms of every booking."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Bookings reindexed per transaction (default 1000).'
+        )
+
+    def handle(self, *args, **opts):
+        done = guest_search.rebuild(batch_size=opts['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {done} booking(s).'))
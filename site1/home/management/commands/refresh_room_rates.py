@@ -0,0 +1,24 @@
+"""Reload room rates in every worker after room_price was edited by hand.
+
+Usage:
+    python manage.py refresh_room_rates
+
+Rates are cached per worker and in the shared Django cache. ORM writes to
+room_price invalidate both (home/signals.py); SQL run directly against the
+table does not, and without this command workers keep the old prices for up to
+ReservationService._RATE_CACHE_TTL_SECONDS.
+"""
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand
+
+from backend.services.services import ReservationService
+
+
+class Command(BaseCommand):
+    help = "Invalidate cached room rates in all workers and reload them."
+
+    def handle(self, *args, **opts):
+        ReservationService.refresh_room_rates()
+        rates = ReservationService.get_room_rates()
+        self.stdout.write(self.style.SUCCESS(f'Reloaded {len(rates)} room rate(s).'))
@@ -0,0 +1,67 @@
+"""Send queued email from the email_queue outbox.
+
+Usage:
+    python manage.py run_email_worker              # poll until stopped
+    python manage.py run_email_worker --once       # drain what is due, then exit
+    python manage.py run_email_worker --interval 2
+
+EmailService queues messages as 'pending' rows and returns; this process
+sends them (see backend/email_outbox.py). Run one or several: each claims
+rows the others are not holding. Stop it with SIGINT/SIGTERM; a message it
+was sending is picked up by the next worker once its lease runs out.
+"""
+from __future__ import annotations
+
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from backend import email_outbox
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = "Send pending email_queue rows, retrying failures with backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Drain what is due now and exit (for cron).'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=5.0,
+            help='Seconds to wait when the outbox is empty (default 5).'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=email_outbox.BATCH_SIZE,
+            help=f'Rows claimed per round trip (default {email_outbox.BATCH_SIZE}).'
+        )
+
+    def handle(self, *args, **opts):
+        if opts['once']:
+            sent, unsent = email_outbox.drain(opts['batch_size'])
+            self.stdout.write(f'Sent {sent} email(s); {unsent} not sent.')
+            return
+
+        self.stdout.write('Email worker running. Ctrl+C to stop.')
+        try:
+            while True:
+                # A worker that runs for days must not hold a connection the
+                # server has since dropped.
+                close_old_connections()
+                try:
+                    sent, unsent = email_outbox.drain(opts['batch_size'])
+                except Exception:
+                    # A database or SMTP outage must not stop the worker:
+                    # claimed rows come back when their lease runs out.
+                    logger.exception("Email outbox drain failed; retrying")
+                    time.sleep(opts['interval'])
+                    continue
+                if sent or unsent:
+                    self.stdout.write(f'Sent {sent} email(s); {unsent} not sent.')
+                else:
+                    time.sleep(opts['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Email worker stopped.')
@@ -0,0 +1,43 @@
+"""Resume campaign sends whose background job died.
+
+Usage:
+    python manage.py send_campaigns [--campaign ID]
+
+A campaign is sent by a thread in the web worker that started it
+(backend/campaign_dispatch.py). If that worker exits mid-send the campaign
+stays 'sending' and its heartbeat stops; once the heartbeat is older than
+EMAIL_CAMPAIGN_LEASE_SECONDS this command takes it over and carries on from
+its checkpoint. Run it from cron, or after a deploy. A campaign whose job is
+still alive is left alone.
+"""
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand
+
+from backend import campaign_dispatch
+from data.repos.repositories import EmailRepository
+
+
+class Command(BaseCommand):
+    help = "Resume 'sending' email campaigns whose background job has stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--campaign', type=int, help='Only this campaign id.')
+
+    def handle(self, *args, **opts):
+        ids = [opts['campaign']] if opts['campaign'] else EmailRepository.sending_campaign_ids()
+        resumed = 0
+        for campaign_id in ids:
+            try:
+                result = campaign_dispatch.dispatch(campaign_id)
+            except Exception as exc:
+                # dispatch checkpointed and released it; the next run resumes.
+                self.stderr.write(f'  #{campaign_id}: stopped by an error: {exc}')
+                continue
+            if result is None:
+                self.stdout.write(f'  #{campaign_id}: not sending, or its job is still running')
+                continue
+            resumed += 1
+            sent, failed = result
+            self.stdout.write(self.style.SUCCESS(f'  #{campaign_id}: {sent} sent, {failed} failed'))
+        self.stdout.write(f'Resumed {resumed} campaign(s).')
@@ -0,0 +1,62 @@
+"""Model signal receivers that keep process caches, the guest search terms
+and the room dashboard snapshot honest.
+
+Connected from HomeConfig.ready(). They cover writes made through the ORM.
+Hand-run SQL bypasses them: those caches fall back to their TTLs, room
+rates can be reloaded at once with `manage.py refresh_room_rates`, and
+search terms with `manage.py rebuild_guest_search`.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from backend import room_snapshot
+from backend.services.services import ImageService, ReservationService
+from backend.versioned_cache import bump_version_on_commit
+from data.models import (
+    CustomerBookingInfo, Hotel, HotelServices, ImagesRef, Room, RoomAssignment, RoomPrice,
+)
+from data.models.site_content import SiteContent
+from data.repos import guest_search
+from home.context_processors import SITE_CONTENT_CACHE
+
+
+@receiver([post_save, post_delete], sender=RoomPrice)
+def room_price_changed(sender, **kwargs):
+    # After commit: bumping first would let another worker reload the old
+    # rows and store them under the new version.
+    transaction.on_commit(ReservationService.invalidate_room_rates)
+
+
+@receiver([post_save, post_delete], sender=SiteContent)
+@receiver([post_save, post_delete], sender=HotelServices)
+@receiver([post_save, post_delete], sender=Hotel)
+def site_content_changed(sender, **kwargs):
+    bump_version_on_commit(SITE_CONTENT_CACHE)
+
+
+@receiver([post_save, post_delete], sender=ImagesRef)
+def image_changed(sender, **kwargs):
+    bump_version_on_commit(ImageService.MANIFEST_CACHE)
+
+
+@receiver([post_save, post_delete], sender=CustomerBookingInfo)
+def booking_changed(sender, **kwargs):
+    bump_version_on_commit(ReservationService.DASHBOARD_STATS_CACHE)
+
+
+@receiver(post_save, sender=CustomerBookingInfo)
+def booking_saved(sender, instance, **kwargs):
+    # Deletes need nothing: the terms cascade with the booking.
+    guest_search.index_booking(instance.booking_id, instance.guest_name, instance.email, instance.phone)
+    room_snapshot.record_booking(instance.booking_id)
+
+
+@receiver([post_save, post_delete], sender=Room)
+def room_changed(sender, instance, **kwargs):
+    room_snapshot.record_room(instance.room_id)
+
+
+@receiver([post_save, post_delete], sender=RoomAssignment)
+def assignment_changed(sender, instance, **kwargs):
+    room_snapshot.record_room(instance.room_id)
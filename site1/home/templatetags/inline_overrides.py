@@ -0,0 +1,40 @@
+"""Template tags for the admin inline-edit overrides (static/js/admin-edit.js).
+
+Override keys are page:tag:hash, where page is the template's page_id block.
+base.html captures that block once with {% page_id %} and then embeds only
+that page's overrides with {% inline_overrides_json %}, instead of the whole
+site_content table on every page.
+"""
+from django import template
+
+register = template.Library()
+
+
+class PageIdNode(template.Node):
+    def __init__(self, nodelist):
+        self.nodelist = nodelist
+
+    def render(self, context):
+        # Set on the current context level, not a pushed one, so the rest of
+        # the template rendering at this level can read it.
+        context['page_id'] = self.nodelist.render(context).strip()
+        return ''
+
+
+@register.tag
+def page_id(parser, token):
+    """{% page_id %}{% block page_id %}default{% endblock %}{% endpage_id %}
+
+    Renders its contents into the `page_id` context variable. A parent
+    template cannot read a child's block otherwise, and the page id is needed
+    twice: once for the JS and once to pick the overrides."""
+    nodelist = parser.parse(('endpage_id',))
+    parser.delete_first_token()
+    return PageIdNode(nodelist)
+
+
+@register.simple_tag(takes_context=True)
+def inline_overrides_json(context, page):
+    """The JSON object of overrides for one page, precomputed by the
+    text_overrides context processor."""
+    return context.get('text_overrides_by_page', {}).get(page, '{}')
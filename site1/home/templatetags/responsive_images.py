@@ -0,0 +1,26 @@
+"""Template tags for the ImageSource values ImageService resolves.
+
+{% image_sources %} goes inside a <picture>, ahead of the <img> it serves:
+
+    <picture>{% image_sources page_images.food_1 "(min-width: 992px) 58vw, 100vw" %}<img src="{{ page_images.food_1 }}" ...></picture>
+
+For an upload in image storage it emits one <source> per format, WebP first,
+each listing every stored width, and the browser picks both. For a static
+file or an image still in ImageData it emits nothing and the <img> stands
+alone.
+"""
+from django import template
+from django.utils.html import format_html_join
+
+register = template.Library()
+
+
+@register.simple_tag
+def image_sources(image, sizes='100vw'):
+    sources = getattr(image, 'sources', ())
+    if not sources:
+        return ''
+    return format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}">',
+        ((content_type, srcset, sizes) for content_type, srcset in sources),
+    )
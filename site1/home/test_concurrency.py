@@ -1,10 +1,11 @@
-"""Concurrency proof for RoomService.allocate_room's select_for_update() guard.
+"""Concurrency proof for RoomService.allocate_room's allocation lock
+(RoomRepository.lock_allocation_window, an sp_getapplock per room type and
+week of the stay).
 
 Deselected from the default run (pytest.ini: addopts = -m "not mssql") because
-it needs a real SQL Server instance. sqlite accepts select_for_update()
-syntactically but never blocks a second transaction on it, so the guard cannot
-be proven there. mssql-django compiles it to WITH (ROWLOCK, UPDLOCK), which
-does block. Run explicitly:
+it needs a real SQL Server instance. sqlite has no application locks
+and serializes writers on the whole file instead, so the guard cannot be
+proven there. Run explicitly:
 
     pytest -m mssql home/test_concurrency.py -v
 
@@ -75,12 +76,16 @@ def _ensure_schema():
     """Create any missing tables from the models. conftest.pytest_configure has
     already flipped managed = True, so the schema editor can build them."""
     from data.models import (
-        AuditLog, CustomerBookingInfo, Hotel, Room, RoomAssignment, RoomPrice, User,
+        AuditLog, CustomerBookingInfo, EmailCampaign, EmailQueue, Hotel, Room,
+        RoomAssignment, RoomPrice, User,
     )
     from django.db import connection
 
     # Creation order: referenced tables before the tables that point at them.
-    order = [Hotel, User, RoomPrice, CustomerBookingInfo, Room, RoomAssignment, AuditLog]
+    order = [
+        Hotel, User, RoomPrice, CustomerBookingInfo, Room, RoomAssignment, AuditLog,
+        EmailCampaign, EmailQueue,
+    ]
     existing = set(connection.introspection.table_names())
     missing = [m for m in order if m._meta.db_table not in existing]
     if missing:
@@ -326,3 +331,128 @@ def test_concurrent_allocation_prevents_double_booking(race_setup):
 
     active = RoomAssignment.objects.filter(room=room, status='active').count()
     assert active == 1, f'room ended up with {active} active assignments, expected exactly 1'
+
+
+def _move(booking, check_in, check_out):
+    """Give one of race_setup's bookings different dates. update() rather than
+    save(), so only the two columns are written."""
+    from data.models import CustomerBookingInfo
+    CustomerBookingInfo.objects.filter(pk=booking.pk).update(check_in=check_in, check_out=check_out)
+    booking.refresh_from_db()
+
+
+def test_overlapping_stays_with_different_dates_cannot_double_allocate(race_setup):
+    """The lock is per week bucket, not per exact date range, so two stays that
+    overlap by one night still have to meet on a common lock. 2027-06-06 is a
+    Sunday, the first night of a new bucket: A straddles the boundary, B starts
+    on it, and they share only that night."""
+    room, booking_a, booking_b = race_setup
+    from backend.services.services import RoomService
+    from data.models import RoomAssignment
+
+    _move(booking_a, date(2027, 6, 5), date(2027, 6, 7))
+    _move(booking_b, date(2027, 6, 6), date(2027, 6, 9))
+    barrier = threading.Barrier(2)
+
+    def attempt(booking):
+        try:
+            barrier.wait(timeout=10)
+            return RoomService.allocate_room(booking)
+        except BaseException as exc:  # noqa: BLE001 - returned, asserted on below
+            return exc
+        finally:
+            connections['default'].close()
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futures = [pool.submit(attempt, booking_a), pool.submit(attempt, booking_b)]
+        outcomes = [f.result(timeout=30) for f in futures]
+
+    assert sum(not isinstance(o, BaseException) for o in outcomes) == 1, outcomes
+    assert sum(isinstance(o, ValidationError) for o in outcomes) == 1, outcomes
+    assert RoomAssignment.objects.filter(room=room, status='active').count() == 1
+
+
+def test_allocations_for_other_weeks_do_not_wait(race_setup, monkeypatch):
+    """What replacing the room_price row lock buys. While one transaction holds
+    the allocation lock for A's stay, B in a different week allocates the same
+    room straight away, and allocating A itself gives up at the lock timeout."""
+    room, booking_a, booking_b = race_setup
+    from backend.services.services import RoomService
+    from data.models import RoomAssignment
+    from data.repos.repositories import RoomRepository
+    from django.db import transaction
+
+    _move(booking_b, date(2027, 7, 10), date(2027, 7, 12))
+    monkeypatch.setattr(RoomRepository, 'ALLOCATION_LOCK_TIMEOUT_MS', 1000)
+
+    holding, release = threading.Event(), threading.Event()
+
+    def hold_a():
+        try:
+            with transaction.atomic():
+                RoomRepository.lock_allocation_window('deluxe', booking_a.check_in, booking_a.check_out)
+                holding.set()
+                release.wait(timeout=20)
+        finally:
+            connections['default'].close()
+
+    def allocate(booking):
+        try:
+            return RoomService.allocate_room(booking)
+        except BaseException as exc:  # noqa: BLE001 - returned, asserted on below
+            return exc
+        finally:
+            connections['default'].close()
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        holder = pool.submit(hold_a)
+        try:
+            assert holding.wait(timeout=10), 'holder never acquired the lock'
+            # Both well inside the holder's 20s: B must not have waited on it,
+            # and A must have timed out on it rather than waited it out.
+            other_week = pool.submit(allocate, booking_b).result(timeout=5)
+            same_week = allocate(booking_a)
+        finally:
+            release.set()
+            holder.result(timeout=30)
+
+    assert isinstance(other_week, RoomAssignment), other_week
+    assert isinstance(same_week, ValidationError), same_week
+    assert 'try again' in same_week.message
+    assert RoomAssignment.objects.filter(room=room, status='active').count() == 1
+
+
+def test_concurrent_outbox_claims_never_share_a_row(mssql_default):
+    """Two email workers claiming at once get disjoint rows: the second skips
+    what the first has locked (READPAST) instead of waiting for it or taking
+    it too."""
+    from data.models import EmailQueue
+    from data.repos.repositories import EmailRepository
+
+    # Scratch database: anything still queued is left over from an earlier
+    # run, and would be claimed alongside this test's rows.
+    EmailQueue.objects.filter(status__in=('pending', 'sending')).delete()
+    ids = {
+        EmailRepository.enqueue(
+            to_email=f'guest{i}@example.com', subject='Race', email_type='outbox_race',
+            body_html='<p>Race</p>',
+        ).id
+        for i in range(20)
+    }
+    barrier = threading.Barrier(2)
+
+    def claim():
+        try:
+            barrier.wait(timeout=10)
+            return [row.id for row in EmailRepository.claim_outbox(20, lease_seconds=600)]
+        finally:
+            connections['default'].close()
+
+    try:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            futures = [pool.submit(claim), pool.submit(claim)]
+            first, second = [f.result(timeout=30) for f in futures]
+        assert not set(first) & set(second), f'row(s) claimed twice: {set(first) & set(second)}'
+        assert set(first) | set(second) == ids
+    finally:
+        EmailQueue.objects.filter(id__in=ids).delete()
@@ -1,7 +1,7 @@
 import contextlib
 import json
 import pytest
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 from decimal import Decimal
 from unittest.mock import MagicMock, patch
 from django.contrib.auth.password_validation import validate_password
@@ -89,6 +89,337 @@ def test_overlapping_dates_are_excluded(room, active_assignment):
     assert free == 0, 'a room with an active assignment over the range is not available'
 
 
+# count_available_rooms_by_type answers from RoomAvailabilityIndex. A warm
+# index must cost one fingerprint query and nothing else, and a write it was
+# never told about must still be picked up before it answers.
+
+@pytest.mark.django_db
+def test_warm_availability_index_answers_with_only_the_fingerprint_query(
+    room, active_assignment, django_assert_num_queries
+):
+    RoomRepository.count_available_rooms_by_type('deluxe', date(2027, 1, 5), date(2027, 1, 7))
+
+    with django_assert_num_queries(1):
+        free = RoomRepository.count_available_rooms_by_type(
+            'deluxe', active_assignment.check_in, active_assignment.check_out
+        )
+
+    assert free == 0
+
+
+@pytest.mark.django_db
+def test_availability_index_sees_writes_made_behind_its_back(room, booking):
+    from data.models import RoomAssignment
+
+    assert RoomRepository.count_available_rooms_by_type(
+        'deluxe', booking.check_in, booking.check_out
+    ) == 1
+
+    # Straight through the ORM, as another worker would: no index hook runs.
+    RoomAssignment.objects.create(
+        booking=booking, room=room, status='active',
+        check_in=booking.check_in, check_out=booking.check_out,
+    )
+
+    assert RoomRepository.count_available_rooms_by_type(
+        'deluxe', booking.check_in, booking.check_out
+    ) == 0, 'the fingerprint check missed a write from outside this process'
+
+
+@pytest.mark.django_db
+def test_availability_index_is_patched_in_place_by_assign_and_release(
+    room, booking, django_assert_num_queries, django_capture_on_commit_callbacks
+):
+    dates = ('deluxe', booking.check_in, booking.check_out)
+    RoomRepository.count_available_rooms_by_type(*dates)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        RoomRepository.create_assignment(booking, room)
+    with django_assert_num_queries(1):  # fingerprint only, no rebuild
+        assert RoomRepository.count_available_rooms_by_type(*dates) == 0
+
+    with django_capture_on_commit_callbacks(execute=True):
+        RoomService.deallocate_room(booking)
+    with django_assert_num_queries(1):
+        assert RoomRepository.count_available_rooms_by_type(*dates) == 1
+
+
+@pytest.mark.django_db
+def test_availability_index_matches_room_type_case_insensitively(room, active_assignment):
+    """SQL Server compares rooms.room_type case-insensitively, and
+    _canonicalise_room_type returns the lowercased form of the room_price
+    row, so the index has to match '1 bed with balcony' to '1 Bed With Balcony'."""
+    room.room_type = 'Deluxe'
+    room.save()
+
+    assert RoomRepository.count_available_rooms_by_type(
+        'deluxe', date(2027, 1, 5), date(2027, 1, 7)
+    ) == 1
+
+
+@pytest.mark.django_db
+def test_availability_calendar_counts_free_rooms_per_night(
+    room, active_assignment, django_assert_num_queries, django_capture_on_commit_callbacks
+):
+    from data.models import Room
+    Room.objects.create(
+        hotel=room.hotel, room_code='102', floor_number=1, room_number=102,
+        room_type='Deluxe', housekeeping_status='out_of_order',
+    )
+    window = (date(2026, 12, 19), date(2026, 12, 23))
+
+    calendar = RoomService.availability_calendar(*window)
+
+    assert calendar['nights'][0] == date(2026, 12, 19)
+    # Check-out night (the 22nd) is free again; the out-of-order room never is.
+    assert calendar['room_types'] == {'deluxe': [1, 0, 0, 1]}
+
+    with django_assert_num_queries(1):  # memoised: fingerprint only
+        RoomService.availability_calendar(*window)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        RoomService.deallocate_room(active_assignment.booking)
+    assert RoomService.availability_calendar(*window)['room_types'] == {'deluxe': [1, 1, 1, 1]}
+
+
+@pytest.mark.django_db
+def test_availability_calendar_endpoint_rejects_bad_windows(client, room):
+    from django.core.cache import cache
+    cache.clear()  # @ratelimit counts in the default cache
+    url = reverse('availability_calendar')
+
+    ok = client.get(url, {'start': '2027-01-01', 'end': '2027-01-03'})
+    assert ok.status_code == 200
+    assert ok.json()['nights'] == ['2027-01-01', '2027-01-02']
+    assert ok.json()['room_types'] == {'deluxe': [1, 1]}
+
+    assert client.get(url, {'start': '2027-01-03', 'end': '2027-01-01'}).status_code == 400
+    assert client.get(url, {'start': '2027-01-01', 'end': '2029-01-01'}).status_code == 400
+    assert client.get(url, {'start': 'tomorrow'}).status_code == 400
+
+
+# allocate_room used to take random.choice of the free rooms. Best-fit packs a
+# stay against an existing booking and leaves empty rooms for longer stays.
+
+@pytest.mark.django_db
+def test_best_fit_allocates_next_to_an_existing_stay(room, active_assignment):
+    from data.models import CustomerBookingInfo, Room
+    empty = Room.objects.create(
+        hotel=room.hotel, room_code='100', floor_number=1, room_number=100,
+        room_type='deluxe',
+    )
+    follow_on = CustomerBookingInfo.objects.create(
+        hotel=room.hotel, guest_name='Next Guest', room_type='deluxe',
+        booking_date=active_assignment.booking.booking_date,
+        check_in=date(2026, 12, 22), check_out=date(2026, 12, 24),
+        booked_rate=Decimal('500000'), total_price=Decimal('1000000'),
+        created_at=active_assignment.booking.created_at,
+        updated_at=active_assignment.booking.updated_at,
+    )
+
+    assignment = RoomService.allocate_room(follow_on)
+
+    assert assignment.room_id == room.room_id, (
+        f'expected the room checked out that morning, got room {assignment.room_id} '
+        f'(empty room is {empty.room_id})'
+    )
+
+
+@pytest.mark.django_db
+def test_best_fit_prefers_the_tighter_gap(room, booking):
+    from backend.allocation import best_fit
+    from data.models import Room, RoomAssignment
+    tight = Room.objects.create(
+        hotel=room.hotel, room_code='102', floor_number=1, room_number=102,
+        room_type='deluxe',
+    )
+    for held, check_in, check_out in ((room, 10, 12), (tight, 20, 22)):
+        RoomAssignment.objects.create(
+            booking=booking, room=held, status='active',
+            check_in=date(2026, 12, check_in), check_out=date(2026, 12, check_out),
+        )
+
+    # Before a stay starting on the 24th, 102 sits free for two nights and
+    # 101 for twelve. Lowest id first would pick 101.
+    ranked = best_fit(Room.objects.all(), date(2026, 12, 24), date(2026, 12, 26))
+    assert list(ranked.values_list('room_id', flat=True)) == [tight.room_id, room.room_id]
+
+
+# allocate_room used to load every free room id and send them back in an
+# IN (...) ranking: one parameter per room, and SQL Server refuses past 2100.
+
+@pytest.mark.django_db
+def test_allocation_query_does_not_grow_with_the_free_rooms(room, booking):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from data.models import Room
+    Room.objects.bulk_create(
+        Room(hotel=room.hotel, room_code=str(200 + n), floor_number=2,
+             room_number=200 + n, room_type='deluxe')
+        for n in range(40)
+    )
+
+    with CaptureQueriesContext(connection) as ctx:
+        RoomService.allocate_room(booking)
+
+    sql = [q['sql'] for q in ctx.captured_queries]
+    assert not [s for s in sql if ' IN (' in s]
+    # The ranking and the pick are one bounded read, not a list of ids.
+    assert all(
+        s.endswith(('LIMIT 1', 'LIMIT 21'))
+        for s in sql if s.startswith('SELECT') and 'FROM "rooms"' in s
+    ), sql
+
+
+# _canonicalise_room_type used to run an iexact EXISTS on room_price per call,
+# four times per booking, then scan the alias table.
+
+@pytest.mark.django_db
+def test_room_type_canonicalisation_is_served_from_the_rate_cache(
+    hotel, django_assert_num_queries
+):
+    from data.models import RoomPrice
+    RoomPrice.objects.create(hotel=hotel, room_type='Deluxe ', price_per_night=Decimal('500000'))
+    RoomPrice.objects.create(hotel=hotel, room_type='Suite', price_per_night=None)
+    ReservationService.get_room_rates()
+
+    with django_assert_num_queries(0):
+        assert ReservationService._canonicalise_room_type(' DELUXE') == 'deluxe'
+        # Unpriced, but still a room type; _resolve_rate is what rejects it.
+        assert ReservationService._canonicalise_room_type('suite') == 'suite'
+        assert ReservationService._canonicalise_room_type('1-Bed Balcony Room') == 'one_bed_balcony_room'
+        assert ReservationService._canonicalise_room_type('penthouse') is None
+
+    RoomPrice.objects.create(hotel=hotel, room_type='Penthouse', price_per_night=Decimal('900000'))
+    ReservationService.refresh_room_rates()
+    assert ReservationService._canonicalise_room_type('penthouse') == 'penthouse'
+
+
+@pytest.mark.django_db
+def test_room_rates_are_shared_through_the_cache_and_invalidated_on_change(
+    hotel, django_assert_num_queries, django_capture_on_commit_callbacks
+):
+    from data.models import RoomPrice
+    price = RoomPrice.objects.create(hotel=hotel, room_type='Deluxe', price_per_night=Decimal('500000'))
+    ReservationService.get_room_rates()
+
+    # Another worker: empty L1, same shared cache.
+    ReservationService._RATE_CACHE = None
+    with django_assert_num_queries(0):
+        assert ReservationService.get_room_rates() == {'deluxe': Decimal('500000.00')}
+
+    with django_capture_on_commit_callbacks(execute=True):
+        price.price_per_night = Decimal('650000')
+        price.save()
+
+    assert ReservationService.get_room_rates() == {'deluxe': Decimal('650000.00')}
+
+
+@pytest.mark.django_db
+def test_rate_version_is_checked_at_most_every_few_seconds(hotel):
+    from backend.versioned_cache import bump_version, get_version
+    from data.models import RoomPrice
+
+    price = RoomPrice.objects.create(hotel=hotel, room_type='Deluxe', price_per_night=Decimal('500000'))
+    clock = [1000.0]
+    with patch('backend.services.services.time.monotonic', side_effect=lambda: clock[0]), \
+            patch('backend.services.services.get_version', wraps=get_version) as version_reads:
+        ReservationService.get_room_rates()
+        for _ in range(5):
+            ReservationService._canonicalise_room_type('Deluxe')
+            ReservationService.get_room_rates()
+        assert version_reads.call_count == 1
+
+        # Another worker changes the rates: seen here once the check is due.
+        RoomPrice.objects.filter(pk=price.pk).update(price_per_night=Decimal('650000'))
+        bump_version(ReservationService._RATE_CACHE_KEY)
+        clock[0] += ReservationService._RATE_VERSION_CHECK_SECONDS - 1
+        assert ReservationService.get_room_rates() == {'deluxe': Decimal('500000.00')}
+        clock[0] += 1
+        assert ReservationService.get_room_rates() == {'deluxe': Decimal('650000.00')}
+        assert version_reads.call_count == 2
+
+
+@pytest.mark.django_db
+def test_rate_readers_survive_an_invalidation_on_another_thread(hotel):
+    from backend.versioned_cache import get_version
+    from data.models import RoomPrice
+
+    RoomPrice.objects.create(hotel=hotel, room_type='Deluxe', price_per_night=Decimal('500000'))
+
+    def invalidated_meanwhile(namespace):
+        # What invalidate_room_rates on another thread does to L1.
+        ReservationService._RATE_CACHE = None
+        return get_version(namespace)
+
+    for read, expected in ((ReservationService.get_room_rates, {'deluxe': Decimal('500000.00')}),
+                           (lambda: ReservationService._canonicalise_room_type('Deluxe'), 'deluxe')):
+        ReservationService.get_room_rates()
+        ReservationService._RATE_VERSION_CHECKED_AT = None
+        with patch('backend.services.services.get_version', side_effect=invalidated_meanwhile):
+            assert read() == expected
+
+
+# text_overrides runs on every rendered page. Its request-independent part
+# is cached per site-content version.
+
+@pytest.mark.django_db
+def test_text_overrides_is_served_from_cache_until_content_changes(
+    hotel, django_assert_num_queries, django_capture_on_commit_callbacks
+):
+    from django.contrib.auth.models import AnonymousUser
+    from data.models.site_content import SiteContent
+    from home.context_processors import text_overrides
+    request = RequestFactory().get('/')
+    request.user = AnonymousUser()
+
+    first = text_overrides(request)
+    with django_assert_num_queries(0):
+        again = text_overrides(request)
+    assert again['hotel_name'] == first['hotel_name'] == 'Thien Tai Hotel'
+    assert again['ct']['welcome_heading'] == 'Welcome!'
+
+    with django_capture_on_commit_callbacks(execute=True):
+        SiteContent.objects.create(content_key='welcome_heading', content_value='Hello!')
+
+    assert text_overrides(request)['ct']['welcome_heading'] == 'Hello!'
+
+
+@pytest.mark.django_db
+def test_pages_embed_only_their_own_inline_overrides(client, hotel):
+    from data.models.site_content import SiteContent
+    SiteContent.objects.create(content_key='home:h2:abc123', content_value='Home override')
+    SiteContent.objects.create(content_key='about:p:def456', content_value='About override')
+
+    html = client.get(reverse('home')).content.decode()
+
+    assert 'pageId:    "home"' in html
+    assert 'Home override' in html
+    assert 'About override' not in html
+
+
+# Image slots used to cost one EXISTS query each on every home/about/rooms
+# render. They now resolve from a cached manifest of uploaded names.
+
+@pytest.mark.django_db
+def test_image_slots_resolve_from_the_manifest(
+    django_assert_num_queries, django_capture_on_commit_callbacks
+):
+    from backend.services.services import ImageService
+    from data.models import ImagesRef
+
+    assert str(ImageService.room_images()['balcony']).endswith('balcony.png')
+    with django_assert_num_queries(0):
+        ImageService.room_images()
+        ImageService.page_images()
+
+    with django_capture_on_commit_callbacks(execute=True):
+        ImagesRef.objects.create(ImageName='room-balcony', ImageData=b'jpeg', ImageContentType='image/jpeg')
+
+    assert str(ImageService.room_images()['balcony']) == reverse('serve_image', args=['room-balcony'])
+    assert str(ImageService.page_images()['hero']).endswith('hero_4.jpg')
+
+
 # Room allocation used to run inside a bare `except Exception: logger.warning(...)`
 # in create_reservation. The booking row is written before allocation is
 # attempted, so a failed allocation left a committed booking with no room
@@ -311,3 +642,967 @@ def test_milestone_check_counts_bookings_by_authenticated_user_not_email():
 
     assert json.loads(response.content)['status'] == 'milestone_check'
     mock_filter.assert_called_once_with(user=user)
+
+
+# serve_image used to read ImageData on every hit and send no validators, so
+# browsers re-downloaded every uploaded image on every page view.
+
+@pytest.mark.django_db
+def test_serve_image_revalidates_without_reading_image_data(client, django_assert_num_queries):
+    import hashlib
+    from backend.services.services import ImageService
+    from data.models import ImagesRef
+
+    image_hash = hashlib.sha256(b'jpeg').hexdigest()
+    ImagesRef.objects.create(
+        ImageName='hero', ImageData=b'jpeg', ImageContentType='image/jpeg', ImageHash=image_hash,
+    )
+    url = ImageService.image_url('hero', image_hash)
+    assert url == reverse('serve_image', args=['hero']) + '?v=' + image_hash[:16]
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert b''.join(response.streaming_content) == b'jpeg'
+    assert response['ETag'] == f'"{image_hash}"'
+    assert 'immutable' in response['Cache-Control']
+
+    # Metadata only: one query, and it does not select ImageData, only its
+    # length.
+    with django_assert_num_queries(1) as ctx:
+        response = client.get(url, HTTP_IF_NONE_MATCH=f'"{image_hash}"')
+    assert response.status_code == 304
+    sql = ctx.captured_queries[0]['sql'].replace('LENGTH("ImagesRef"."ImageData")', '')
+    assert 'ImageData' not in sql
+
+    # A bare or stale URL may be cached but must revalidate.
+    response = client.get(reverse('serve_image', args=['hero']) + '?v=stale')
+    assert 'no-cache' in response['Cache-Control']
+
+
+
+@pytest.mark.django_db
+def test_serve_image_streams_image_data_in_chunks_and_honours_ranges(
+    client, django_assert_num_queries
+):
+    from data.models import ImagesRef
+    from data.repos.repositories import ImageRepository
+
+    data = bytes(range(256)) * 40  # 10240 bytes
+    ImagesRef.objects.create(
+        ImageName='hero', ImageData=data, ImageContentType='image/jpeg', ImageHash='a' * 64,
+    )
+    url = reverse('serve_image', args=['hero'])
+
+    # One metadata query, then one SUBSTRING query per 4 KB chunk.
+    with patch.object(ImageRepository, 'IMAGE_CHUNK_SIZE', 4096), django_assert_num_queries(4):
+        response = client.get(url)
+        body = b''.join(response.streaming_content)
+    assert body == data
+    assert response['Content-Length'] == '10240'
+
+    response = client.get(url, HTTP_RANGE='bytes=100-199')
+    assert response.status_code == 206
+    assert response['Content-Range'] == 'bytes 100-199/10240'
+    assert b''.join(response.streaming_content) == data[100:200]
+
+    response = client.get(url, HTTP_RANGE='bytes=-10')
+    assert b''.join(response.streaming_content) == data[-10:]
+
+    response = client.get(url, HTTP_RANGE='bytes=20000-')
+    assert response.status_code == 416
+    assert response['Content-Range'] == 'bytes */10240'
+
+    # A resume against a different version gets the whole new image.
+    response = client.get(url, HTTP_RANGE='bytes=100-199', HTTP_IF_RANGE='"stale"')
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db
+def test_serve_image_streams_asynchronously_under_asgi(django_assert_num_queries):
+    from asgiref.sync import async_to_sync
+    from django.test import AsyncClient
+    from data.models import ImagesRef
+    from data.repos.repositories import ImageRepository
+
+    data = bytes(range(256)) * 40
+    ImagesRef.objects.create(
+        ImageName='hero', ImageData=data, ImageContentType='image/jpeg', ImageHash='a' * 64,
+    )
+
+    async def fetch(**headers):
+        response = await AsyncClient().get(reverse('serve_image', args=['hero']), headers=headers)
+        return response, b''.join([chunk async for chunk in response.streaming_content])
+
+    with patch.object(ImageRepository, 'IMAGE_CHUNK_SIZE', 4096), \
+            patch.object(ImageRepository, 'iter_data') as sync_reader, \
+            django_assert_num_queries(4):
+        response, body = async_to_sync(fetch)()
+    sync_reader.assert_not_called()
+    assert response.is_async and body == data
+
+    response, body = async_to_sync(fetch)(range='bytes=100-199')
+    assert (response.status_code, body) == (206, data[100:200])
+
+
+# Uploads used to be one full-size JPEG in ImagesRef.ImageData, streamed out
+# of SQL Server on every page view. They are now resized JPEG/WebP files in
+# the images storage (InMemoryStorage under pytest), and the row keeps only
+# their hash and widths.
+
+@pytest.mark.django_db
+def test_uploads_are_stored_as_resized_variants_with_srcsets(
+    client, django_capture_on_commit_callbacks
+):
+    from io import BytesIO
+    from PIL import Image
+    from django.template import engines
+    from backend.image_storage import get_storage, variant_name
+    from backend.services.services import ImageService
+    from data.models import ImagesRef
+
+    buffer = BytesIO()
+    Image.new('RGBA', (1200, 600), (255, 0, 0, 128)).save(buffer, 'PNG')
+    with django_capture_on_commit_callbacks(execute=True):
+        ImageService.store_upload('food-1', buffer.getvalue())
+
+    row = ImagesRef.objects.get(ImageName='food-1')
+    assert row.ImageData is None
+    assert row.ImageWidths == '480,960,1200'
+    storage = get_storage()
+    for width in (480, 960, 1200):
+        for fmt in ('webp', 'jpeg'):
+            assert storage.exists(variant_name(row.ImageHash, width, fmt))
+    with storage.open(variant_name(row.ImageHash, 480, 'webp')) as f:
+        assert Image.open(f).size == (480, 240)
+
+    image = ImageService.page_images()['food_1']
+    assert str(image) == storage.url(variant_name(row.ImageHash, 1200, 'jpeg'))
+    html = engines['django'].from_string(
+        '{% load responsive_images %}{% image_sources image "50vw" %}'
+    ).render({'image': image})
+    assert html.index('image/webp') < html.index('image/jpeg')
+    assert storage.url(variant_name(row.ImageHash, 480, 'webp')) + ' 480w' in html
+
+    # Old serve_image links follow the image to storage.
+    response = client.get(reverse('serve_image', args=['food-1']))
+    assert response.status_code == 302
+    assert response['Location'] == str(image)
+
+
+# Decoding and resizing used to run inside the upload request. The upload is
+# now saved as-is and processed by the image pipeline, and the slot keeps its
+# old image until the new one is ready.
+
+@pytest.mark.django_db
+def test_queued_upload_is_processed_by_the_pipeline(django_capture_on_commit_callbacks):
+    from io import BytesIO
+    from PIL import Image
+    from backend.image_storage import get_storage, variant_name
+    from backend.services.services import ImageService
+    from data.models import ImagesRef
+
+    def jpeg(size, color):
+        buffer = BytesIO()
+        Image.new('RGB', size, color).save(buffer, 'JPEG')
+        return buffer.getvalue()
+
+    ImageService.store_upload('hero', jpeg((800, 400), 'blue'))
+    old_src = str(ImageService.page_images()['hero'])
+
+    with patch('backend.services.services.submit_image_on_commit') as submit, \
+            django_capture_on_commit_callbacks(execute=True):
+        pending_hash = ImageService.queue_upload('hero', jpeg((3200, 1600), 'red'))
+    submit.assert_called_once_with('hero')
+    assert ImageService.status('hero') == 'pending'
+    assert str(ImageService.page_images()['hero']) == old_src
+
+    with django_capture_on_commit_callbacks(execute=True):
+        assert ImageService.process_upload('hero') == 'ready'
+    assert ImageService.process_upload('hero') is None  # nothing left to claim
+
+    row = ImagesRef.objects.get(ImageName='hero')
+    assert (row.ImageHash, row.ImageWidths, row.ImageStatus) == (pending_hash, '480,960,1600', 'ready')
+    assert row.ImagePendingHash is None
+    with get_storage().open(variant_name(pending_hash, 1600, 'jpeg')) as f:
+        assert Image.open(f).size == (1600, 800)
+    assert str(ImageService.page_images()['hero']) != old_src
+
+
+@pytest.mark.django_db
+def test_unreadable_upload_is_marked_failed(django_capture_on_commit_callbacks):
+    from backend.image_storage import save_original
+    from backend.services.services import ImageService
+    from data.repos.repositories import ImageRepository
+
+    ImageRepository.save_pending('hero', save_original(b'not an image'))
+    assert ImageService.process_upload('hero') == 'failed'
+    assert ImageService.status('hero') == 'failed'
+    # A first upload with nothing processed yet keeps the static file.
+    assert str(ImageService.page_images()['hero']).endswith('hero_4.jpg')
+
+
+@pytest.mark.django_db
+def test_upload_view_refuses_unreadable_and_oversized_images(client):
+    from io import BytesIO
+    from PIL import Image
+    from django.contrib.auth import get_user_model
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from data.models import ImagesRef
+
+    staff = get_user_model().objects.create_user('staff', 'staff@example.com', 'Not-a-guess-42', role='staff')
+    client.force_login(staff)
+
+    def upload(data):
+        image = SimpleUploadedFile('hero.png', data, content_type='image/png')
+        return client.post(reverse('upload_image'), {'image': image, 'image_id': 'hero'})
+
+    def png(size):
+        buffer = BytesIO()
+        Image.new('RGB', size).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    response = upload(b'not an image')
+    assert response.status_code == 400
+    assert response.json()['message'] == 'The file is not an image we can read.'
+    # Past twice the limit Pillow raises; between once and twice it only warns.
+    with patch.object(Image, 'MAX_IMAGE_PIXELS', 1000):
+        for size in ((100, 100), (40, 40)):
+            response = upload(png(size))
+            assert response.status_code == 400
+            assert response.json()['message'] == 'The image has too many pixels.'
+    assert not ImagesRef.objects.exists()
+
+
+# EmailService used to send over SMTP inside the request. It now queues the
+# rendered message in email_queue and backend/email_outbox.py sends it.
+
+@pytest.mark.django_db
+def test_emails_are_queued_in_the_request_and_sent_by_the_outbox(settings, mailoutbox):
+    from backend import email_outbox
+    from backend.services.services import EmailService
+    from data.models import EmailQueue
+
+    settings.ADMIN_NOTIFICATION_EMAIL = 'desk@example.com'
+    with patch('backend.email_providers.send_email') as send:
+        EmailService.queue_admin_notification('new_booking', {'booking_id': 4711, 'guest_name': 'Ann'})
+    send.assert_not_called()
+    row = EmailQueue.objects.get()
+    assert (row.status, row.attempts, row.to_email) == ('pending', 0, 'desk@example.com')
+    assert 'Ann' in row.body_html and '4711' in row.body_html
+
+    assert email_outbox.drain() == (1, 0)
+    row.refresh_from_db()
+    assert (row.status, row.attempts) == ('sent', 1)
+    assert [m.to for m in mailoutbox] == [['desk@example.com']]
+    assert email_outbox.drain() == (0, 0)
+
+
+@pytest.mark.django_db
+def test_outbox_retries_with_backoff_then_gives_up(settings):
+    from django.utils import timezone
+    from backend import email_outbox
+    from data.models import EmailQueue
+
+    settings.EMAIL_MAX_ATTEMPTS = 2
+    row = EmailRepository.enqueue(
+        to_email='guest@example.com', subject='Hi', email_type='other', body_html='<p>Hi</p>',
+    )
+    with patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('relay down')):
+        assert email_outbox.drain() == (0, 1)
+        row.refresh_from_db()
+        assert (row.status, row.attempts) == ('pending', 1)
+        assert row.next_attempt_at > timezone.now()
+        assert email_outbox.drain() == (0, 0)  # not due yet
+
+        EmailQueue.objects.filter(id=row.id).update(next_attempt_at=timezone.now())
+        assert email_outbox.drain() == (0, 1)
+    row.refresh_from_db()
+    assert (row.status, row.attempts, row.error_message) == ('failed', 2, 'relay down')
+
+
+def test_send_many_shares_one_connection_and_reconnects_once(mailoutbox):
+    from smtplib import SMTPServerDisconnected
+    from django.core.mail.backends.locmem import EmailBackend
+    from backend.email_providers import build_message, send_many
+
+    deliver = EmailBackend.send_messages
+    attempts = []
+
+    def flaky(self, messages):
+        attempts.append(messages[0].to[0])
+        if len(attempts) == 2:
+            raise SMTPServerDisconnected('idle timeout')
+        if messages[0].to == ['refused@example.com']:
+            raise ValueError('550 no such user')
+        return deliver(self, messages)
+
+    messages = [
+        build_message(to=[to], subject='Hi', html_body='<p>Hi</p>')
+        for to in ('a@example.com', 'b@example.com', 'refused@example.com')
+    ]
+    with patch.object(EmailBackend, 'send_messages', flaky), \
+            patch.object(EmailBackend, 'open', autospec=True) as opened:
+        results = send_many(messages)
+
+    # Opened once, then once more after the drop; the refusal is not retried.
+    assert opened.call_count == 2
+    assert attempts == ['a@example.com', 'b@example.com', 'b@example.com', 'refused@example.com']
+    assert [m.to for m in mailoutbox] == [['a@example.com'], ['b@example.com']]
+    assert [msg_id for msg_id, _ in results[:2]] == [m.extra_headers['Message-ID'] for m in mailoutbox]
+    assert results[2][0] is None and str(results[2][1]) == '550 no such user'
+
+
+def test_email_worker_outlives_a_failed_drain(caplog):
+    from io import StringIO
+    from django.core.management import call_command
+    from django.db import OperationalError
+
+    out = StringIO()
+    outcomes = [OperationalError('server has gone away'), (1, 0), KeyboardInterrupt()]
+    with patch('backend.email_outbox.drain', side_effect=outcomes) as drain, \
+            patch('home.management.commands.run_email_worker.time.sleep') as sleep, \
+            patch('home.management.commands.run_email_worker.close_old_connections'):
+        call_command('run_email_worker', '--interval', '3', stdout=out)
+
+    assert drain.call_count == 3
+    sleep.assert_called_once_with(3.0)
+    assert 'Email outbox drain failed' in caplog.text
+    assert 'Sent 1 email(s)' in out.getvalue() and 'Email worker stopped.' in out.getvalue()
+
+
+def test_in_process_drain_failures_are_logged(caplog):
+    from backend import email_outbox
+
+    with patch.object(email_outbox, 'close_old_connections', side_effect=RuntimeError('no database')), \
+            patch.object(email_outbox, 'connection'):
+        email_outbox._wake()
+        email_outbox._get_executor().submit(lambda: None).result()
+    assert 'In-process email outbox drain failed' in caplog.text
+
+
+@pytest.mark.django_db
+def test_unreachable_smtp_fails_the_batch_instead_of_raising(mailoutbox):
+    from smtplib import SMTPServerDisconnected
+    from django.core.mail.backends.locmem import EmailBackend
+    from django.utils import timezone
+    from backend import email_outbox
+    from backend.email_providers import build_message, send_many
+
+    messages = [
+        build_message(to=[to], subject='Hi', html_body='<p>Hi</p>')
+        for to in ('a@example.com', 'b@example.com')
+    ]
+    with patch.object(EmailBackend, 'open', side_effect=OSError('connection refused')):
+        results = send_many(messages)
+    assert [(msg_id, str(error)) for msg_id, error in results] == [(None, 'connection refused')] * 2
+
+    # Reconnecting after a drop fails the message and everything after it.
+    sends = iter([None, SMTPServerDisconnected('idle timeout')])
+
+    def drop_second(self, batch):
+        outcome = next(sends)
+        if outcome:
+            raise outcome
+        return len(batch)
+
+    with patch.object(EmailBackend, 'send_messages', drop_second), \
+            patch.object(EmailBackend, 'open', autospec=True,
+                         side_effect=[None, OSError('connection refused')]):
+        results = send_many(messages + [build_message(to=['c@example.com'], subject='Hi', html_body='<p>Hi</p>')])
+    assert results[0][0] == messages[0].extra_headers['Message-ID']
+    assert [(msg_id, str(error)) for msg_id, error in results[1:]] == [(None, 'connection refused')] * 2
+
+    # The outbox backs the rows off like any other failure.
+    row = EmailRepository.enqueue(
+        to_email='guest@example.com', subject='Hi', email_type='other', body_html='<p>Hi</p>',
+    )
+    with patch.object(EmailBackend, 'open', side_effect=OSError('connection refused')):
+        assert email_outbox.drain() == (0, 1)
+    row.refresh_from_db()
+    assert (row.status, row.attempts, row.error_message) == ('pending', 1, 'connection refused')
+    assert row.next_attempt_at > timezone.now()
+    assert mailoutbox == []
+
+
+# Campaigns used to be sent inside the admin's request. queue_campaign now
+# only starts them; backend/campaign_dispatch.py sends and checkpoints.
+
+@pytest.mark.django_db
+def test_campaign_sends_in_the_background_with_live_counters(settings, mailoutbox):
+    from backend import campaign_dispatch
+    from backend.services.services import EmailService
+    from data.models import EmailCampaign
+
+    settings.EMAIL_CAMPAIGN_RATE = 0
+    settings.EMAIL_CAMPAIGN_BATCH = 2
+    for i in range(3):
+        EmailRepository.create_subscriber(f's{i}@example.com', name=f'S{i}')
+    campaign = EmailRepository.create_campaign(name='Spring', subject='Rates', body_html='<p>Hi</p>')
+
+    with patch('backend.campaign_dispatch.dispatch_on_commit') as dispatch_on_commit:
+        started = EmailService.queue_campaign(campaign.id)
+    dispatch_on_commit.assert_called_once_with(campaign.id)
+    assert (started.status, started.recipient_count, started.sent_count) == ('sending', 3, 0)
+    assert mailoutbox == []
+
+    # The first job to claim it sends it; any other finds it taken.
+    assert EmailRepository.claim_campaign(campaign.id, lease_seconds=300)
+    assert campaign_dispatch.dispatch(campaign.id) is None
+    EmailCampaign.objects.filter(id=campaign.id).update(heartbeat_at=None)
+
+    assert campaign_dispatch.dispatch(campaign.id) == (3, 0)
+    done = EmailRepository.get_campaign(campaign.id)
+    assert (done.status, done.recipient_count, done.sent_count, done.failed_count) == ('sent', 3, 3, 0)
+    assert sorted(m.to[0] for m in mailoutbox) == ['s0@example.com', 's1@example.com', 's2@example.com']
+    assert campaign_dispatch.dispatch(campaign.id) is None
+
+
+@pytest.mark.django_db
+def test_send_view_starts_a_draft_campaign(client):
+    from data.models import User
+
+    staff = User.objects.create_user('staff', 'staff@example.com', 'Not-a-guess-42', role='staff')
+    client.force_login(staff)
+    EmailRepository.create_subscriber('s0@example.com', name='S0')
+    campaign = EmailRepository.create_campaign(name='Spring', subject='Rates', body_html='<p>Hi</p>')
+
+    with patch('backend.campaign_dispatch.dispatch_on_commit') as dispatch_on_commit:
+        response = client.post(reverse('email_campaign_send', args=[campaign.id]))
+    assert (response.status_code, response.url) == (302, reverse('email_campaigns'))
+    dispatch_on_commit.assert_called_once_with(campaign.id)
+    assert EmailRepository.get_campaign(campaign.id).status == 'sending'
+
+
+@pytest.mark.django_db
+def test_stalled_campaign_resumes_after_its_checkpoint(settings, mailoutbox):
+    from datetime import timedelta
+    from io import StringIO
+    from django.core.management import call_command
+    from django.utils import timezone
+    from data.models import EmailCampaign
+
+    settings.EMAIL_CAMPAIGN_RATE = 0
+    subs = [EmailRepository.create_subscriber(f's{i}@example.com')[0] for i in range(3)]
+    campaign = EmailRepository.create_campaign(name='Spring', subject='Rates', body_html='<p>Hi</p>')
+    EmailRepository.start_campaign(campaign.id, recipient_count=3)
+    # A job got through the first subscriber, then its worker died.
+    EmailCampaign.objects.filter(id=campaign.id).update(
+        last_subscriber_id=subs[0].id, sent_count=1,
+        heartbeat_at=timezone.now() - timedelta(seconds=settings.EMAIL_CAMPAIGN_LEASE_SECONDS + 1),
+    )
+
+    call_command('send_campaigns', stdout=StringIO())
+    assert sorted(m.to[0] for m in mailoutbox) == ['s1@example.com', 's2@example.com']
+    done = EmailCampaign.objects.get(id=campaign.id)
+    assert (done.status, done.sent_count, done.recipient_count) == ('sent', 3, 3)
+
+
+@pytest.mark.django_db
+def test_campaign_errors_are_logged_per_batch_and_checkpointed(settings, mailoutbox, caplog):
+    from backend import campaign_dispatch
+    from data.models import EmailCampaign, EmailQueue
+
+    settings.EMAIL_CAMPAIGN_RATE = 0
+    settings.EMAIL_CAMPAIGN_BATCH = 1
+    subs = [EmailRepository.create_subscriber(f's{i}@example.com')[0] for i in range(3)]
+    campaign = EmailRepository.create_campaign(name='Spring', subject='Rates', body_html='<p>Hi</p>')
+    EmailRepository.start_campaign(campaign.id, recipient_count=3)
+
+    # A batch that blows up is logged failed and the send goes on.
+    send_batch = campaign_dispatch._send_batch
+    calls = []
+
+    def second_fails(messages, *args):
+        calls.append(messages)
+        if len(calls) == 2:
+            raise RuntimeError('pool broke')
+        return send_batch(messages, *args)
+
+    with patch.object(campaign_dispatch, '_send_batch', side_effect=second_fails):
+        assert campaign_dispatch.dispatch(campaign.id) == (2, 1)
+    assert 'batch after subscriber' in caplog.text
+    failed = EmailQueue.objects.get(campaign_id=campaign.id, status='failed')
+    assert (failed.to_email, failed.error_message) == ('s1@example.com', 'pool broke')
+
+    # A database error stops the job, which checkpoints and lets go first.
+    second = EmailRepository.create_campaign(name='Summer', subject='Rates', body_html='<p>Hi</p>')
+    EmailRepository.start_campaign(second.id, recipient_count=3)
+    mailoutbox.clear()
+
+    def dies_after_one(after, size):
+        yield subs[0]
+        raise OSError('connection reset')
+
+    with patch.object(EmailRepository, 'iter_active_subscribers', side_effect=dies_after_one):
+        with pytest.raises(OSError):
+            campaign_dispatch.dispatch(second.id)
+    stopped = EmailCampaign.objects.get(id=second.id)
+    assert (stopped.status, stopped.last_subscriber_id, stopped.sent_count) == ('sending', subs[0].id, 1)
+    assert stopped.heartbeat_at is None
+
+    assert campaign_dispatch.dispatch(second.id) == (2, 0)
+    assert [m.to[0] for m in mailoutbox] == [f's{i}@example.com' for i in range(3)]
+
+
+@pytest.mark.django_db
+def test_slow_campaign_keeps_its_heartbeat_between_log_flushes(settings, mailoutbox, caplog):
+    from itertools import count
+    from backend import campaign_dispatch
+
+    settings.EMAIL_CAMPAIGN_RATE = 0
+    settings.EMAIL_CAMPAIGN_BATCH = 1
+    settings.EMAIL_CAMPAIGN_LOG_FLUSH = 300
+    settings.EMAIL_CAMPAIGN_LEASE_SECONDS = 30
+    for i in range(3):
+        EmailRepository.create_subscriber(f's{i}@example.com')
+    campaign = EmailRepository.create_campaign(name='Spring', subject='Rates', body_html='<p>Hi</p>')
+    EmailRepository.start_campaign(campaign.id, recipient_count=3)
+
+    # Each batch takes 15s, past a third of the lease: every checkpoint
+    # writes the heartbeat, though the log is far from flush size.
+    clock = count(0, 15)
+    with patch('data.repos.repositories.time.monotonic', side_effect=lambda: next(clock)), \
+            patch.object(EmailRepository, 'checkpoint_campaign',
+                         wraps=EmailRepository.checkpoint_campaign) as checkpoint:
+        assert campaign_dispatch.dispatch(campaign.id) == (3, 0)
+    assert checkpoint.call_count == 3
+
+    # A batch that cannot fit in the lease is worth a warning up front.
+    settings.EMAIL_CAMPAIGN_RATE = 1000
+    settings.EMAIL_CAMPAIGN_BATCH = 100
+    settings.EMAIL_CAMPAIGN_LEASE_SECONDS = 0.03
+    second = EmailRepository.create_campaign(name='Summer', subject='Rates', body_html='<p>Hi</p>')
+    EmailRepository.start_campaign(second.id, recipient_count=3)
+    assert campaign_dispatch.dispatch(second.id) == (3, 0)
+    assert 'raise the lease or shrink the batch' in caplog.text
+
+
+# The campaign template used to be rendered, and hotel info queried, once per
+# subscriber. It is now rendered once and personalised by substitution, which
+# must come out exactly as a per-recipient render would.
+
+@pytest.mark.django_db
+def test_campaign_is_rendered_once_and_matches_a_per_recipient_render(settings):
+    from django.template.loader import render_to_string
+    from backend.services.services import EmailService, HotelService
+
+    settings.SITE_BASE_URL = 'https://hotel.test/?from=mail&lang=en'
+    subs = [
+        EmailRepository.create_subscriber(f's{i}@example.com', name=f'<S{i}>')[0]
+        for i in range(3)
+    ]
+    campaign = EmailRepository.create_campaign(name='Spring', subject='Rates', body_html='<p>Hi</p>')
+
+    with patch('backend.services.services.HotelService.get_hotel_info',
+               wraps=HotelService.get_hotel_info) as hotel_info, \
+            patch('django.template.loader.render_to_string', wraps=render_to_string) as render:
+        renderer = EmailService.campaign_renderer(campaign)
+        messages = [renderer.message(sub) for sub in subs]
+    assert hotel_info.call_count == 1
+    assert render.call_count == 1
+
+    for sub, msg in zip(subs, messages):
+        unsubscribe_url = EmailService._build_unsubscribe_url(sub.unsubscribe_token)
+        expected = render_to_string('email/campaign.html', {
+            'campaign': campaign,
+            'subscriber': sub,
+            'unsubscribe_url': unsubscribe_url,
+            'hotel': HotelService.get_hotel_info(),
+        })
+        assert msg.alternatives[0][0] == expected
+        assert '&amp;lang=en' in expected
+        assert msg.extra_headers['List-Unsubscribe'] == f'<{unsubscribe_url}>'
+        assert msg.to == [sub.email]
+
+
+# Each campaign recipient used to be logged with its own INSERT. The log is
+# now buffered and bulk-inserted with the checkpoint.
+
+@pytest.mark.django_db
+def test_campaign_log_is_bulk_inserted_with_each_checkpoint(settings, mailoutbox):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from backend import campaign_dispatch
+    from data.models import EmailQueue
+
+    settings.EMAIL_CAMPAIGN_RATE = 0
+    settings.EMAIL_CAMPAIGN_BATCH = 2
+    settings.EMAIL_CAMPAIGN_LOG_FLUSH = 4
+    for i in range(5):
+        EmailRepository.create_subscriber(f's{i}@example.com')
+    campaign = EmailRepository.create_campaign(name='Spring', subject='Rates', body_html='<p>Hi</p>')
+    EmailRepository.start_campaign(campaign.id, recipient_count=5)
+
+    with CaptureQueriesContext(connection) as queries:
+        assert campaign_dispatch.dispatch(campaign.id) == (5, 0)
+    sql = [q['sql'] for q in queries.captured_queries]
+    # Flushed after the second batch (4 rows) and at the end (1 row).
+    assert sum(s.startswith('INSERT INTO "email_queue"') for s in sql) == 2
+    assert sum(s.startswith('UPDATE "email_campaigns"') and '"last_subscriber_id"' in s for s in sql) == 2
+
+    assert EmailQueue.objects.filter(campaign=campaign, status='sent').count() == 5
+    done = EmailRepository.get_campaign(campaign.id)
+    assert (done.status, done.sent_count, done.failed_count) == ('sent', 5, 0)
+
+
+@pytest.mark.django_db
+def test_active_subscribers_are_streamed_by_id_in_pages(django_assert_num_queries):
+    subs = [EmailRepository.create_subscriber(f's{i}@example.com', name=f'S{i}')[0] for i in range(5)]
+    EmailRepository.unsubscribe(subs[2])
+
+    with django_assert_num_queries(2):
+        rows = list(EmailRepository.iter_active_subscribers(batch_size=3))
+    assert [row.email for row in rows] == ['s0@example.com', 's1@example.com', 's3@example.com', 's4@example.com']
+    assert rows[0] == (subs[0].id, 's0@example.com', 'S0', subs[0].unsubscribe_token, None)
+
+    resumed = EmailRepository.iter_active_subscribers(after_id=subs[1].id, batch_size=3)
+    assert [row.id for row in resumed] == [subs[3].id, subs[4].id]
+
+
+# retry_failed_emails used to resend a "(Retry of email_queue #N)" placeholder.
+# It now resends the real message, on a backoff, until the dead letter.
+
+@pytest.mark.django_db
+def test_retry_engine_resends_the_real_message_then_dead_letters(settings, mailoutbox):
+    from io import StringIO
+    from django.core.management import call_command
+    from django.utils import timezone
+    from backend import email_retry
+    from backend.services.services import EmailService
+    from data.models import EmailCampaign, EmailQueue
+
+    settings.EMAIL_MAX_ATTEMPTS = 1
+    settings.EMAIL_DEAD_LETTER_ATTEMPTS = 3
+    outbox_row = EmailRepository.enqueue(
+        to_email='guest@example.com', subject='Booked', email_type='booking_confirmation',
+        body_html='<p>Room 101 is yours</p>',
+    )
+    EmailQueue.objects.filter(id=outbox_row.id).update(status='failed', attempts=1)
+    sub = EmailRepository.create_subscriber('fan@example.com')[0]
+    campaign = EmailRepository.create_campaign(name='Spring', subject='Rates', body_html='<p>Spring rates</p>')
+    campaign_row = EmailService.campaign_log_row(campaign, sub, error=OSError('relay down'))
+    campaign_row.save()
+    EmailCampaign.objects.filter(id=campaign.id).update(status='sent', sent_count=4, failed_count=1)
+    unrenderable = EmailRepository.log_failed(
+        to_email='x@example.com', subject='Hi', email_type='other', error='template render failed',
+    )
+
+    with patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('relay down')):
+        assert email_retry.retry_failed() == {'failed': 2, 'dead': 1}
+        outbox_row.refresh_from_db()
+        assert (outbox_row.status, outbox_row.attempts) == ('failed', 2)
+        assert outbox_row.next_attempt_at > timezone.now()
+        assert email_retry.retry_failed() == {}  # not due yet
+    unrenderable.refresh_from_db()
+    assert (unrenderable.status, unrenderable.error_message) == ('dead', 'no stored message to resend')
+
+    EmailQueue.objects.filter(status='failed').update(next_attempt_at=None)
+    out = StringIO()
+    call_command('retry_failed_emails', '--no-cleanup', stdout=out)
+    assert 'sent=2 still_failed=0 dead=0' in out.getvalue()
+    sent = {m.to[0]: m for m in mailoutbox}
+    assert 'Room 101 is yours' in sent['guest@example.com'].alternatives[0][0]
+    assert 'Spring rates' in sent['fan@example.com'].alternatives[0][0]
+    assert sent['fan@example.com'].extra_headers['List-Unsubscribe'].startswith('<')
+    # The campaign's failure became a send.
+    campaign.refresh_from_db()
+    assert (campaign.sent_count, campaign.failed_count) == (5, 0)
+
+
+@pytest.mark.django_db
+def test_retry_worker_logs_a_failed_pass_and_carries_on(settings, caplog, mailoutbox):
+    from backend import email_retry
+    from data.models import EmailQueue
+    from data.repos.repositories import EmailRepository as Repo
+
+    row = EmailRepository.enqueue(
+        to_email='guest@example.com', subject='Hi', email_type='other', body_html='<p>Hi</p>',
+    )
+    EmailQueue.objects.filter(id=row.id).update(status='failed', attempts=1)
+    claim = Repo.claim_failed
+    outcomes = iter([OSError('deadlock victim'), None])
+
+    def flaky_claim(limit, lease_seconds):
+        failure = next(outcomes, None)
+        if failure:
+            raise failure
+        return claim(limit, lease_seconds)
+
+    with patch.object(Repo, 'claim_failed', side_effect=flaky_claim):
+        assert email_retry.retry_failed(limit=2, batch_size=1) == {'sent': 1}
+    assert 'Email retry pass failed' in caplog.text
+    assert [m.to for m in mailoutbox] == [['guest@example.com']]
+
+
+@pytest.mark.django_db
+def test_abandoned_retry_claims_go_back_to_the_retry_engine(settings, mailoutbox):
+    from datetime import timedelta
+    from django.utils import timezone
+    from backend import email_outbox, email_retry
+    from backend.services.services import EmailService
+    from data.models import EmailQueue
+
+    settings.EMAIL_MAX_ATTEMPTS = 1
+    sub = EmailRepository.create_subscriber('fan@example.com')[0]
+    campaign = EmailRepository.create_campaign(name='Spring', subject='Rates', body_html='<p>Spring rates</p>')
+    row = EmailService.campaign_log_row(campaign, sub, error=OSError('relay down'))
+    row.save()
+
+    # A retry worker claims the row, then dies before sending it.
+    [claimed] = EmailRepository.claim_failed(10, settings.EMAIL_SEND_LEASE_SECONDS)
+    assert claimed.status == 'retrying'
+    EmailQueue.objects.filter(id=row.id).update(
+        locked_at=timezone.now() - timedelta(seconds=settings.EMAIL_SEND_LEASE_SECONDS + 1),
+    )
+
+    # Past its lease, the outbox leaves it alone: it has no body to send.
+    assert email_outbox.drain() == (0, 0)
+    assert mailoutbox == []
+    assert email_retry.retry_failed() == {'sent': 1}
+    assert 'Spring rates' in mailoutbox[0].alternatives[0][0]
+
+    # A bodiless row that does reach the outbox is dead-lettered, not sent.
+    blank = EmailService.campaign_log_row(campaign, sub, error=OSError('relay down'))
+    blank.status = 'pending'
+    blank.save()
+    assert email_outbox.drain() == (0, 1)
+    blank.refresh_from_db()
+    assert (blank.status, blank.error_message) == ('dead', 'no stored message to send')
+    assert len(mailoutbox) == 1
+
+
+@pytest.mark.django_db
+def test_retry_engine_dead_letters_after_the_last_attempt(settings):
+    from backend import email_retry
+    from data.models import EmailQueue
+
+    settings.EMAIL_MAX_ATTEMPTS = 1
+    settings.EMAIL_DEAD_LETTER_ATTEMPTS = 2
+    row = EmailRepository.enqueue(
+        to_email='guest@example.com', subject='Hi', email_type='other', body_html='<p>Hi</p>',
+    )
+    EmailQueue.objects.filter(id=row.id).update(status='failed', attempts=1)
+
+    with patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('relay down')):
+        assert email_retry.retry_failed() == {'dead': 1}
+    row.refresh_from_db()
+    assert (row.status, row.attempts, row.next_attempt_at) == ('dead', 2, None)
+
+
+# admin_reservations used to run six queries for its figures on every load.
+
+@pytest.mark.django_db
+def test_dashboard_stats_are_one_cached_query_until_a_booking_changes(
+        booking, django_assert_num_queries, django_capture_on_commit_callbacks):
+    from django.utils import timezone
+
+    today = date(2026, 12, 21)
+    with django_assert_num_queries(1):
+        stats = ReservationService.dashboard_stats(today)
+    assert stats == {
+        'total_reservations': 1, 'today_checkins': 0, 'today_checkouts': 0,
+        'upcoming_reservations': 0, 'currently_checked_in': 1, 'total_revenue': 0,
+    }
+    with django_assert_num_queries(0):
+        assert ReservationService.dashboard_stats(today) == stats
+
+    with django_capture_on_commit_callbacks(execute=True):
+        booking.check_in = today
+        booking.booking_date = timezone.make_aware(datetime(2026, 12, 21, 9))
+        booking.save()
+    stats = ReservationService.dashboard_stats(today)
+    assert (stats['today_checkins'], stats['total_revenue']) == (1, Decimal('1000000'))
+
+
+# The reservations table used to render every booking and filter in the page.
+
+@pytest.mark.django_db
+def test_reservation_pages_are_keyset_and_filtered_server_side(booking):
+    from django.core.exceptions import ValidationError
+    from django.http import QueryDict
+    from data.models import CustomerBookingInfo
+
+    today = date(2026, 12, 21)
+    for n, (check_in, room_type) in enumerate([
+            (date(2026, 12, 21), 'suite'), (date(2027, 1, 5), 'deluxe'), (date(2026, 11, 1), 'deluxe')]):
+        CustomerBookingInfo.objects.create(
+            hotel=booking.hotel, guest_name=f'Guest {n}', room_type=room_type,
+            booking_date=booking.booking_date, check_in=check_in,
+            check_out=check_in + timedelta(days=2), booked_rate=Decimal('500000'),
+            total_price=Decimal('1000000'), created_at=booking.created_at, updated_at=booking.updated_at,
+        )
+
+    def page(query):
+        return ReservationService.reservation_page(QueryDict(query), today)
+
+    seen, cursor = [], ''
+    while True:
+        result = page(f'limit=2&cursor={cursor}')
+        seen += [row['booking_id'] for row in result['reservations']]
+        if not result['next']:
+            break
+        cursor = result['next']
+    # Same booking_date throughout, so booking_id breaks the tie.
+    assert seen == sorted(CustomerBookingInfo.objects.values_list('booking_id', flat=True))
+
+    assert [(r['guest_name'], r['stay']) for r in page('period=today')['reservations']] == [
+        ('Test Guest', 'staying'), ('Guest 0', 'checking_in')]
+    assert [r['guest_name'] for r in page('period=today&stay=staying')['reservations']] == ['Test Guest']
+    assert page('stay=')['reservations'] == []
+    assert [r['guest_name'] for r in page('room_type=deluxe&check_in_from=2027-01-01')['reservations']] == [
+        'Guest 1']
+    assert [r['stay'] for r in page('period=past')['reservations']] == ['completed']
+    for bad in ('cursor=nope', 'period=soon', 'price_min=abc', 'check_in_to=21/12/2026'):
+        with pytest.raises(ValidationError):
+            page(bad)
+
+
+# Guest search used to be LIKE '%term%' on three booking_info columns.
+
+@pytest.mark.django_db
+def test_guest_search_is_folded_prefix_matching_with_a_trigram_fallback(booking):
+    from data.models import BookingSearchTerm, CustomerBookingInfo
+    from data.repos.repositories import ReservationRepository
+
+    def add(guest_name, email=None, phone=None):
+        return CustomerBookingInfo.objects.create(
+            hotel=booking.hotel, guest_name=guest_name, email=email, phone=phone,
+            room_type='deluxe', booking_date=booking.booking_date, check_in=booking.check_in,
+            check_out=booking.check_out, booked_rate=Decimal('500000'),
+            total_price=Decimal('1000000'), created_at=booking.created_at, updated_at=booking.updated_at,
+        ).booking_id
+
+    duc = add('Nguyễn Văn Đức', 'vanduc@example.com', '+84 912 345 678')
+    ducanh = add('Trần Đức Anh', 'ducanh@example.com', '0987 654 321')
+    nguyet = add('Lê Thị Nguyệt')
+
+    def found(term, limit=50):
+        return [b.booking_id for b in ReservationRepository.search_bookings(term, limit=limit)]
+
+    assert found('nguyen duc') == [duc]
+    # An exact word outranks a prefix of one; otherwise newest first.
+    assert found('đức') == [ducanh, duc]
+    assert found('du') == [ducanh, duc]
+    assert found('du', limit=1) == [ducanh]
+    assert found('0912345678') == found('0912-345') == [duc]
+    # +84 is the local 0, even in part of a number; the end of one finds it too.
+    assert found('+84 912 345 678') == found('+84 912') == found('0084912') == [duc]
+    assert found('345 678') == found('5678') == [duc]
+    assert found('654 321') == [ducanh]
+    assert found('DucAnh@Example') == [ducanh]
+    # The email's domain is words like any other.
+    assert found('example') == found('@example.com') == [ducanh, duc]
+    assert found('tran example') == [ducanh]
+    assert found('x') == found('') == []
+    # Nothing starts with these, so trigrams: a misspelling, a middle.
+    # More shared trigrams rank higher.
+    assert found('nguyn') == [nguyet, duc]
+    assert found('guyet') == [nguyet, duc]
+
+    # Terms follow an edit, and go with the booking.
+    renamed = CustomerBookingInfo.objects.get(pk=nguyet)
+    renamed.guest_name = 'Phạm Thu'
+    renamed.save()
+    assert nguyet not in found('nguyet') and found('pham') == [nguyet]
+    renamed.delete()
+    assert not BookingSearchTerm.objects.filter(booking_id=nguyet).exists()
+
+
+# room_dashboard used to load every room and active assignment per request.
+
+@pytest.mark.django_db
+def test_room_snapshot_is_built_once_then_patched_per_room(
+        room, booking, django_assert_num_queries, django_capture_on_commit_callbacks):
+    from backend import room_snapshot
+    from data.models import Room
+    from data.repos.repositories import RoomRepository
+
+    today = date(2026, 12, 21)
+    other = Room.objects.create(hotel=room.hotel, room_code='102', floor_number=1,
+                                room_number=102, room_type='deluxe')
+    with django_assert_num_queries(1):
+        version, cards = room_snapshot.cards(today)
+    assert [(c['room_code'], c['disp_status']) for c in cards] == [('101', 'vacant'), ('102', 'vacant')]
+    with django_assert_num_queries(0):
+        assert room_snapshot.cards(today) == (version, cards)
+    assert room_snapshot.changes_since(version, today)['rooms'] == []
+
+    with django_capture_on_commit_callbacks(execute=True):
+        RoomRepository.create_assignment(booking, room)
+    with django_capture_on_commit_callbacks(execute=True):
+        RoomRepository.update_room_status(other.room_id, 'vacant', housekeeping_status='dirty')
+
+    changes = room_snapshot.changes_since(version, today)
+    assert not changes['full']
+    assert [(c['room_code'], c['disp_status'], c['guest_name']) for c in changes['rooms']] == [
+        ('101', 'occupied', 'Test Guest'), ('102', 'dirty', None)]
+    # Replayed over the stored snapshot, not read again.
+    with django_assert_num_queries(0):
+        version_now, cards = room_snapshot.cards(today)
+    assert version_now == changes['version']
+    assert [c['disp_status'] for c in cards] == ['occupied', 'dirty']
+    assert room_snapshot.cards(date(2026, 12, 1))[1][0]['disp_status'] == 'reserved'
+
+    # Too far back to list: everything, flagged.
+    assert room_snapshot.changes_since(version - 10_000, today)['full']
+
+
+# Dashboards used to see room changes only by reloading.
+
+@pytest.mark.django_db
+def test_room_changes_are_pushed_to_open_dashboards(room, django_capture_on_commit_callbacks):
+    import asyncio
+    import json
+
+    from backend import room_events, room_snapshot
+    from data.repos.repositories import RoomRepository
+
+    async def long_poll():
+        return [chunk async for chunk in room_events.stream(None, timeout=5)]
+
+    version, _ = room_snapshot.cards(date(2026, 12, 21))
+    loop = asyncio.new_event_loop()
+    try:
+        poll = loop.create_task(long_poll())
+        loop.run_until_complete(asyncio.sleep(0.01))  # subscribed, waiting
+        with django_capture_on_commit_callbacks(execute=True):
+            RoomRepository.update_room_status(room.room_id, 'vacant', housekeeping_status='dirty')
+        chunks = loop.run_until_complete(poll)
+    finally:
+        loop.close()
+
+    assert chunks[0] == 'retry: 3000\n\n'
+    event, event_id, data = chunks[1].strip().split('\n')
+    pushed = json.loads(data.removeprefix('data: '))
+    assert (event, event_id) == ('event: room', f"id: {pushed['version']}")
+    assert (pushed['room_id'], pushed['room']['disp_status']) == (room.room_id, 'dirty')
+
+    # A dashboard reconnecting from before the change is sent it again.
+    [replayed] = room_events._catch_up(version)
+    assert json.loads(replayed.strip().split('\n')[2].removeprefix('data: ')) == pushed
+
+
+@pytest.mark.django_db
+def test_room_events_fall_back_to_polling_under_wsgi(client, room):
+    from django.contrib.auth import get_user_model
+    from asgiref.sync import async_to_sync
+    from django.test import AsyncClient
+
+    staff = get_user_model().objects.create_user('staff', 'staff@example.com', 'Not-a-guess-42', role='staff')
+    client.force_login(staff)
+
+    # No stream to hold a WSGI worker open: 204 stops EventSource, and the
+    # page polls the changes endpoint instead.
+    page = client.get(reverse('room_dashboard'))
+    assert page.context['room_events'] is False and 'setInterval(refreshRooms' in page.content.decode()
+    assert client.get(reverse('room_dashboard_events'), {'since': page.context['version']}).status_code == 204
+    changes = client.get(reverse('room_dashboard_changes'), {'since': page.context['version']})
+    assert changes.json()['rooms'] == []
+
+    async def dashboard_under_asgi():
+        async_client = AsyncClient()
+        await async_client.aforce_login(staff)
+        page = await async_client.get(reverse('room_dashboard'))
+        return page.context['room_events']
+
+    assert async_to_sync(dashboard_under_asgi)() is True
@@ -40,6 +40,7 @@ urlpatterns = [
     path('rooms/', views.get_rooms, name='rooms'),
     path('newsletter/signup/', views.newsletter_signup, name='newsletter_signup'),
     path('discount/validate/', views.validate_discount_code, name='validate_discount_code'),
+    path('reservation/availability/', views.availability_calendar, name='availability_calendar'),
     path('unsubscribe/<str:token>/', views.unsubscribe_view, name='unsubscribe'),
     path('accounts/login/', views.login_view, name='login'),
     path('accounts/register/', views.register_view, name='register'),
@@ -47,7 +48,10 @@ urlpatterns = [
     path('accounts/verify/resend/', views.resend_verification, name='resend_verification'),
     path('logout/', views.logout_view, name='logout'),
     path('dashboard/reservations/', views.admin_reservations, name='admin_reservations'),
+    path('dashboard/reservations/api/', views.admin_reservations_api, name='admin_reservations_api'),
     path('dashboard/rooms/', views.room_dashboard, name='room_dashboard'),
+    path('dashboard/rooms/changes/', views.room_dashboard_changes, name='room_dashboard_changes'),
+    path('dashboard/rooms/events/', views.room_dashboard_events, name='room_dashboard_events'),
     path('dashboard/reservations/view/<int:booking_id>/', views.view_reservation, name='view_reservation'),
     path('dashboard/reservations/edit/<int:booking_id>/', views.edit_reservation, name='edit_reservation'),
     path('dashboard/reservations/delete/<int:booking_id>/', views.delete_reservation, name='delete_reservation'),
@@ -58,7 +62,9 @@ urlpatterns = [
     path('dashboard/email/campaigns/new/', views.email_campaign_edit, name='email_campaign_new'),
     path('dashboard/email/campaigns/<int:campaign_id>/edit/', views.email_campaign_edit, name='email_campaign_edit'),
     path('dashboard/email/campaigns/<int:campaign_id>/send/', views.email_campaign_send, name='email_campaign_send'),
+    path('dashboard/email/campaigns/<int:campaign_id>/progress/', views.email_campaign_progress, name='email_campaign_progress'),
     path('staff/upload-image/', views.upload_image, name='upload_image'),
+    path('staff/image-status/<str:image_name>/', views.image_status, name='image_status'),
     path('staff/save-content/', views.save_content, name='save_content'),
     path('images/<str:image_name>/', views.serve_image, name='serve_image'),
 ]
\ No newline at end of file
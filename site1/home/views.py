@@ -1,20 +1,24 @@
 from django.shortcuts import render, redirect
-from django.http import JsonResponse
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib import messages
 from django.contrib.auth import logout, login
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.template.defaultfilters import pluralize
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.views.decorators.http import require_POST
 from django_ratelimit.decorators import ratelimit
-from backend.services.services import HotelService, ReservationService, RoomService, EmailService, DiscountService
+from backend.services.services import HotelService, ReservationService, RoomService, EmailService, DiscountService, ImageService
+from backend import room_events, room_snapshot
 from data.models import User, CustomerBookingInfo
 from data.models.hotel import BookingStatus
 from data.repos.repositories import DiscountRepository
+from data.repos.availability import RoomAvailabilityIndex
 from django.db import IntegrityError
-from django.db.models import Sum
 from datetime import date, datetime
 import logging
 from home.audit import log_booking_create, log_booking_update, log_booking_delete, log_user_login
@@ -48,57 +52,6 @@ def _can_manage_target(request_user, target_user=None, target_role=None):
         return False, 'You do not have permission to manage staff or admin accounts.'
     return True, None
 
-def _db_image_exists(name):
-    """Return True if an image with this name exists in the DB."""
-    try:
-        from data.models.images import ImagesRef
-        return ImagesRef.objects.filter(ImageName=name).exists()
-    except Exception:
-        return False
-
-
-def _db_images_exist(names):
-    """Batch-check which image names exist in the DB. Returns a dict {name: bool}."""
-    try:
-        from data.models.images import ImagesRef
-        existing = set(
-            ImagesRef.objects.filter(ImageName__in=names)
-            .values_list('ImageName', flat=True)
-        )
-        return {name: name in existing for name in names}
-    except Exception:
-        return {name: False for name in names}
-
-
-
-
-
-
-
-
-
-
-
-def _room_image_url(db_key, static_path):
-    """Return serve_image URL if uploaded to DB, otherwise the static file URL."""
-    from django.urls import reverse
-    from django.templatetags.static import static
-    if _db_image_exists(db_key):
-        return reverse('serve_image', args=[db_key])
-    return static(static_path)
-
-
-def _get_room_images():
-    """Return resolved URLs for all 5 room images."""
-    return {
-        'single_bed': _room_image_url('room-single-bed', 'images/single bed.png'),
-        'double':     _room_image_url('room-double',      'images/double room.png'),
-        'window':     _room_image_url('room-window',      'images/window room.png'),
-        'balcony':    _room_image_url('room-balcony',     'images/balcony.png'),
-        'condotel':   _room_image_url('room-condotel',    'images/condotel.png'),
-    }
-
-
 # Create your views here.
 def get_home(request):
     
@@ -108,23 +61,14 @@ def get_home(request):
     # Get available room types with pricing from database
     room_types = HotelService.get_available_room_types()
 
-    # Resolve image sources: DB if uploaded, otherwise mark as static fallback
-    db_images = _db_images_exist(['hero', 'food-1', 'img-1', 'reserve-bg'])
-    db_images = {
-        'hero':       db_images.get('hero', False),
-        'food_1':     db_images.get('food-1', False),
-        'img_1':      db_images.get('img-1', False),
-        'reserve_bg': db_images.get('reserve-bg', False),
-    }
-
     return render(request, 'home.html', {
         'active_page': 'home',
         
         
         
         'room_types': room_types,
-        'db_images': db_images,
-        'room_images': _get_room_images(),
+        'page_images': ImageService.page_images(),
+        'room_images': ImageService.room_images(),
         })
 
 def get_about(request):
@@ -132,17 +76,10 @@ def get_about(request):
     
     
     
-    # Resolve image sources: DB if uploaded, otherwise static
-    db_images = _db_images_exist(['food-1', 'img-1'])
-    db_images = {
-        'food_1': db_images.get('food-1', False),
-        'img_1':  db_images.get('img-1', False),
-    }
-
     return render(request, 'about.html', {
         'active_page': 'about',
-        'db_images': db_images,
-        'room_images': _get_room_images(),
+        'page_images': ImageService.page_images(),
+        'room_images': ImageService.room_images(),
         })
 
 @ratelimit(key='ip', rate='5/m', method='POST', block=True)
@@ -293,7 +230,7 @@ def get_rooms(request):
         
         
         'room_types': room_types,
-        'room_images': _get_room_images(),
+        'room_images': ImageService.room_images(),
         })
 
 @ratelimit(key='ip', rate='3/m', method='POST', block=True)
@@ -377,6 +314,28 @@ def validate_discount_code(request):
     return JsonResponse({'valid': False, 'message': 'Invalid request.'}, status=400)
 
 
+@ratelimit(key='ip', rate='30/m', method='GET', block=True)
+def availability_calendar(request):
+    """AJAX endpoint: free rooms per type per night, for greying out sold-out
+    dates in the reservation datepicker. ?start=YYYY-MM-DD&end=YYYY-MM-DD,
+    end exclusive."""
+    if request.method != 'GET':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request.'}, status=400)
+    try:
+        start = date.fromisoformat(request.GET.get('start', ''))
+        end = date.fromisoformat(request.GET.get('end', ''))
+        calendar = RoomService.availability_calendar(start, end)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Dates must be YYYY-MM-DD.'}, status=400)
+    except ValidationError as exc:
+        return JsonResponse({'status': 'error', 'message': exc.message}, status=400)
+    return JsonResponse({
+        'status': 'success',
+        'nights': [night.isoformat() for night in calendar['nights']],
+        'room_types': calendar['room_types'],
+    })
+
+
 def unsubscribe_view(request, token):
     """Token-based unsubscribe. GET shows a confirm screen; POST acts."""
     from data.repos.repositories import EmailRepository
@@ -641,62 +600,17 @@ def register_view(request):
 def admin_reservations(request):
     """
     Admin dashboard view to display all customer reservations.
-    Shows statistics and a filterable table of bookings with pagination.
+    Shows statistics and a filterable table of bookings, filled in by
+    admin_reservations_api.
     Requires user to be logged in and have staff/admin role.
     """
     # Get available room types from database
     room_types = HotelService.get_available_room_types()
     
-    # Get all reservations, ordered by most recent first
-    all_reservations = CustomerBookingInfo.objects.all().select_related('hotel')
-    
-    # Calculate statistics
+    # The table itself loads a page at a time from admin_reservations_api.
     today = date.today()
-    
-    total_reservations = all_reservations.count()
-    
-    # Check-ins happening today
-    today_checkins = all_reservations.filter(check_in=today).count()
-    
-    # Check-outs happening today
-    today_checkouts = all_reservations.filter(check_out=today).count()
-    
-    # Upcoming reservations (check-in date is in the future)
-    upcoming_reservations = all_reservations.filter(check_in__gt=today).count()
-    
-    # Currently checked in (check-in date is today or past, check-out date is today or future)
-    currently_checked_in = all_reservations.filter(
-        check_in__lte=today,
-        check_out__gte=today
-    ).count()
-    
-    # Calculate today's revenue (bookings made today)
-    total_revenue = all_reservations.filter(booking_date__date=today).aggregate(
-        total=Sum('total_price')
-    )['total'] or 0
-    
-    page = request.GET.get('page', 1)
-    paginator = Paginator(all_reservations, 200)
-    
-    try:
-        reservations = paginator.page(page)
-    except PageNotAnInteger:
-        # If page is not an integer, deliver first page
-        reservations = paginator.page(1)
-    except EmptyPage:
-        # If page is out of range, deliver last page
-        reservations = paginator.page(paginator.num_pages)
-    
-    # Prepare context data
     context = {
-        
-        'reservations': reservations,
-        'total_reservations': total_reservations,
-        'today_checkins': today_checkins,
-        'today_checkouts': today_checkouts,
-        'currently_checked_in': currently_checked_in,
-        'upcoming_reservations': upcoming_reservations,
-        'total_revenue': total_revenue,
+        **ReservationService.dashboard_stats(today),
         'today': today,
         'room_types': room_types,
     }
@@ -704,11 +618,27 @@ def admin_reservations(request):
     return render(request, 'admin_reservations.html', context)
 
 
+@login_required
+@user_passes_test(is_staff_or_admin, login_url='/accounts/login/')
+def admin_reservations_api(request):
+    """AJAX endpoint: one keyset page of the reservations table, filtered
+    server-side. See ReservationService.reservation_page for the query
+    parameters; pass the response's `next` back as ?cursor= for the page
+    after."""
+    if request.method != 'GET':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request.'}, status=400)
+    try:
+        page = ReservationService.reservation_page(request.GET, date.today())
+    except ValidationError as exc:
+        return JsonResponse({'status': 'error', 'message': exc.message}, status=400)
+    return JsonResponse({'status': 'success', **page})
+
+
 @login_required
 @user_passes_test(is_staff_or_admin, login_url='/accounts/login/')
 def room_dashboard(request):
     """Room status dashboard showing all physical rooms grouped by floor."""
-    from data.models import Room, RoomAssignment
+    from data.models import Room
 
     # Handle status update via POST (staff/admin changes a room's status)
     if request.method == 'POST':
@@ -731,6 +661,7 @@ def room_dashboard(request):
                 elif new_status == 'out_of_order':
                     room.housekeeping_status = 'out_of_order'
                 room.save()
+                RoomAvailabilityIndex.record_room(room)
                 if request.headers.get('x-requested-with') == 'XMLHttpRequest':
                     return JsonResponse({'status': 'ok'})
                 messages.success(request, f'Room {room.room_code} updated status.')
@@ -740,66 +671,71 @@ def room_dashboard(request):
                 messages.error(request, 'Room not found.')
         return redirect('room_dashboard')
 
-    # Build room data with active assignments
-    rooms = Room.objects.select_related('hotel').order_by('floor_number', 'room_number')
-
-    # Pre-fetch active assignments with their bookings
-    active_assignments = RoomAssignment.objects.filter(
-        status='active'
-    ).select_related('booking', 'room')
-
-    assignment_map = {}
-    for a in active_assignments:
-        assignment_map[a.room_id] = a
-
-    # Group rooms by floor
+    # Built from the shared snapshot (backend/room_snapshot.py); the page
+    # then asks room_dashboard_changes for what changed after `version`.
+    version, cards = room_snapshot.cards(date.today())
     floors = {}
-    status_counts = {
-        'vacant': 0, 'dirty': 0, 'occupied': 0, 'out_of_order': 0, 'reserved': 0,
-    }
-    for room in rooms:
-        assignment = assignment_map.get(room.room_id)
-        duration = None
-        if assignment:
-            duration = (assignment.check_out - assignment.check_in).days
-
-        # Mapping to old format for UI rendering
-        from datetime import date
-        today = date.today()
-        disp_status = room.reservation_status # defaults to vacant/occupied/reserved
-        if room.housekeeping_status == 'out_of_order':
-            disp_status = 'out_of_order'
-        elif assignment and assignment.check_in <= today <= assignment.check_out:
-            disp_status = 'occupied'
-        elif assignment and assignment.check_in > today:
-            disp_status = 'reserved'
-        elif room.reservation_status == 'vacant' and room.housekeeping_status == 'dirty':
-            disp_status = 'dirty'
-        elif room.reservation_status == 'vacant':
-            disp_status = 'vacant'
-        
-        status_counts[disp_status] = status_counts.get(disp_status, 0) + 1
+    status_counts = dict.fromkeys(room_snapshot.STATUSES, 0)
+    for item in cards:
+        status_counts[item['disp_status']] = status_counts.get(item['disp_status'], 0) + 1
+        floors.setdefault(item['floor_number'], []).append(item)
 
-        room_data = {
-            'room': room,
-            'assignment': assignment,
-            'duration': duration,
-            'disp_status': disp_status, # Include disp_status
-        }
-        floors.setdefault(room.floor_number, []).append(room_data)
-            
     status_filter = request.GET.get('status', 'all')
 
     context = {
-        'floors': dict(sorted(floors.items())),
+        'floors': floors,
         'status_counts': status_counts,
-        'total_rooms': len(rooms),
+        'total_rooms': len(cards),
         'status_filter': status_filter,
+        'version': version,
+        # Without a stream to listen to (WSGI) the page polls for changes.
+        'room_events': isinstance(request, ASGIRequest),
+        'poll_seconds': getattr(settings, 'ROOM_DASHBOARD_POLL_SECONDS', 15),
         'hotel': HotelService.get_hotel_info(),
     }
     return render(request, 'room_dashboard.html', context)
 
 
+@login_required
+@user_passes_test(is_staff_or_admin, login_url='/accounts/login/')
+def room_dashboard_changes(request):
+    """AJAX endpoint: the room cards changed after ?since=<version>, as
+    returned by room_snapshot.changes_since."""
+    try:
+        since = int(request.GET.get('since', ''))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'since must be a version number.'}, status=400)
+    changes = room_snapshot.changes_since(since, date.today())
+    # As a string: versions are seeded from the clock, past what a
+    # JavaScript number holds exactly.
+    changes['version'] = None if changes['version'] is None else str(changes['version'])
+    return JsonResponse({'status': 'success', **changes})
+
+
+@login_required
+@user_passes_test(is_staff_or_admin, login_url='/accounts/login/')
+async def room_dashboard_events(request):
+    """Server-Sent Events: each room change as it happens (see
+    backend/room_events.py), after those since ?since=<version>, or since
+    the Last-Event-ID a reconnecting EventSource sends.
+
+    Only under ASGI. A WSGI worker would be held for as long as the stream
+    is open, so there the answer is 204, which tells EventSource not to
+    reconnect, and the page polls room_dashboard_changes instead."""
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    since = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    try:
+        since = int(since) if since else None
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'since must be a version number.'}, status=400)
+    response = StreamingHttpResponse(room_events.stream(since), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Tell nginx not to buffer it.
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @login_required
 @user_passes_test(is_staff_or_admin, login_url='/accounts/login/')
 def view_reservation(request, booking_id):
@@ -1036,7 +972,7 @@ def email_log(request):
     email_type = request.GET.get('type') or None
 
     qs = EmailQueue.objects.all().order_by('-created_at')
-    if status in ('sent', 'failed'):
+    if status in ('pending', 'sending', 'retrying', 'sent', 'failed', 'dead'):
         qs = qs.filter(status=status)
     if email_type:
         qs = qs.filter(email_type=email_type)
@@ -1052,8 +988,9 @@ def email_log(request):
 
     stats = {
         'total': EmailQueue.objects.count(),
+        'pending': EmailQueue.objects.filter(status__in=('pending', 'sending')).count(),
         'sent': EmailQueue.objects.filter(status='sent').count(),
-        'failed': EmailQueue.objects.filter(status='failed').count(),
+        'failed': EmailQueue.objects.filter(status__in=('failed', 'retrying', 'dead')).count(),
     }
 
     return render(request, 'admin_email_log.html', {
@@ -1182,7 +1119,8 @@ def email_campaign_edit(request, campaign_id=None):
 @login_required
 @user_passes_test(is_staff_or_admin, login_url='/accounts/login/')
 def email_campaign_send(request, campaign_id):
-    """Send a draft campaign to all active subscribers."""
+    """Start sending a draft campaign to all active subscribers. The send
+    runs in the background; the campaigns page polls its progress."""
     if request.method != 'POST':
         return JsonResponse({'status': 'error', 'message': 'POST only'}, status=405)
 
@@ -1191,6 +1129,7 @@ def email_campaign_send(request, campaign_id):
     if not campaign:
         messages.error(request, 'Campaign not found.')
         return redirect('email_campaigns')
+
     if campaign.status != 'draft':
         messages.error(request, 'Only drafts can be sent.')
         return redirect('email_campaigns')
@@ -1199,24 +1138,40 @@ def email_campaign_send(request, campaign_id):
     if result:
         messages.success(
             request,
-            f'Campaign "{result.name}" sent: {result.sent_count} delivered, '
-            f'{result.failed_count} failed (of {result.recipient_count} recipients).'
+            f'Campaign "{result.name}" is sending to {result.recipient_count} '
+            f'subscriber{pluralize(result.recipient_count)}. Progress updates below.'
         )
     else:
         messages.error(request, 'Campaign send failed. Check server logs.')
     return redirect('email_campaigns')
 
 
+@login_required
+@user_passes_test(is_staff_or_admin, login_url='/accounts/login/')
+def email_campaign_progress(request, campaign_id):
+    """Live counters of a campaign, polled by the campaigns page while it
+    is sending."""
+    from data.repos.repositories import EmailRepository
+    campaign = EmailRepository.get_campaign(campaign_id)
+    if not campaign:
+        return JsonResponse({'status': 'error', 'message': 'Campaign not found'}, status=404)
+    return JsonResponse({
+        'status': 'success',
+        'campaign_status': campaign.status,
+        'recipient_count': campaign.recipient_count,
+        'sent_count': campaign.sent_count,
+        'failed_count': campaign.failed_count,
+        'sent_at': campaign.sent_at.isoformat() if campaign.sent_at else None,
+    })
+
+
 @login_required
 @user_passes_test(is_staff_or_admin, login_url='/accounts/login/')
 @require_POST
 def upload_image(request):
-    """Handle image upload for admin users — saves binary data to the ImagesRef DB table."""
+    """Handle image upload for admin users — saves the upload and queues it
+    for the image pipeline, which writes its variants to image storage."""
     try:
-        from PIL import Image
-        from io import BytesIO
-        from data.models.images import ImagesRef
-
         image_file = request.FILES.get('image')
         image_id = request.POST.get('image_id')
 
@@ -1235,31 +1190,20 @@ def upload_image(request):
         if image_file.content_type not in allowed_types:
             return JsonResponse({'status': 'error', 'message': 'Invalid file type. Only JPG, PNG, and GIF are allowed'}, status=400)
 
-        # Open, convert, and compress with Pillow
-        img = Image.open(image_file)
-        if img.mode in ('RGBA', 'LA', 'P'):
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode in ('P', 'LA'):
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1])
-            img = background
-
-        buffer = BytesIO()
-        img.save(buffer, 'JPEG', quality=85, optimize=True)
-        image_bytes = buffer.getvalue()
-
-        # Upsert: update if name exists, otherwise insert
-        obj, created = ImagesRef.objects.update_or_create(
-            ImageName=image_id,
-            defaults={
-                'ImageData': image_bytes,
-                'ImageContentType': 'image/jpeg',
-            }
-        )
+        # Saved as uploaded; the resized JPEG and WebP variants are made in
+        # the background (backend/image_pipeline.py). The page polls
+        # status_url until they are ready.
+        from django.urls import reverse
+        try:
+            ImageService.queue_upload(image_id, image_file.read())
+        except ValidationError as exc:
+            return JsonResponse({'status': 'error', 'message': exc.message}, status=400)
 
         return JsonResponse({
             'status': 'success',
-            'message': f'Image "{image_id}" saved to database successfully!',
+            'message': f'Image "{image_id}" uploaded. Processing...',
+            'image_status': 'pending',
+            'status_url': reverse('image_status', args=[image_id]),
         })
 
     except Exception as e:
@@ -1267,16 +1211,122 @@ def upload_image(request):
         return JsonResponse({'status': 'error', 'message': 'Image upload failed. Please try again.'}, status=500)
 
 
-def serve_image(request, image_name):
-    """Serve an image stored as binary in the ImagesRef table."""
-    from django.http import HttpResponse, Http404
-    from data.models.images import ImagesRef
+@login_required
+@user_passes_test(is_staff_or_admin, login_url='/accounts/login/')
+def image_status(request, image_name):
+    """Pipeline status of an upload, polled by the upload dialog:
+    pending, processing, ready or failed."""
+    status = ImageService.status(image_name)
+    if status is None:
+        return JsonResponse({'status': 'error', 'message': 'No such image'}, status=404)
+    return JsonResponse({'status': 'success', 'image_status': status})
+
+
+# A URL carrying the current hash (?v=, see ImageService.image_url) names one
+# exact file, so browsers may keep it for a year without asking again. A bare
+# or stale URL must revalidate, which the ETag makes a 304 with no body.
+IMAGE_IMMUTABLE_CACHE_SECONDS = 365 * 24 * 60 * 60
+
+
+def _parse_byte_range(header, length):
+    """(start, end) half-open for a single-range `Range: bytes=...` header.
+
+    None means serve the whole image: no header, a unit other than bytes, or
+    several ranges (allowed by RFC 9110 and not worth a multipart body for an
+    image). ValueError means no part of the range falls inside the image: 416.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, dash, last = spec.strip().partition('-')
+    if not dash:
+        return None
     try:
-        img = ImagesRef.objects.get(ImageName=image_name)
-        return HttpResponse(bytes(img.ImageData), content_type=img.ImageContentType)
-    except ImagesRef.DoesNotExist:
+        if first:
+            start = int(first)
+            if last and int(last) < start:
+                return None  # Malformed; RFC 9110 says ignore it.
+            end = min(int(last) + 1, length) if last else length
+        else:
+            # bytes=-N: the last N bytes.
+            start, end = max(length - int(last), 0), length
+    except ValueError:
+        return None
+    if start < 0 or start >= end:
+        raise ValueError(header)
+    return start, end
+
+
+def serve_image(request, image_name):
+    """Serve an image stored as binary in the ImagesRef table.
+
+    The row is read without ImageData first. If the browser already has this
+    version (If-None-Match matches ImageHash) the answer is a 304 and the
+    VARBINARY(MAX) column is never read. Otherwise the bytes are streamed a
+    chunk at a time (ImageRepository.iter_data, or aiter_data under ASGI)
+    rather than loaded whole, and a single byte range is honoured.
+    """
+    from django.http import HttpResponse, Http404, StreamingHttpResponse
+    from django.utils.cache import get_conditional_response, patch_cache_control
+    from django.utils.http import quote_etag
+    from data.repos.repositories import ImageRepository
+
+    img = ImageRepository.get_metadata(image_name)
+    if img is None:
+        raise Http404
+    if img.ImageWidths:
+        # Moved to image storage. Old links (emails, bookmarks) still work.
+        from backend.image_storage import parse_widths, variant_url
+        return redirect(variant_url(img.ImageHash, max(parse_widths(img.ImageWidths)), 'jpeg'))
+    if img.ImageLength is None:
         raise Http404
 
+    etag = quote_etag(img.ImageHash) if img.ImageHash else None
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        length = img.ImageLength
+        byte_range = None
+        # If-Range: only resume a download of the same image.
+        if_range = request.headers.get('If-Range')
+        if if_range is None or (etag and if_range == etag):
+            try:
+                byte_range = _parse_byte_range(request.headers.get('Range'), length)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{length}'
+                return response
+
+        start, end = byte_range or (0, length)
+        if request.method == 'HEAD':
+            response = HttpResponse(content_type=img.ImageContentType)
+        else:
+            iter_data = (
+                ImageRepository.aiter_data if isinstance(request, ASGIRequest)
+                else ImageRepository.iter_data
+            )
+            response = StreamingHttpResponse(
+                iter_data(img.ImageId, img.ImageHash, start, end),
+                content_type=img.ImageContentType,
+            )
+        response['Content-Length'] = str(end - start)
+        response['Accept-Ranges'] = 'bytes'
+        if byte_range:
+            response.status_code = 206
+            response['Content-Range'] = f'bytes {start}-{end - 1}/{length}'
+
+    if etag:
+        response['ETag'] = etag
+    version = request.GET.get('v')
+    if version and version == ImageService.url_version(img.ImageHash):
+        patch_cache_control(
+            response, public=True, max_age=IMAGE_IMMUTABLE_CACHE_SECONDS, immutable=True,
+        )
+    else:
+        patch_cache_control(response, public=True, no_cache=True)
+    return response
+
 
 @login_required
 @user_passes_test(is_admin, login_url='/accounts/login/')
@@ -219,6 +219,50 @@ STORAGES = {
     },
 }
 
+# ---------- Uploaded images ----------
+# Admin uploads are written as resized JPEG/WebP files (backend/image_storage.py)
+# to the `images` storage rather than into ImagesRef.ImageData. Locally that is
+# MEDIA_ROOT/images, which the front web server must serve at MEDIA_URL
+# (Django does it only when DEBUG; see site1/urls.py). The file names are
+# content hashes, so serve that location with
+#   Cache-Control: public, max-age=31536000, immutable
+MEDIA_URL = os.getenv('MEDIA_URL', '/media/')
+MEDIA_ROOT = Path(os.getenv('MEDIA_ROOT', BASE_DIR / 'media'))
+STORAGES['images'] = {
+    'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    'OPTIONS': {
+        'location': MEDIA_ROOT / 'images',
+        'base_url': MEDIA_URL + 'images/',
+    },
+}
+
+# Or an S3-compatible bucket. Needs django-storages[s3], which is not in
+# requirements.txt: install it where the bucket is set. Credentials come from
+# the usual AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY. Point
+# IMAGE_STORAGE_ENDPOINT_URL at a local MinIO to try it without AWS.
+IMAGE_STORAGE_BUCKET = os.getenv('IMAGE_STORAGE_BUCKET')
+IMAGE_STORAGE_ENDPOINT_URL = os.getenv('IMAGE_STORAGE_ENDPOINT_URL') or None
+IMAGE_STORAGE_CUSTOM_DOMAIN = os.getenv('IMAGE_STORAGE_CUSTOM_DOMAIN') or None
+if IMAGE_STORAGE_BUCKET:
+    STORAGES['images'] = {
+        'BACKEND': 'storages.backends.s3.S3Storage',
+        'OPTIONS': {
+            'bucket_name': IMAGE_STORAGE_BUCKET,
+            'endpoint_url': IMAGE_STORAGE_ENDPOINT_URL,
+            'custom_domain': IMAGE_STORAGE_CUSTOM_DOMAIN,
+            'location': 'images',
+            # Public, unsigned URLs: signed ones change on every render and
+            # could never be cached.
+            'querystring_auth': False,
+            'default_acl': 'public-read',
+            'file_overwrite': True,
+            'object_parameters': {'CacheControl': 'public, max-age=31536000, immutable'},
+        },
+    }
+
+# Threads per web worker resizing uploads (backend/image_pipeline.py).
+IMAGE_PIPELINE_WORKERS = int(os.getenv('IMAGE_PIPELINE_WORKERS', '2'))
+
 # The manifest backend cannot resolve {% static %} without staticfiles.json,
 # which only collectstatic writes, so on a fresh clone every test that renders a
 # template died before reaching what it was written to check.
@@ -226,6 +270,8 @@ if 'pytest' in sys.modules:
     STORAGES['staticfiles']['BACKEND'] = (
         'django.contrib.staticfiles.storage.StaticFilesStorage'
     )
+    # And uploads must not land in the working tree.
+    STORAGES['images'] = {'BACKEND': 'django.core.files.storage.InMemoryStorage'}
 
 # Login/Logout URLs
 LOGIN_URL = '/accounts/login/'
@@ -241,6 +287,42 @@ PASSWORD_RESET_TIMEOUT = 3600
 HOTEL_DEFAULT_PHONE = os.getenv('HOTEL_DEFAULT_PHONE', '+63 900 000 0000')
 HOTEL_DEFAULT_EMAIL = os.getenv('HOTEL_DEFAULT_EMAIL', 'info@hotelbooking.local')
 
+# Which free room RoomService.allocate_room hands a booking. Dotted path to a
+# ranking function; see backend/allocation.py for the ones provided.
+ROOM_ALLOCATION_STRATEGY = os.getenv('ROOM_ALLOCATION_STRATEGY', 'backend.allocation.best_fit')
+
+# ---------- Cache ----------
+# Per-process LocMemCache unless CACHE_REDIS_URL is set. Anything that must
+# agree across gunicorn workers (room rates, django-ratelimit counters) only
+# does so on a shared backend, so set it in any multi-worker deployment.
+# Django's RedisCache needs the `redis` package, which is not in
+# requirements.txt: install it where the URL is set.
+if os.getenv('CACHE_REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_REDIS_URL'),
+            'KEY_PREFIX': 'hotel',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# ---------- Room dashboard live updates ----------
+# Room status changes are pushed to open dashboards over Server-Sent Events
+# (backend/room_events.py) when the app is served by an ASGI server
+# (site1.asgi:application). Under WSGI there are no streams, and dashboards
+# poll for changes every ROOM_DASHBOARD_POLL_SECONDS instead.
+# Events reach only the streams in the process that made the change unless
+# they go through Redis pub/sub: set ROOM_EVENTS_REDIS_URL (defaults to
+# CACHE_REDIS_URL) in any multi-process deployment.
+ROOM_EVENTS_REDIS_URL = os.getenv('ROOM_EVENTS_REDIS_URL', os.getenv('CACHE_REDIS_URL', ''))
+ROOM_DASHBOARD_POLL_SECONDS = int(os.getenv('ROOM_DASHBOARD_POLL_SECONDS', '15'))
+
 # ---------- Email (Gmail SMTP via django.core.mail) ----------
 # Use SMTP whenever Gmail credentials are present (even in DEBUG).
 # Falls back to console-only when no credentials are configured.
@@ -262,7 +344,7 @@ EMAIL_PORT = int(os.getenv('EMAIL_PORT', '587'))
 EMAIL_USE_TLS = True
 EMAIL_HOST_USER = os.getenv('GMAIL_FROM_EMAIL', '')
 EMAIL_HOST_PASSWORD = os.getenv('GMAIL_APP_PASSWORD', '')
-EMAIL_TIMEOUT = 15  # seconds — fail fast rather than hanging the request
+EMAIL_TIMEOUT = 15  # seconds — per SMTP call, in the outbox worker (requests no longer send)
 
 DEFAULT_FROM_EMAIL = os.getenv(
     'DEFAULT_FROM_EMAIL',
@@ -276,6 +358,38 @@ SITE_BASE_URL = os.getenv('SITE_BASE_URL', 'http://localhost:8000')
 # Email queue retention (days) — used by retry_failed_emails cleanup pass.
 EMAIL_QUEUE_RETENTION_DAYS = int(os.getenv('EMAIL_QUEUE_RETENTION_DAYS', '90'))
 
+# Email outbox (backend/email_outbox.py). EmailService only queues; these
+# control how queued mail is sent. EMAIL_OUTBOX_IN_PROCESS drains from a
+# thread in the web worker after each commit; turn it off where
+# `manage.py run_email_worker` runs instead. A failed send is retried after
+# EMAIL_RETRY_BASE_SECONDS, doubling each time up to EMAIL_RETRY_MAX_SECONDS,
+# until EMAIL_MAX_ATTEMPTS. `manage.py retry_failed_emails` keeps retrying
+# failed rows on the same backoff until EMAIL_DEAD_LETTER_ATTEMPTS in all,
+# then marks them dead. EMAIL_SEND_LEASE_SECONDS is how long a claimed row may
+# sit in 'sending' (or 'retrying') before another worker takes it over.
+EMAIL_OUTBOX_IN_PROCESS = os.getenv('EMAIL_OUTBOX_IN_PROCESS', 'True').lower() == 'true'
+EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', '5'))
+EMAIL_DEAD_LETTER_ATTEMPTS = int(os.getenv('EMAIL_DEAD_LETTER_ATTEMPTS', '10'))
+EMAIL_RETRY_BASE_SECONDS = int(os.getenv('EMAIL_RETRY_BASE_SECONDS', '60'))
+EMAIL_RETRY_MAX_SECONDS = int(os.getenv('EMAIL_RETRY_MAX_SECONDS', str(6 * 60 * 60)))
+EMAIL_SEND_LEASE_SECONDS = int(os.getenv('EMAIL_SEND_LEASE_SECONDS', '600'))
+
+# Campaign sends (backend/campaign_dispatch.py) run in the background,
+# EMAIL_CAMPAIGN_BATCH subscribers at a time, spread over
+# EMAIL_CAMPAIGN_CONNECTIONS parallel SMTP connections and held to
+# EMAIL_CAMPAIGN_RATE messages a second in total (0 = unlimited; Gmail allows
+# far less than a dedicated relay). The send log is bulk-inserted and the
+# checkpoint written once EMAIL_CAMPAIGN_LOG_FLUSH recipients are waiting, or
+# a third of EMAIL_CAMPAIGN_LEASE_SECONDS after the last one. A campaign whose
+# job has not checkpointed for EMAIL_CAMPAIGN_LEASE_SECONDS is taken over by
+# `manage.py send_campaigns`, so keep one batch's worth of sending
+# (EMAIL_CAMPAIGN_BATCH / EMAIL_CAMPAIGN_RATE seconds) well inside it.
+EMAIL_CAMPAIGN_BATCH = int(os.getenv('EMAIL_CAMPAIGN_BATCH', '100'))
+EMAIL_CAMPAIGN_CONNECTIONS = int(os.getenv('EMAIL_CAMPAIGN_CONNECTIONS', '2'))
+EMAIL_CAMPAIGN_RATE = float(os.getenv('EMAIL_CAMPAIGN_RATE', '10'))
+EMAIL_CAMPAIGN_LOG_FLUSH = int(os.getenv('EMAIL_CAMPAIGN_LOG_FLUSH', '300'))
+EMAIL_CAMPAIGN_LEASE_SECONDS = int(os.getenv('EMAIL_CAMPAIGN_LEASE_SECONDS', '300'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -373,6 +487,14 @@ CONTENT_SECURITY_POLICY_REPORT_ONLY = {
     },
 }
 
+# Uploaded images in a bucket (IMAGE_STORAGE_BUCKET above) come from another
+# origin.
+if IMAGE_STORAGE_BUCKET:
+    CONTENT_SECURITY_POLICY_REPORT_ONLY['DIRECTIVES']['img-src'].append(
+        f'https://{IMAGE_STORAGE_CUSTOM_DOMAIN}' if IMAGE_STORAGE_CUSTOM_DOMAIN
+        else IMAGE_STORAGE_ENDPOINT_URL or f'https://{IMAGE_STORAGE_BUCKET}.s3.amazonaws.com'
+    )
+
 # ---------- Logging ----------
 # Console for dev, rotating file for anything long-lived. Root is INFO;
 # django.db.backends is pinned to WARNING because at DEBUG it logs every single
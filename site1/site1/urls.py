@@ -14,6 +14,8 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 from django.http import JsonResponse, HttpResponse
@@ -26,6 +28,10 @@ urlpatterns = [
     path('', include('home.urls')),
 ]
 
+# Uploaded images in local storage. Production serves MEDIA_URL from the web
+# server; static() returns no patterns unless DEBUG.
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
 def handler403(request, exception=None):
     """Return a friendly response when rate limit is exceeded."""
     if isinstance(exception, Ratelimited):
@@ -22,6 +22,7 @@ GO
 -- IF OBJECT_ID('email_queue', 'U')           IS NOT NULL DROP TABLE email_queue;
 -- IF OBJECT_ID('email_campaigns', 'U')       IS NOT NULL DROP TABLE email_campaigns;
 -- IF OBJECT_ID('email_subscribers', 'U')     IS NOT NULL DROP TABLE email_subscribers;
+-- IF OBJECT_ID('booking_search_terms', 'U')  IS NOT NULL DROP TABLE booking_search_terms;
 -- IF OBJECT_ID('room_assignments', 'U')      IS NOT NULL DROP TABLE room_assignments;
 -- IF OBJECT_ID('room_maintenance_logs', 'U') IS NOT NULL DROP TABLE room_maintenance_logs;
 -- IF OBJECT_ID('rooms', 'U')                 IS NOT NULL DROP TABLE rooms;
@@ -175,6 +176,23 @@ CREATE TABLE booking_info (
 );
 GO
 
+-- Guest search index: normalised name words, email, phone digits and name
+-- trigrams per booking; see data/repos/guest_search.py.
+CREATE TABLE booking_search_terms (
+    search_term_id INT IDENTITY(1,1) NOT NULL
+        CONSTRAINT pk_booking_search_terms PRIMARY KEY NONCLUSTERED,
+    booking_id     INT NOT NULL
+        CONSTRAINT fk_booking_search_terms_booking REFERENCES booking_info(booking_id)
+        ON DELETE CASCADE,
+    kind           CHAR(1) NOT NULL
+        CONSTRAINT chk_booking_search_terms_kind CHECK (kind IN ('w','e','p','r','g')),
+    term           NVARCHAR(64) NOT NULL
+);
+GO
+CREATE UNIQUE CLUSTERED INDEX ix_booking_search_terms_term ON booking_search_terms (kind, term, booking_id);
+CREATE INDEX ix_booking_search_terms_booking ON booking_search_terms (booking_id);
+GO
+
 CREATE TABLE room_assignments (
     assignment_id INT IDENTITY(1,1) PRIMARY KEY,
     booking_id    INT NOT NULL,
@@ -239,8 +257,14 @@ GO
 CREATE TABLE ImagesRef (
     ImageId          INT IDENTITY(1,1) PRIMARY KEY,
     ImageName        NVARCHAR(100) NOT NULL UNIQUE,
-    ImageData        VARBINARY(MAX) NOT NULL,
-    ImageContentType NVARCHAR(50) NOT NULL DEFAULT 'image/jpeg'
+    ImageData        VARBINARY(MAX) NULL,  -- legacy inline copy; NULL once the image is in file storage
+    ImageContentType NVARCHAR(50) NOT NULL DEFAULT 'image/jpeg',
+    ImageHash        CHAR(64) NULL,        -- sha256 hex of the upload; ETag, URL version and storage key
+    ImageWidths      NVARCHAR(100) NULL,   -- widths stored in file storage, e.g. '480,960,1600'
+    ImagePendingHash CHAR(64) NULL,        -- upload saved but not yet processed into variants
+    ImageStatus      NVARCHAR(20) NULL,    -- pending / processing / ready / failed; NULL = ready
+    CONSTRAINT chk_image_status
+        CHECK (ImageStatus IN ('pending','processing','ready','failed'))
 );
 GO
 
@@ -282,11 +306,17 @@ CREATE TABLE email_campaigns (
     body_html       NVARCHAR(MAX) NOT NULL,
     body_text       NVARCHAR(MAX) NULL,
     status          NVARCHAR(20) NOT NULL DEFAULT 'draft'
-        CHECK (status IN ('draft','sent','cancelled')),
+        CONSTRAINT chk_email_campaigns_status CHECK (status IN ('draft','sending','sent','cancelled')),
     sent_at         DATETIME NULL,
     recipient_count INT NOT NULL DEFAULT 0,
     sent_count      INT NOT NULL DEFAULT 0,
     failed_count    INT NOT NULL DEFAULT 0,
+    -- Background send (backend/campaign_dispatch.py): subscribers go out in
+    -- id order, last_subscriber_id is the checkpoint a resumed job starts
+    -- after, heartbeat_at tells a live job from a dead one.
+    started_at         DATETIME NULL,
+    last_subscriber_id INT NULL,
+    heartbeat_at       DATETIME NULL,
     created_by      INT NULL,
     created_at      DATETIME DEFAULT GETDATE(),
     updated_at      DATETIME DEFAULT GETDATE(),
@@ -302,12 +332,18 @@ CREATE TABLE email_queue (
     template_name   NVARCHAR(100) NULL,
     email_type      NVARCHAR(50) NOT NULL,
     status          NVARCHAR(20) NOT NULL DEFAULT 'sent'
-        CHECK (status IN ('sent','failed')),
+        CONSTRAINT chk_email_queue_status CHECK (status IN ('pending','sending','retrying','sent','failed','dead')),
     attempts        INT NOT NULL DEFAULT 1,
     error_message   NVARCHAR(MAX) NULL,
     provider_msg_id NVARCHAR(255) NULL,
     created_at      DATETIME DEFAULT GETDATE(),
     sent_at         DATETIME NULL,
+    -- Outbox payload and scheduling; see backend/email_outbox.py.
+    body_html       NVARCHAR(MAX) NULL,
+    body_text       NVARCHAR(MAX) NULL,
+    headers         NVARCHAR(MAX) NULL,  -- JSON object of extra headers
+    next_attempt_at DATETIME NULL,
+    locked_at       DATETIME NULL,       -- when a worker claimed a 'sending' row
     user_id         INT NULL,
     related_type    NVARCHAR(50) NULL,
     related_id      INT NULL,
@@ -319,6 +355,7 @@ GO
 
 CREATE INDEX ix_email_queue_status_created ON email_queue (status, created_at DESC);
 CREATE INDEX ix_email_queue_related        ON email_queue (related_type, related_id);
+CREATE INDEX ix_email_queue_outbox         ON email_queue (status, next_attempt_at);
 GO
 
 